@@ -0,0 +1,111 @@
+"""
+Time a 12 month balance forecast of a large canvas with minute-granularity
+schedules, against cascading every event one by one, and check both give
+the same balances.
+
+Needs a migrated database; the canvas is created in a transaction that is
+rolled back.
+
+    python benchmarks/canvas_forecast.py [--depth N] [--width N] [--months N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings.test")
+
+import django  # noqa: E402
+
+django.setup()
+
+import numpy as np  # noqa: E402
+from django.db import transaction  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from dhanriti.models import User  # noqa: E402
+from dhanriti.models.enums import FlowRateType, FlowType  # noqa: E402
+from dhanriti.models.tanks import Canvas, Funnel, Tank  # noqa: E402
+from utils.forecast import CanvasForecast, get_sample_times, to_minutes  # noqa: E402
+
+TIMELY_RATES = ["0 * * * *", "30 9 * * *", "0 0 * * 1", "0 12 1 * *"]
+
+
+def create_canvas(depth, width):
+    random.seed(0)
+    user = User.objects.create_user(
+        email="forecast@dhanriti.net", username="forecast", password="password"
+    )
+    canvas = Canvas.objects.create(
+        name="Canvas", user=user, inflow=1000, inflow_rate="* * * * *"
+    )
+    parents = [None]
+    funnels = 0
+    for _ in range(depth):
+        level = []
+        for parent in parents:
+            for i in range(width):
+                tank = Tank.objects.create(
+                    name="Tank",
+                    canvas=canvas,
+                    capacity=random.choice([None, 10**5, 10**6, 10**7]),
+                )
+                timely = i == 0 and parent is not None
+                Funnel.objects.create(
+                    canvas=canvas,
+                    in_tank=parent,
+                    out_tank=tank,
+                    flow=random.choice([5, 10, 20]),
+                    flow_type=FlowType.ABSOLUTE if timely else FlowType.PERCENTAGE,
+                    flow_rate_type=(
+                        FlowRateType.TIMELY if timely else FlowRateType.CONSEQUENT
+                    ),
+                    flow_rate=random.choice(TIMELY_RATES) if timely else None,
+                )
+                funnels += 1
+                level.append(tank)
+        parents = level
+    return canvas, funnels
+
+
+class SteppedForecast(CanvasForecast):
+    # Never reuse an effect, so every event is cascaded
+    def find(self, effects):
+        return None
+
+
+def run(canvas, start, months, forecast_class):
+    samples = get_sample_times(start, months, "day")
+    began = time.perf_counter()
+    forecast = forecast_class(canvas.pk)
+    balances = forecast.run(start, int(samples[-1]), samples)
+    return time.perf_counter() - began, balances
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--width", type=int, default=4)
+    parser.add_argument("--months", type=int, default=12)
+    args = parser.parse_args()
+
+    with transaction.atomic():
+        canvas, funnels = create_canvas(args.depth, args.width)
+        start = to_minutes(timezone.now())
+        stepped, expected = run(canvas, start, args.months, SteppedForecast)
+        forecast, balances = run(canvas, start, args.months, CanvasForecast)
+        transaction.set_rollback(True)
+
+    error = np.abs(balances - expected).max() / max(np.abs(expected).max(), 1)
+    print(f"{funnels} funnels, inflow every minute, {args.months} months")
+    print(f"{'every event':<16} {stepped * 1000:>10.1f} ms")
+    print(f"{'forecast':<16} {forecast * 1000:>10.1f} ms")
+    print(f"{'speedup':<16} {stepped / forecast:>10.1f}x")
+    print(f"{'relative error':<16} {error:>10.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare the compiled cron expressions in utils.cron against croniter for
+validation, "is due at T" and "next fire after T".
+
+    python benchmarks/cron_expressions.py [--number N]
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings.test")
+
+import django  # noqa: E402
+
+django.setup()
+
+import croniter  # noqa: E402
+
+from utils.cron import compile_cron, get_next_fire_times  # noqa: E402
+
+EXPRESSIONS = [
+    "0 9 1 * *",
+    "*/15 * * * *",
+    "30 18 * * 1-5",
+    "0 0 1,15 * *",
+    "0 */6 * * 0,6",
+    "0 9 1 1 *",
+]
+AFTER = datetime(2024, 2, 28, 23, 59, 30, tzinfo=timezone.utc)
+
+
+def check(number):
+    # A tick over this many canvases sharing the expressions above
+    exprs = [EXPRESSIONS[i % len(EXPRESSIONS)] for i in range(number)]
+    for expr in EXPRESSIONS:
+        expected = croniter.croniter(expr, AFTER).get_next(datetime)
+        assert compile_cron(expr).next_after(AFTER) == expected, expr
+    return exprs
+
+
+def report(name, croniter_func, compiled_func):
+    before = min(timeit.repeat(croniter_func, number=1, repeat=3))
+    after = min(timeit.repeat(compiled_func, number=1, repeat=3))
+    print(
+        f"{name:<28} {before * 1000:>10.1f} {after * 1000:>10.1f}"
+        f" {before / after:>8.1f}x"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=10000)
+    args = parser.parse_args()
+    exprs = check(args.number)
+    at = AFTER + timedelta(days=2)
+
+    print(f"{'operation':<28} {'croniter ms':>10} {'compiled ms':>10} {'speedup':>9}")
+    report(
+        "validate",
+        lambda: [croniter.croniter.is_valid(expr) for expr in exprs],
+        lambda: [compile_cron(expr) for expr in exprs],
+    )
+    report(
+        "is due at T",
+        lambda: [croniter.croniter.match(expr, at) for expr in exprs],
+        lambda: [compile_cron(expr).matches(at) for expr in exprs],
+    )
+    report(
+        "next fire after T",
+        lambda: [croniter.croniter(expr, AFTER).get_next(datetime) for expr in exprs],
+        lambda: [compile_cron(expr).next_after(AFTER) for expr in exprs],
+    )
+    report(
+        "next fire, distinct per tick",
+        lambda: [croniter.croniter(expr, AFTER).get_next(datetime) for expr in exprs],
+        lambda: get_next_fire_times(exprs, AFTER),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Compare the streaming HTML validator against the previous BeautifulSoup
+implementation of verify_html on large rich-text documents.
+
+    python benchmarks/html_validation.py [--paragraphs N] [--repeat N]
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings.test")
+
+import django  # noqa: E402
+
+django.setup()
+
+from bs4 import BeautifulSoup  # noqa: E402
+from rest_framework import serializers  # noqa: E402
+
+from utils.cdn import get_file_name  # noqa: E402
+from utils.verifyHTML import validate_html  # noqa: E402
+
+TAG_RE = re.compile(r"<(/?)([a-zA-Z0-9]+)[^>]*?(/?)>")
+
+
+def check_unclosed_tags(value):
+    stack = []
+    for closing, tag, self_closing in TAG_RE.findall(value):
+        tag = tag.lower()
+        if self_closing or tag in ("br", "img"):
+            continue
+        if not closing:
+            stack.append(tag)
+        elif not stack or stack.pop() != tag:
+            return False
+    return not stack
+
+
+def validate_html_soup(value):
+    """
+    The tag/attribute/style checks of verify_html before the streaming
+    validator: a closure scan, a full parse and two tree traversals.
+    """
+    allowed_tags = ["div", "br", "i", "b", "strike", "u", "img"]
+
+    if not check_unclosed_tags(value):
+        raise serializers.ValidationError("Invalid HTML: Some tags are not closed")
+
+    soup = BeautifulSoup(value, "html.parser")
+    file_names = []
+    for tag in soup.find_all(True):
+        if tag.name not in allowed_tags:
+            raise serializers.ValidationError("Invalid HTML tag")
+        for attr in tag.attrs:
+            if attr == "src":
+                continue
+            if attr != "style":
+                raise serializers.ValidationError("Invalid HTML attribute for tag")
+        if tag.name == "img":
+            file_names.append(get_file_name(tag.get("src")))
+
+    for tag in soup.find_all(attrs={"style": True}):
+        for prop in tag["style"].split(";"):
+            if prop.strip() and not prop.strip().startswith("text-align"):
+                raise serializers.ValidationError(
+                    "Style attribute contains an invalid property"
+                )
+    return file_names
+
+
+def build_document(paragraphs):
+    parts = []
+    for i in range(paragraphs):
+        parts.append(
+            '<div style="text-align: center;">'
+            f"<b>Chapter {i}</b> some <i>italic</i> and <u>underlined</u> text"
+            " with a <strike>correction</strike> in it.<br>"
+            "</div>"
+        )
+        if i % 25 == 0:
+            parts.append(f'<img src="https://cdn.dhanriti.net/media/img{i}_x.png">')
+    return "".join(parts)
+
+
+def peak_memory(func, value):
+    tracemalloc.start()
+    func(value)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--paragraphs", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'paragraphs':>10} {'size':>10} {'impl':>10} {'best ms':>10} {'peak KiB':>10}")
+    for paragraphs in args.paragraphs:
+        value = build_document(paragraphs)
+        assert validate_html(value) == validate_html_soup(value)
+        for name, func in (("soup", validate_html_soup), ("stream", validate_html)):
+            best = min(timeit.repeat(lambda: func(value), number=1, repeat=args.repeat))
+            peak = peak_memory(func, value) / 1024
+            print(
+                f"{paragraphs:>10} {len(value):>10} {name:>10}"
+                f" {best * 1000:>10.1f} {peak:>10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
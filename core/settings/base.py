@@ -268,8 +268,46 @@ CELERY_BEAT_SCHEDULE = {
         "task": "dhanriti.tasks.cron.cron_watch",
         "schedule": crontab(minute="*/1"), # Every minute
     },
+    "flush-last-online": {
+        "task": "dhanriti.tasks.users.flush_last_online_task",
+        "schedule": crontab(minute="*/1"),
+    },
+    "ledger-snapshots": {
+        "task": "dhanriti.tasks.ledger.snapshot_balances",
+        "schedule": crontab(minute=0),  # Every hour
+    },
 }
 
+# Key the cron/<key>/ endpoint is called with. The endpoint refuses every
+# call while it is unset.
+CRON_KEY = env("CRON_KEY", default="")
+# Due canvases and funnels are streamed from the database in chunks this big
+CRON_CHUNK_SIZE = env.int("CRON_CHUNK_SIZE", default=500)
+# Due work is routed to the queues cron.0 ... cron.<CRON_PARTITIONS - 1> by
+# canvas id. Each queue needs exactly one single-process worker
+# (--concurrency=1) so a canvas runs serially while other partitions run in
+# parallel: the Procfile has a "cronN" process per partition and the
+# celerycronworker compose service starts one worker per partition. Keep
+# the queues off the general workers, and add Procfile processes when
+# raising this.
+CRON_PARTITIONS = env.int("CRON_PARTITIONS", default=4)
+CRON_QUEUE_PREFIX = env("CRON_QUEUE_PREFIX", default="cron")
+# Most missed windows a cron chunk fires per canvas inflow or timely funnel
+# when catching up after the workers were down; the rest follow on the next
+# ticks
+CRON_CATCH_UP_LIMIT = env.int("CRON_CATCH_UP_LIMIT", default=100)
+# Seconds before due work for a canvas that was busy is retried
+CRON_BUSY_RETRY_DELAY = env.int("CRON_BUSY_RETRY_DELAY", default=5)
+
+# Seconds the status of a manual flow trigger job can be looked up for
+FLOW_JOB_TTL = env.int("FLOW_JOB_TTL", default=24 * 60 * 60)
+
+# Longest balance forecast served, in months
+FORECAST_MAX_MONTHS = env.int("FORECAST_MAX_MONTHS", default=24)
+
+# Milliseconds to wait for another operation on the same canvas to finish
+CANVAS_LOCK_TIMEOUT = env.int("CANVAS_LOCK_TIMEOUT", default=10000)
+
 # django-rest-framework
 # -------------------------------------------------------------------------------
 # django-rest-framework - https://www.django-rest-framework.org/api-guide/settings/
@@ -348,12 +386,47 @@ CDN_KEY = env(
     "CDN_KEY",
     default="",
 )
+CDN_HOST = env("CDN_HOST", default="https://cdn.dhanriti.net")
+CDN_TIMEOUT = env.float("CDN_TIMEOUT", default=5)
+# Seconds file metadata lookups are cached for, locally and in the cache
+CDN_INFO_TTL = env.int("CDN_INFO_TTL", default=300)
+CDN_LOCAL_CACHE_SIZE = env.int("CDN_LOCAL_CACHE_SIZE", default=1024)
+# Lookups made in parallel when validating one document
+CDN_LOOKUP_CONCURRENCY = env.int("CDN_LOOKUP_CONCURRENCY", default=8)
 
 RATE_LIMIT_ENABLED = env(
     "RateLimit",
     default=False,
 )
 
+# Proxies in front of the app that append to X-Forwarded-For; with 0 the
+# client is identified by REMOTE_ADDR and X-Forwarded-For is ignored
+RATE_LIMIT_TRUSTED_PROXIES = env.int("RATE_LIMIT_TRUSTED_PROXIES", default=0)
+# Seconds a token's user is cached for when keying "user" buckets
+RATE_LIMIT_TOKEN_TTL = env.int("RATE_LIMIT_TOKEN_TTL", default=300)
+# Seconds an unknown token is remembered as such; kept short so a token
+# created meanwhile is soon recognised
+RATE_LIMIT_UNKNOWN_TOKEN_TTL = env.int("RATE_LIMIT_UNKNOWN_TOKEN_TTL", default=30)
+
+# Evaluated in order, the first rule whose path prefix matches applies.
+# "key" is either "ip" or "user" (anonymous requests fall back to the IP).
+RATE_LIMITS = [
+    {
+        "name": "auth",
+        "path": "/v1/auth/",
+        "limit": env.int("RATE_LIMIT_AUTH", default=50),
+        "window": 3600,
+        "key": "ip",
+    },
+    {
+        "name": "api",
+        "path": "/v1/",
+        "limit": env.int("RATE_LIMIT_API", default=1000),
+        "window": 3600,
+        "key": "user",
+    },
+]
+
 CLOSED_BETA = env(
     "CLOSED_BETA",
     default=False,
@@ -371,6 +444,14 @@ FCM_APIKEY = env(
     default="",
 )
 
+# Last online
+# ------------------------------------------------------------------------------
+# Seconds a user's stored last_online may lag behind before it is written again
+LAST_ONLINE_UPDATE_INTERVAL = env.int("LAST_ONLINE_UPDATE_INTERVAL", default=300)
+# Park timestamps in the cache and write them in bulk from flush_last_online_task;
+# needs the Redis cache unless the app and the flush share one process
+LAST_ONLINE_BUFFERED = env.bool("LAST_ONLINE_BUFFERED", default=False)
+
 # Vishnu
 # ------------------------------------------------------------------------------
 VISHNU_API_KEY = env(
@@ -383,6 +464,15 @@ VISHNU_HOST = env(
     default="https://auth-api.writeroo.net",
 )
 
+# Seconds to wait for a connection and for a response from Vishnu
+VISHNU_CONNECT_TIMEOUT = env.float("VISHNU_CONNECT_TIMEOUT", default=3.05)
+VISHNU_READ_TIMEOUT = env.float("VISHNU_READ_TIMEOUT", default=10)
+VISHNU_RETRIES = env.int("VISHNU_RETRIES", default=2)
+VISHNU_BACKOFF = env.float("VISHNU_BACKOFF", default=0.3)
+# Consecutive failures before calls are short-circuited, and for how long
+VISHNU_CIRCUIT_FAILURES = env.int("VISHNU_CIRCUIT_FAILURES", default=5)
+VISHNU_CIRCUIT_RESET = env.float("VISHNU_CIRCUIT_RESET", default=30)
+
 # Emails
 # ------------------------------------------------------------------------------
 
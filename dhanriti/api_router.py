@@ -2,7 +2,7 @@ from django.conf import settings
 from django.urls import include, path
 from rest_framework_nested import routers
 from dhanriti.views.flow import FlowViewSet
-from dhanriti.tasks import cron
+from dhanriti.views.cron import cron_job_status, cron_trigger
 from dhanriti.views.payments import PaymentsViewSet
 
 from dhanriti.views.tanks import CanvasViewSet, FunnelViewSet, TankViewSet
@@ -41,7 +41,12 @@ urlpatterns = [
     path(r"", include(tanks_router.urls)),
     path(
         "cron/<str:cron_key>/",
-        cron.cron_watch,
+        cron_trigger,
         name="cron",
     ),
+    path(
+        "cron/<str:cron_key>/jobs/<str:job_id>/",
+        cron_job_status,
+        name="cron-job",
+    ),
 ]
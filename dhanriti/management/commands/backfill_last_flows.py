@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from dhanriti.models.tanks import Canvas, Flow, Funnel
+
+
+def get_latest_flows(field, ids, **filters):
+    """
+    Return `{id: flow}` with the latest flow for each of `ids`.
+    """
+    flows = (
+        Flow.objects.filter(**{f"{field}__in": ids}, **filters)
+        .order_by(field, "-created_at")
+        .distinct(field)
+    )
+    return {getattr(flow, field): flow for flow in flows}
+
+
+class Command(BaseCommand):
+    help = (
+        "Set the last flow and last automatic flow pointers of every canvas and "
+        "funnel from the existing flows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, chunk_size=500, **options):
+        for model, field, filters in (
+            (Canvas, "canvas_id", {"funnel": None}),
+            (Funnel, "funnel_id", {}),
+        ):
+            ids = list(model.objects.order_by("pk").values_list("pk", flat=True))
+            for start in range(0, len(ids), chunk_size):
+                chunk = ids[start : start + chunk_size]
+                instances = list(model.objects.filter(pk__in=chunk))
+                last_flows = get_latest_flows(field, chunk, **filters)
+                last_auto_flows = get_latest_flows(
+                    field, chunk, manual=False, **filters
+                )
+                for instance in instances:
+                    last_flow = last_flows.get(instance.pk)
+                    last_auto_flow = last_auto_flows.get(instance.pk)
+                    instance.last_flow = last_flow
+                    instance.last_flow_at = last_flow and last_flow.created_at
+                    instance.last_flowed = last_flow and last_flow.flowed
+                    instance.last_auto_flow = last_auto_flow
+                    instance.last_auto_flow_at = (
+                        last_auto_flow and last_auto_flow.created_at
+                    )
+                    instance.last_auto_flowed = last_auto_flow and last_auto_flow.flowed
+                model.objects.bulk_update(instances, model.LAST_FLOW_FIELDS)
+
+            self.stdout.write(
+                f"Backfilled {len(ids)} {model._meta.verbose_name_plural}"
+            )
@@ -0,0 +1,100 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from dhanriti.models.enums import AccountType
+from dhanriti.models.ledger import LedgerEntry
+from dhanriti.models.payments import Payment
+from dhanriti.models.tanks import Canvas, Flow, Tank
+from utils.ledger import (
+    adjustment_entries,
+    flow_entries,
+    payment_entries,
+    record_entries,
+)
+from utils.locks import canvas_lock
+
+
+def get_ledger_balances(canvas_id):
+    """
+    `{(account_type, account_id): balance}` of the entries the canvas
+    already has, whether written live or by an earlier backfill.
+    """
+    balances = defaultdict(float)
+    for account_type, account_id, total in (
+        LedgerEntry.objects.filter(canvas_id=canvas_id)
+        .values("account_type", "account_id")
+        .annotate(total=Sum("amount"))
+        .values_list("account_type", "account_id", "total")
+    ):
+        balances[(account_type, account_id)] = total
+    return balances
+
+
+def get_adjustments(canvas, balances, now):
+    """
+    Entries bringing every account of the canvas from its ledger balance
+    to its stored one. Deleted tanks have handed their balance on, so they
+    are brought to zero.
+    """
+    targets = {(AccountType.CANVAS, canvas.pk): canvas.filled}
+    for pk, filled, deleted in Tank._base_manager.filter(canvas=canvas).values_list(
+        "pk", "filled", "deleted"
+    ):
+        targets[(AccountType.TANK, pk)] = 0 if deleted else filled
+
+    adjustments = []
+    for account, target in targets.items():
+        adjustments += adjustment_entries(
+            canvas.pk, account, target - balances[account], now
+        )
+    return adjustments
+
+
+class Command(BaseCommand):
+    help = (
+        "Write ledger entries for the flows and payments of every canvas that have "
+        "none yet, and reconcile the ledger with the stored balances."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--canvas", help="External id of a single canvas")
+
+    def handle(self, *args, canvas=None, **options):
+        # Every canvas is visited: one that flowed live since the deploy has
+        # entries, but its older flows and payments may still have none.
+        # Rows that already have entries are skipped, so reruns are no-ops.
+        canvases = Canvas._base_manager.all()
+        if canvas:
+            canvases = canvases.filter(external_id=canvas)
+
+        count = 0
+        for canvas_id in canvases.values_list("pk", flat=True).iterator():
+            with canvas_lock(canvas_id):
+                canvas = Canvas._base_manager.get(pk=canvas_id)
+                now = timezone.now()
+                entries = []
+                flows = Flow.objects.filter(
+                    Q(canvas_id=canvas_id)
+                    | Q(canvas=None, funnel__canvas_id=canvas_id),
+                    ledger_entries=None,
+                ).order_by("created_at")
+                for flow in flows.iterator():
+                    entries += flow_entries(flow, canvas_id)
+                payments = Payment._base_manager.filter(
+                    tank__canvas_id=canvas_id, ledger_entries=None
+                )
+                for payment in payments.iterator():
+                    entries += payment_entries(payment, canvas_id)
+
+                balances = get_ledger_balances(canvas_id)
+                for entry in entries:
+                    balances[(entry.account_type, entry.account_id)] += entry.amount
+                entries += get_adjustments(canvas, balances, now)
+                record_entries(entries)
+            if entries:
+                count += 1
+
+        self.stdout.write(f"Backfilled the ledger of {count} canvases")
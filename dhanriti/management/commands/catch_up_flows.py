@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from dhanriti.models.enums import FlowRateType
+from dhanriti.models.tanks import Canvas
+from utils.flow import catch_up_canvas
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire the canvas inflows and timely funnel flows whose schedule windows "
+        "were missed (e.g. while the workers were down), stamped with the time "
+        "of each window. The cron workers do this on their own for the canvases "
+        "they find overdue, CRON_CATCH_UP_LIMIT windows at a time; run this "
+        "before starting them again to preview (--dry-run) or to catch up with "
+        "another limit. Overdue canvases are only found before the first beat "
+        "tick reschedules them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--canvas",
+            action="append",
+            dest="canvases",
+            help="External id of a canvas to catch up (repeatable). Defaults to "
+            "every canvas with an overdue inflow or timely funnel.",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=1000,
+            help="Most windows to fire per canvas inflow or funnel in one run.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be fired without writing anything.",
+        )
+
+    def handle(self, *args, canvases=None, limit=1000, dry_run=False, **options):
+        now = timezone.now()
+        queryset = Canvas.objects.all()
+        if canvases:
+            queryset = queryset.filter(external_id__in=canvases)
+        else:
+            queryset = queryset.filter(
+                Q(next_fire_at__lte=now)
+                | Q(
+                    funnels__deleted=False,
+                    funnels__flow_rate_type=FlowRateType.TIMELY,
+                    funnels__next_fire_at__lte=now,
+                )
+            ).distinct()
+
+        totals = {"canvases": 0, "windows": 0, "flows": 0}
+        for canvas_id in queryset.values_list("id", flat=True).iterator():
+            report = catch_up_canvas(canvas_id, now, limit, dry_run=dry_run)
+            if not report["windows"]:
+                continue
+
+            totals["canvases"] += 1
+            totals["windows"] += report["windows"]
+            totals["flows"] += report["flows"]
+            self.stdout.write(
+                f"{report['name']} ({report['canvas']}): {report['windows']} windows, "
+                f"{report['flows']} flows, {report['inflowed']} inflowed"
+                + (", more windows remain" if report["remaining"] else "")
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{'Would fire' if dry_run else 'Fired'} {totals['windows']} windows "
+                f"({totals['flows']} flows) on {totals['canvases']} canvases"
+            )
+        )
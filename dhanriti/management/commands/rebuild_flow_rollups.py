@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from dhanriti.models.rollups import FlowRollup
+from dhanriti.models.tanks import Canvas, Flow
+from utils.locks import canvas_lock
+from utils.rollups import TOTAL_FIELDS, rollup_flows
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily and monthly flow rollups of every canvas from its flows."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--canvas", help="External id of a single canvas")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, canvas=None, chunk_size=2000, **options):
+        canvases = Canvas._base_manager.order_by("pk")
+        if canvas:
+            canvases = canvases.filter(external_id=canvas)
+
+        count = 0
+        for canvas_id in canvases.values_list("pk", flat=True).iterator():
+            with canvas_lock(canvas_id):
+                flows = Flow.objects.filter(
+                    Q(canvas_id=canvas_id) | Q(canvas=None, funnel__canvas_id=canvas_id)
+                ).only(
+                    "funnel_id", "out_tank_id", "flowed", "manual", "meta", "created_at"
+                )
+                totals = rollup_flows(flows.iterator(chunk_size=chunk_size), canvas_id)
+
+                FlowRollup.objects.filter(canvas_id=canvas_id).delete()
+                FlowRollup.objects.bulk_create(
+                    [
+                        FlowRollup(
+                            canvas_id=canvas_id,
+                            scope=scope,
+                            scope_id=scope_id,
+                            period=period,
+                            bucket=bucket,
+                            **dict(zip(TOTAL_FIELDS, values)),
+                        )
+                        for (scope, scope_id, period, bucket), values in totals.items()
+                    ],
+                    batch_size=chunk_size,
+                )
+            count += 1
+
+        self.stdout.write(f"Rebuilt the flow rollups of {count} canvases")
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:52
+
+from datetime import datetime
+
+import croniter
+from django.db import migrations, models
+
+TIMELY = 1
+
+
+def populate_next_fire_at(apps, schema_editor):
+    Canvas = apps.get_model("dhanriti", "Canvas")
+    Funnel = apps.get_model("dhanriti", "Funnel")
+    Flow = apps.get_model("dhanriti", "Flow")
+
+    for canvas in Canvas.objects.filter(deleted=False).iterator():
+        last_flow = (
+            Flow.objects.filter(canvas=canvas, funnel=None, manual=False)
+            .order_by("-created_at")
+            .first()
+        )
+        after = last_flow.created_at if last_flow else canvas.created_at
+        canvas.next_fire_at = croniter.croniter(canvas.inflow_rate, after).get_next(
+            datetime
+        )
+        canvas.save(update_fields=["next_fire_at"])
+
+    # Timely funnels without a flow rate never fire on their own
+    funnels = (
+        Funnel.objects.filter(deleted=False, flow_rate_type=TIMELY)
+        .exclude(flow_rate__isnull=True)
+        .exclude(flow_rate="")
+    )
+    for funnel in funnels.iterator():
+        last_flow = (
+            Flow.objects.filter(funnel=funnel, manual=False)
+            .order_by("-created_at")
+            .first()
+        )
+        after = last_flow.created_at if last_flow else funnel.created_at
+        funnel.next_fire_at = croniter.croniter(funnel.flow_rate, after).get_next(
+            datetime
+        )
+        funnel.save(update_fields=["next_fire_at"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("dhanriti", "0013_payment"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="canvas",
+            name="next_fire_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="funnel",
+            name="next_fire_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(populate_next_fire_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,127 @@
+# Generated by Django 4.2.6 on 2026-10-18 11:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_last_flows(apps, schema_editor):
+    Canvas = apps.get_model("dhanriti", "Canvas")
+    Funnel = apps.get_model("dhanriti", "Funnel")
+    Flow = apps.get_model("dhanriti", "Flow")
+
+    for model, field, filters in (
+        (Canvas, "canvas_id", {"funnel": None}),
+        (Funnel, "funnel_id", {}),
+    ):
+        pointers = {}
+        for prefix, manual in (("last", {}), ("last_auto", {"manual": False})):
+            latest = Flow.objects.filter(
+                **{field: models.OuterRef("pk")}, **filters, **manual
+            ).order_by("-created_at", "-id")
+            pointers.update(
+                {
+                    f"{prefix}_flow_id": models.Subquery(latest.values("pk")[:1]),
+                    f"{prefix}_flow_at": models.Subquery(
+                        latest.values("created_at")[:1]
+                    ),
+                    f"{prefix}_flowed": models.Subquery(latest.values("flowed")[:1]),
+                }
+            )
+        model.objects.update(**pointers)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dhanriti", "0014_canvas_next_fire_at_funnel_next_fire_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="canvas",
+            name="last_auto_flow",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="dhanriti.flow",
+            ),
+        ),
+        migrations.AddField(
+            model_name="canvas",
+            name="last_auto_flow_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="canvas",
+            name="last_auto_flowed",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="canvas",
+            name="last_flow",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="dhanriti.flow",
+            ),
+        ),
+        migrations.AddField(
+            model_name="canvas",
+            name="last_flow_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="canvas",
+            name="last_flowed",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="funnel",
+            name="last_auto_flow",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="dhanriti.flow",
+            ),
+        ),
+        migrations.AddField(
+            model_name="funnel",
+            name="last_auto_flow_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="funnel",
+            name="last_auto_flowed",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="funnel",
+            name="last_flow",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="dhanriti.flow",
+            ),
+        ),
+        migrations.AddField(
+            model_name="funnel",
+            name="last_flow_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="funnel",
+            name="last_flowed",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        # Without the pointers the flow engine and the cron guards would
+        # see canvases and funnels that never flowed
+        migrations.RunPython(populate_last_flows, migrations.RunPython.noop),
+    ]
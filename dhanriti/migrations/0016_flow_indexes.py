@@ -0,0 +1,62 @@
+# Generated by Django 4.2.6 on 2026-10-18 11:13
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # Flow is the largest table, so its indexes are built without locking
+    # out writes, which cannot happen inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("dhanriti", "0015_last_flow_pointers"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="flow",
+            index=models.Index(
+                fields=["canvas", "-created_at", "-id"], name="flow_canvas_created_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="flow",
+            index=models.Index(
+                condition=models.Q(("funnel__isnull", True)),
+                fields=["canvas", "-created_at"],
+                name="flow_canvas_inflow_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="flow",
+            index=models.Index(
+                fields=["funnel", "-created_at", "-id"], name="flow_funnel_created_idx"
+            ),
+        ),
+        # The foreign key indexes are dropped once the indexes leading with
+        # the same columns are in place
+        migrations.AlterField(
+            model_name="flow",
+            name="canvas",
+            field=models.ForeignKey(
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="flows",
+                to="dhanriti.canvas",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="flow",
+            name="funnel",
+            field=models.ForeignKey(
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="flows",
+                to="dhanriti.funnel",
+            ),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.6 on 2026-10-18 11:16
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_flow_tanks(apps, schema_editor):
+    Flow = apps.get_model("dhanriti", "Flow")
+    Funnel = apps.get_model("dhanriti", "Funnel")
+
+    funnel = Funnel.objects.filter(pk=models.OuterRef("funnel_id"))
+    Flow.objects.filter(funnel__isnull=False).update(
+        in_tank_id=models.Subquery(funnel.values("in_tank_id")[:1]),
+        out_tank_id=models.Subquery(funnel.values("out_tank_id")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+    # The indexes are built concurrently, see 0016
+    atomic = False
+
+    dependencies = [
+        ("dhanriti", "0016_flow_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="flow",
+            name="in_tank",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="outflows",
+                to="dhanriti.tank",
+            ),
+        ),
+        migrations.AddField(
+            model_name="flow",
+            name="out_tank",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="inflows",
+                to="dhanriti.tank",
+            ),
+        ),
+        # Backfilled before the indexes are built
+        migrations.RunPython(
+            populate_flow_tanks, migrations.RunPython.noop, atomic=True
+        ),
+        AddIndexConcurrently(
+            model_name="flow",
+            index=models.Index(
+                fields=["in_tank", "-created_at", "-id"],
+                name="flow_in_tank_created_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="flow",
+            index=models.Index(
+                fields=["out_tank", "-created_at", "-id"],
+                name="flow_out_tank_created_idx",
+            ),
+        ),
+    ]
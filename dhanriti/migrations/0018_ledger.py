@@ -0,0 +1,126 @@
+# Generated by Django 4.2.6 on 2026-10-18 11:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dhanriti", "0017_flow_in_tank_out_tank"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BalanceSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "account_type",
+                    models.IntegerField(
+                        choices=[(1, "External"), (2, "Canvas"), (3, "Tank")]
+                    ),
+                ),
+                ("account_id", models.BigIntegerField()),
+                ("at", models.DateTimeField()),
+                ("balance", models.FloatField()),
+                ("last_entry_id", models.BigIntegerField(db_index=True)),
+                (
+                    "canvas",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="balance_snapshots",
+                        to="dhanriti.canvas",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="LedgerEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("journal", models.UUIDField()),
+                (
+                    "account_type",
+                    models.IntegerField(
+                        choices=[(1, "External"), (2, "Canvas"), (3, "Tank")]
+                    ),
+                ),
+                ("account_id", models.BigIntegerField()),
+                (
+                    "entry_type",
+                    models.IntegerField(
+                        choices=[
+                            (1, "Inflow"),
+                            (2, "Flow"),
+                            (3, "Payment"),
+                            (4, "Tank Deletion"),
+                            (5, "Adjustment"),
+                        ]
+                    ),
+                ),
+                ("amount", models.FloatField()),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "canvas",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ledger_entries",
+                        to="dhanriti.canvas",
+                    ),
+                ),
+                (
+                    "flow",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="ledger_entries",
+                        to="dhanriti.flow",
+                    ),
+                ),
+                (
+                    "payment",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="ledger_entries",
+                        to="dhanriti.payment",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["account_type", "account_id", "created_at"],
+                        name="ledger_account_created_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="balancesnapshot",
+            constraint=models.UniqueConstraint(
+                fields=("account_type", "account_id", "at"),
+                name="snapshot_account_at_unique",
+            ),
+        ),
+    ]
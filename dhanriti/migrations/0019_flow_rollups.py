@@ -0,0 +1,65 @@
+# Generated by Django 4.2.6 on 2026-10-18 11:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dhanriti", "0018_ledger"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FlowRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "scope",
+                    models.IntegerField(
+                        choices=[(1, "Canvas"), (2, "Tank"), (3, "Funnel")]
+                    ),
+                ),
+                ("scope_id", models.BigIntegerField()),
+                ("period", models.IntegerField(choices=[(1, "Day"), (2, "Month")])),
+                ("bucket", models.DateField()),
+                ("flowed", models.FloatField(default=0)),
+                ("count", models.IntegerField(default=0)),
+                ("manual_count", models.IntegerField(default=0)),
+                ("reduced_count", models.IntegerField(default=0)),
+                (
+                    "canvas",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="flow_rollups",
+                        to="dhanriti.canvas",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["canvas", "period", "bucket"],
+                        name="rollup_canvas_bucket_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="flowrollup",
+            constraint=models.UniqueConstraint(
+                fields=("scope", "scope_id", "period", "bucket"),
+                name="rollup_scope_bucket_unique",
+            ),
+        ),
+    ]
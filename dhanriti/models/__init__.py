@@ -1,3 +1,5 @@
 from .users import *  # noqa
 from .tanks import *  # noqa
-from .payments import *  # noqa
\ No newline at end of file
+from .payments import *  # noqa
+from .ledger import *  # noqa
+from .rollups import *  # noqa
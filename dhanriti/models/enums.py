@@ -9,3 +9,34 @@ class FlowRateType(IntegerChoices):
 class FlowType(IntegerChoices):
     ABSOLUTE = 1
     PERCENTAGE = 2
+
+
+class AccountType(IntegerChoices):
+    # Money entering or leaving a canvas (income, payments, write-offs)
+    EXTERNAL = 1
+    # The main tank of a canvas
+    CANVAS = 2
+    TANK = 3
+
+
+class EntryType(IntegerChoices):
+    INFLOW = 1
+    FLOW = 2
+    PAYMENT = 3
+    TANK_DELETION = 4
+    # Reconciles the ledger with the stored balances when it is backfilled
+    ADJUSTMENT = 5
+
+
+class RollupScope(IntegerChoices):
+    # Inflows of a canvas
+    CANVAS = 1
+    # Flows into a tank
+    TANK = 2
+    # Flows through a funnel
+    FUNNEL = 3
+
+
+class RollupPeriod(IntegerChoices):
+    DAY = 1
+    MONTH = 2
@@ -0,0 +1,85 @@
+from dhanriti.models.enums import AccountType, EntryType
+from dhanriti.models.payments import Payment
+from dhanriti.models.tanks import Canvas, Flow
+from django.db import models
+from django.utils import timezone
+
+
+class LedgerEntry(models.Model):
+    """
+    One leg of a balance movement. Every movement is written as a pair of
+    entries sharing a `journal` id whose amounts sum to zero: the account
+    money leaves is debited (negative amount) and the account it enters is
+    credited.
+
+    An account is `(account_type, account_id)`, where `account_id` is the
+    tank for TANK accounts and the canvas otherwise. Entries are never
+    updated or deleted, so they carry no external id or deleted flag.
+    """
+
+    canvas = models.ForeignKey(
+        Canvas, on_delete=models.CASCADE, related_name="ledger_entries"
+    )
+    journal = models.UUIDField()
+    account_type = models.IntegerField(choices=AccountType.choices)
+    account_id = models.BigIntegerField()
+    entry_type = models.IntegerField(choices=EntryType.choices)
+    amount = models.FloatField()
+    flow = models.ForeignKey(
+        Flow,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="ledger_entries",
+    )
+    payment = models.ForeignKey(
+        Payment,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="ledger_entries",
+    )
+    # When the money moved, which is earlier than the insert for backdated
+    # flows
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["account_type", "account_id", "created_at"],
+                name="ledger_account_created_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.get_account_type_display()} {self.account_id} {self.amount:+} on {self.created_at}"
+
+
+class BalanceSnapshot(models.Model):
+    """
+    The balance of an account including every entry created at or before
+    `at`. Snapshots are taken periodically and deleted when a backdated
+    entry lands before them.
+    """
+
+    canvas = models.ForeignKey(
+        Canvas, on_delete=models.CASCADE, related_name="balance_snapshots"
+    )
+    account_type = models.IntegerField(choices=AccountType.choices)
+    account_id = models.BigIntegerField()
+    at = models.DateTimeField()
+    balance = models.FloatField()
+    # Highest LedgerEntry id when the snapshot was taken, to find the
+    # accounts with newer entries on the next run
+    last_entry_id = models.BigIntegerField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account_type", "account_id", "at"],
+                name="snapshot_account_at_unique",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.get_account_type_display()} {self.account_id} at {self.at}: {self.balance}"
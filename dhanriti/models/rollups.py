@@ -0,0 +1,42 @@
+from dhanriti.models.enums import RollupPeriod, RollupScope
+from dhanriti.models.tanks import Canvas
+from django.db import models
+
+
+class FlowRollup(models.Model):
+    """
+    Totals of the flows of one scope (see RollupScope) in one day or month.
+    `scope_id` is the canvas, tank or funnel and `bucket` the first day of
+    the period. Rows are incremented as flows are written and can be
+    rebuilt from the flows with the rebuild_flow_rollups command.
+    """
+
+    # Leads the composite index below, so it needs no index of its own
+    canvas = models.ForeignKey(
+        Canvas, on_delete=models.CASCADE, related_name="flow_rollups", db_index=False
+    )
+    scope = models.IntegerField(choices=RollupScope.choices)
+    scope_id = models.BigIntegerField()
+    period = models.IntegerField(choices=RollupPeriod.choices)
+    bucket = models.DateField()
+    flowed = models.FloatField(default=0)
+    count = models.IntegerField(default=0)
+    manual_count = models.IntegerField(default=0)
+    reduced_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["scope", "scope_id", "period", "bucket"],
+                name="rollup_scope_bucket_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["canvas", "period", "bucket"],
+                name="rollup_canvas_bucket_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.get_scope_display()} {self.scope_id} {self.get_period_display()} {self.bucket}: {self.flowed}"
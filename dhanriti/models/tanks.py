@@ -1,9 +1,11 @@
 from dhanriti.models.enums import FlowRateType, FlowType
 from dhanriti.models.users import User
-from utils.helpers import is_valid_crontab_expression
+from utils.helpers import get_next_fire_time, is_valid_crontab_expression
 from utils.models.base import BaseModel
+from utils.models.mixins import FilledBalanceMixin, PreserveInitialFieldValueMixin
 from django.db import models
 from django.db.models.signals import post_save
+from django.utils import timezone
 
 class BulkCreateSignalManager(models.Manager):
     def bulk_create(self, objs, **kwargs):
@@ -13,7 +15,60 @@ class BulkCreateSignalManager(models.Manager):
         return a
 
 
-class Canvas(BaseModel):
+class LastFlowMixin(models.Model):
+    """
+    Pointers to the latest flow and the latest automatic flow, with their
+    amount and time, kept up to date by CanvasFlowEngine.commit. For a
+    canvas these are its inflows.
+    """
+
+    last_flow = models.ForeignKey(
+        "Flow", on_delete=models.SET_NULL, blank=True, null=True, related_name="+"
+    )
+    last_flow_at = models.DateTimeField(blank=True, null=True)
+    last_flowed = models.FloatField(blank=True, null=True)
+    last_auto_flow = models.ForeignKey(
+        "Flow", on_delete=models.SET_NULL, blank=True, null=True, related_name="+"
+    )
+    last_auto_flow_at = models.DateTimeField(blank=True, null=True)
+    last_auto_flowed = models.FloatField(blank=True, null=True)
+
+    LAST_FLOW_FIELDS = (
+        "last_flow",
+        "last_flow_at",
+        "last_flowed",
+        "last_auto_flow",
+        "last_auto_flow_at",
+        "last_auto_flowed",
+    )
+
+    class Meta:
+        abstract = True
+
+    def record_flow(self, flow):
+        """
+        Point at `flow` if it is newer than the current pointers. Returns
+        whether anything changed; the caller saves LAST_FLOW_FIELDS.
+        """
+        changed = False
+        if self.last_flow_at is None or flow.created_at >= self.last_flow_at:
+            self.last_flow = flow
+            self.last_flow_at = flow.created_at
+            self.last_flowed = flow.flowed
+            changed = True
+        if not flow.manual and (
+            self.last_auto_flow_at is None or flow.created_at >= self.last_auto_flow_at
+        ):
+            self.last_auto_flow = flow
+            self.last_auto_flow_at = flow.created_at
+            self.last_auto_flowed = flow.flowed
+            changed = True
+        return changed
+
+
+class Canvas(
+    FilledBalanceMixin, PreserveInitialFieldValueMixin, LastFlowMixin, BaseModel
+):
     name = models.CharField(max_length=255, blank=False, null=False)
     description = models.TextField(blank=True, null=True)
     user = models.ForeignKey(
@@ -27,12 +82,29 @@ class Canvas(BaseModel):
         null=False,
         validators=[is_valid_crontab_expression],
     )
+    next_fire_at = models.DateTimeField(blank=True, null=True, db_index=True)
+
+    _preserved_fields = ("inflow_rate",)
 
     def __str__(self) -> str:
         return f"{self.name} - {self.inflow} Rs."
 
+    def schedule_next_fire(self, after=None):
+        after = after or self.last_auto_flow_at or self.created_at or timezone.now()
+        self.next_fire_at = get_next_fire_time(self.inflow_rate, after)
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or self.inflow_rate != self._initial_inflow_rate:
+            # A changed schedule starts now, so its windows from before the
+            # change are not fired (or caught up)
+            self.schedule_next_fire(None if self._state.adding else timezone.now())
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "next_fire_at"}
+        super().save(*args, **kwargs)
+        self._initial_inflow_rate = self.inflow_rate
+
 
-class Tank(BaseModel):
+class Tank(FilledBalanceMixin, BaseModel):
     name = models.CharField(max_length=255, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
     capacity = models.FloatField(blank=True, null=True)
@@ -46,7 +118,7 @@ class Tank(BaseModel):
         return f"{self.name} - {self.capacity} Rs."
 
 
-class Funnel(BaseModel):
+class Funnel(PreserveInitialFieldValueMixin, LastFlowMixin, BaseModel):
     name = models.CharField(max_length=255, blank=True, null=True)
     flow_rate = models.CharField(
         max_length=255, blank=False, null=True, validators=[is_valid_crontab_expression]
@@ -71,22 +143,120 @@ class Funnel(BaseModel):
         null=True,
         related_name="funnels",
     )
+    next_fire_at = models.DateTimeField(blank=True, null=True, db_index=True)
+
+    _preserved_fields = ("flow_rate", "flow_rate_type")
 
     def __str__(self) -> str:
         return f"[{self.canvas.name}] Flows {self.flow} {'/-' if self.flow_type == FlowType.ABSOLUTE else '%'} from {self.in_tank.name if self.in_tank else 'Main Tank'} to {self.out_tank.name} every {self.flow_rate if self.flow_rate_type == FlowRateType.TIMELY else 'inflow'}"
 
+    def schedule_next_fire(self, after=None):
+        # A timely funnel without a flow rate never fires on its own
+        if self.flow_rate_type != FlowRateType.TIMELY or not self.flow_rate:
+            self.next_fire_at = None
+            return
+        after = after or self.last_auto_flow_at or self.created_at or timezone.now()
+        self.next_fire_at = get_next_fire_time(self.flow_rate, after)
+
+    def save(self, *args, **kwargs):
+        if (
+            self._state.adding
+            or self.flow_rate != self._initial_flow_rate
+            or self.flow_rate_type != self._initial_flow_rate_type
+        ):
+            self.schedule_next_fire(None if self._state.adding else timezone.now())
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "next_fire_at"}
+        super().save(*args, **kwargs)
+        self._initial_flow_rate = self.flow_rate
+        self._initial_flow_rate_type = self.flow_rate_type
+
 
 class Flow(BaseModel):
     objects = BulkCreateSignalManager()
+    # Both foreign keys lead the composite indexes below, so they need no
+    # index of their own
     funnel = models.ForeignKey(
-        Funnel, on_delete=models.CASCADE, blank=False, null=True, related_name="flows"
+        Funnel,
+        on_delete=models.CASCADE,
+        blank=False,
+        null=True,
+        related_name="flows",
+        db_index=False,
     )
     canvas = models.ForeignKey(
-        Canvas, on_delete=models.CASCADE, blank=False, null=True, related_name="flows"
+        Canvas,
+        on_delete=models.CASCADE,
+        blank=False,
+        null=True,
+        related_name="flows",
+        db_index=False,
+    )
+    # Copied from the funnel when the flow is created, so flow history can
+    # be filtered by tank without joining through Funnel
+    in_tank = models.ForeignKey(
+        Tank,
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        related_name="outflows",
+        db_index=False,
+    )
+    out_tank = models.ForeignKey(
+        Tank,
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        related_name="inflows",
+        db_index=False,
     )
     flowed = models.FloatField(blank=False, null=True)
     manual = models.BooleanField(default=False)
     meta = models.JSONField(blank=True, null=True)
 
+    class Meta:
+        # BaseManager adds `deleted = false` to every read. The app never
+        # deletes flows, so that stays a filter instead of an index
+        # condition, and the indexes also serve the cascades of hard
+        # deletes. Flow history is paginated on (-created_at, -id), which
+        # the history indexes match exactly.
+        indexes = [
+            # Flow history of a canvas, newest first
+            models.Index(
+                fields=["canvas", "-created_at", "-id"],
+                name="flow_canvas_created_idx",
+            ),
+            # Latest inflows of a canvas
+            models.Index(
+                fields=["canvas", "-created_at"],
+                condition=models.Q(funnel__isnull=True),
+                name="flow_canvas_inflow_idx",
+            ),
+            # Flow history of a funnel, and its latest flows
+            models.Index(
+                fields=["funnel", "-created_at", "-id"],
+                name="flow_funnel_created_idx",
+            ),
+            # Flow history out of and into a tank
+            models.Index(
+                fields=["in_tank", "-created_at", "-id"],
+                name="flow_in_tank_created_idx",
+            ),
+            models.Index(
+                fields=["out_tank", "-created_at", "-id"],
+                name="flow_out_tank_created_idx",
+            ),
+        ]
+
+    def set_tanks(self):
+        if self.funnel_id is not None:
+            self.in_tank_id = self.funnel.in_tank_id
+            self.out_tank_id = self.funnel.out_tank_id
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.set_tanks()
+        super().save(*args, **kwargs)
+
     def __str__(self) -> str:
         return f"Flowed {self.flowed} Rs. from {(self.funnel.in_tank.name if self.funnel.in_tank else 'Main Tank') if self.funnel else 'Canvas Inflow'} to {self.funnel.out_tank.name if self.funnel else 'Main Tank'} on {self.created_at}"
\ No newline at end of file
@@ -1,8 +1,51 @@
-from calendar import c
+from collections import defaultdict
+
 from rest_framework import serializers
 
 from dhanriti.models.tanks import Canvas, Flow, Funnel, Tank
-from django.db.models import Sum
+from django.db.models import FloatField, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def prefetch_canvas_graph(queryset):
+    """
+    Load everything CanvasSerializer renders with a fixed number of queries.
+
+    Funnels are fetched once per page with their out tanks, and the last
+    five flows of every funnel and the last five inflows of every canvas
+    come from ranked (ROW_NUMBER) prefetches. The serializers rebuild the
+    funnel tree from these instead of querying per node.
+    """
+    tanks_filled = (
+        Tank.objects.filter(canvas=OuterRef("pk"))
+        .values("canvas")
+        .annotate(total=Sum("filled"))
+        .values("total")
+    )
+    return queryset.annotate(
+        tanks_filled=Coalesce(
+            Subquery(tanks_filled, output_field=FloatField()), Value(0.0)
+        )
+    ).prefetch_related(
+        Prefetch(
+            "flows",
+            queryset=Flow.objects.filter(funnel=None).order_by("-created_at")[:5],
+            to_attr="last_inflows",
+        ),
+        Prefetch(
+            "funnels",
+            queryset=Funnel.objects.select_related("out_tank")
+            .prefetch_related(
+                Prefetch(
+                    "flows",
+                    queryset=Flow.objects.order_by("-created_at")[:5],
+                    to_attr="recent_flows",
+                )
+            )
+            .order_by("-created_at"),
+            to_attr="graph_funnels",
+        ),
+    )
 
 
 class CanvasSerializer(serializers.ModelSerializer):
@@ -25,7 +68,14 @@ class CanvasSerializer(serializers.ModelSerializer):
             "filled",
             "total_money"
         )
-        read_only_fields = ("external_id", "created_at", "modified_at", "tanks")
+        # Balances only change through flows, payments and the adjust action
+        read_only_fields = (
+            "external_id",
+            "created_at",
+            "modified_at",
+            "tanks",
+            "filled",
+        )
 
     def save(self, **kwargs):
         user = self.context["request"].user
@@ -34,21 +84,39 @@ class CanvasSerializer(serializers.ModelSerializer):
 
     def get_funnels(self, obj):
         # get all funnels with in_tank = None
+        graph_funnels = getattr(obj, "graph_funnels", None)
+        if graph_funnels is None:
+            funnels = Funnel.objects.filter(in_tank=None, out_tank__canvas=obj).order_by('-created_at')
+            return FunnelSerializer(funnels, many=True).data
 
-        funnels = Funnel.objects.filter(in_tank=None, out_tank__canvas=obj).order_by('-created_at')
+        # Hand every out tank its child funnels so the nested serializers
+        # walk the prefetched graph instead of querying per tank
+        children = defaultdict(list)
+        for funnel in graph_funnels:
+            children[funnel.in_tank_id].append(funnel)
+        for funnel in graph_funnels:
+            funnel.out_tank.child_funnels = children[funnel.out_tank_id]
+
+        return FunnelSerializer(children[None], many=True).data
 
-        return FunnelSerializer(funnels, many=True).data
-    
     def get_last_flows(self, obj):
-        flows = Flow.objects.filter(canvas=obj, funnel=None).order_by('-created_at')[:5]
+        flows = getattr(obj, "last_inflows", None)
+        if flows is None:
+            flows = Flow.objects.filter(canvas=obj, funnel=None).order_by('-created_at')[:5]
         return FlowSerializer(flows, many=True).data
-    
+
     def get_total_money(self, obj):
-        total_money = Tank.objects.filter(canvas=obj).aggregate(total_filled=Sum('filled'))['total_filled']
+        total_money = getattr(obj, "tanks_filled", None)
+        if total_money is None:
+            total_money = Tank.objects.filter(canvas=obj).aggregate(total_filled=Sum('filled'))['total_filled']
         total_money = (total_money or 0) + obj.filled
         return total_money
 
 
+class BalanceAdjustmentSerializer(serializers.Serializer):
+    filled = serializers.FloatField(min_value=0)
+
+
 class TankSerializer(serializers.ModelSerializer):
     funnels = serializers.SerializerMethodField()
 
@@ -65,10 +133,13 @@ class TankSerializer(serializers.ModelSerializer):
             "funnels",
             "filled"
         )
-        read_only_fields = ("external_id", "created_at", "modified_at")
+        read_only_fields = ("external_id", "created_at", "modified_at", "filled")
 
     def get_funnels(self, obj):
-        return FunnelSerializer(obj.funnels.all(), many=True).data
+        funnels = getattr(obj, "child_funnels", None)
+        if funnels is None:
+            funnels = obj.funnels.all()
+        return FunnelSerializer(funnels, many=True).data
 
 
 class FunnelSerializer(serializers.ModelSerializer):
@@ -92,7 +163,9 @@ class FunnelSerializer(serializers.ModelSerializer):
         read_only_fields = ("external_id", "created_at", "modified_at", "out_tank")
 
     def get_last_flows(self, obj):
-        flows = Flow.objects.filter(funnel=obj).order_by('-created_at')[:5]
+        flows = getattr(obj, "recent_flows", None)
+        if flows is None:
+            flows = Flow.objects.filter(funnel=obj).order_by('-created_at')[:5]
         return FlowSerializer(flows, many=True).data
 
 class FunnelDetailSerializer(FunnelSerializer):
@@ -118,6 +191,45 @@ class FlowSerializer(serializers.ModelSerializer):
         )
         read_only_fields = ("external_id", "created_at", "modified_at")
 
+class FlowListSerializer(serializers.ModelSerializer):
+    funnel = serializers.UUIDField(
+        source="funnel.external_id", read_only=True, allow_null=True
+    )
+    in_tank = serializers.UUIDField(
+        source="in_tank.external_id", read_only=True, allow_null=True
+    )
+    out_tank = serializers.UUIDField(
+        source="out_tank.external_id", read_only=True, allow_null=True
+    )
+
+    class Meta:
+        model = Flow
+        fields = (
+            "flowed",
+            "external_id",
+            "created_at",
+            "meta",
+            "manual",
+            "funnel",
+            "in_tank",
+            "out_tank",
+        )
+        read_only_fields = fields
+
+
+class FlowPreviewSerializer(FlowListSerializer):
+    # Previewed flows are never saved, so they have no id or time yet
+    class Meta(FlowListSerializer.Meta):
+        fields = (
+            "flowed",
+            "meta",
+            "manual",
+            "funnel",
+            "in_tank",
+            "out_tank",
+        )
+        read_only_fields = fields
+
 class FlowDetailSerializer(FlowSerializer):
     funnel = FunnelDetailSerializer(read_only=True)
     canvas = CanvasSerializer(read_only=True)
@@ -1,7 +1,8 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from dhanriti.models.tanks import Flow, Funnel
-from utils.flow import trigger_funnel_flow
+from dhanriti.models.tanks import Flow
+from utils.flow import CanvasFlowEngine
+from utils.locks import canvas_lock
 
 @receiver(
     post_save,
@@ -9,21 +10,11 @@ from utils.flow import trigger_funnel_flow
     dispatch_uid="add_notification_follow",
 )
 def flowed(sender, instance: Flow, created, raw, **kwargs):
-    # check if it is a newly created object
-    if created:
-        if instance.canvas and not instance.funnel:
-            instance.canvas.filled += instance.flowed
-            instance.canvas.save()
-            for funnel in Funnel.objects.filter(canvas=instance.canvas, in_tank=None):
-                trigger_funnel_flow(funnel, manual_trigger=instance.manual)
-        elif instance.funnel:
-            if instance.funnel.in_tank:
-                instance.funnel.in_tank.filled -= instance.flowed
-                instance.funnel.in_tank.save()
-            else:
-                instance.funnel.canvas.filled -= instance.flowed
-                instance.funnel.canvas.save()
-            instance.funnel.out_tank.filled += instance.flowed
-            instance.funnel.out_tank.save()
-            for funnel in Funnel.objects.filter(in_tank=instance.funnel.out_tank):
-                trigger_funnel_flow(funnel, manual_trigger=instance.manual)
+    # check if it is a newly created object. Flows written by the engine are
+    # bulk created (raw) and have already been accounted for.
+    if created and not raw:
+        canvas_id = instance.canvas_id or instance.funnel.canvas_id
+        with canvas_lock(canvas_id):
+            engine = CanvasFlowEngine(canvas_id)
+            engine.apply(instance)
+            engine.commit()
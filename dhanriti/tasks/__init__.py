@@ -0,0 +1 @@
+from . import cron, flows, ledger, users  # noqa: F401
@@ -1,57 +1,256 @@
+import logging
+from collections import defaultdict
+from functools import partial
+from itertools import islice
+
+from django.conf import settings
 from django.utils import timezone
-import croniter
+from django.utils.dateparse import parse_datetime
 from celery import shared_task
-from django.db import models
-from django.http import HttpResponse, HttpResponseForbidden
+from django.core.cache import cache
+
+from dhanriti.models.tanks import Canvas, Funnel, FlowRateType
+from utils.flow import (
+    catch_up_canvas,
+    get_missed_fire_times,
+    trigger_canvas_inflow,
+    trigger_funnel_flow,
+)
+from utils.cron import get_next_fire_times
+from utils.locks import CanvasBusy, canvas_lock
+from utils.metrics import record, timed
+
+logger = logging.getLogger(__name__)
+
+# Job id of the cron_watch run started over HTTP, while it is in flight
+CRON_JOB_CACHE_KEY = "cron:job"
+
+
+def chunked(queryset, size):
+    """
+    Stream `queryset` with a server-side cursor and yield lists of at most
+    `size` rows, so only one chunk is ever held in memory.
+    """
+    rows = queryset.iterator(chunk_size=size)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def reschedule(model, rows, now):
+    """
+    Move `rows` of `(pk, expr)` to their next fire time after `now`.
+    """
+    pks_by_expr = defaultdict(list)
+    for pk, expr in rows:
+        pks_by_expr[expr].append(pk)
+
+    next_fire_times = get_next_fire_times(pks_by_expr, now)
+    for expr, pks in pks_by_expr.items():
+        model.objects.filter(pk__in=pks).update(next_fire_at=next_fire_times[expr])
+
+
+def get_queue(canvas_id):
+    return f"{settings.CRON_QUEUE_PREFIX}.{canvas_id % settings.CRON_PARTITIONS}"
+
+
+def dispatch(task, kind, rows, now, enqueued):
+    """
+    Enqueue `rows` of `(canvas_id, pk, slot)` as one task per partition,
+    adding the pks of each partition to `enqueued` once its task is sent.
+    """
+    batches = defaultdict(list)
+    for canvas_id, pk, slot in rows:
+        batches[get_queue(canvas_id)].append((pk, slot.isoformat()))
+
+    for queue, items in batches.items():
+        task.apply_async(args=[items, now.isoformat()], queue=queue)
+        enqueued.update(pk for pk, _ in items)
+
+    lag = max((now - slot).total_seconds() for _, _, slot in rows)
+    record("cron.dispatch_lag", lag * 1000, kind=kind, rows=len(rows))
+
+
+def start_chunk(kind, items, dispatched_at):
+    lag = timezone.now() - parse_datetime(dispatched_at)
+    record("cron.queue_lag", lag.total_seconds() * 1000, kind=kind)
+    return {pk: parse_datetime(slot) for pk, slot in items}
+
+
+def run_locked(canvas_id, has_fired, fire):
+    """
+    Fire under the canvas lock without waiting for it, unless `has_fired`
+    reports the slot as already fired. Returns False if the canvas is busy.
+    """
+    try:
+        with canvas_lock(canvas_id, blocking=False):
+            # Checked again under the lock in case an overlapping run fired
+            if not has_fired():
+                fire()
+    except CanvasBusy:
+        return False
+    return True
+
+
+def has_missed_windows(expr, slot, now):
+    """
+    Return whether another window of `expr` has passed after the due `slot`,
+    which only happens when the beat or the cron workers were down.
+    """
+    if not expr:
+        return False
+    times, _ = get_missed_fire_times(expr, slot, now, 1)
+    return bool(times)
+
+
+def catch_up(canvas_id):
+    # Also fires the missed windows of the other entities of the canvas, and
+    # reschedules every one that has more windows left at the first of them
+    catch_up_canvas(canvas_id, timezone.now(), settings.CRON_CATCH_UP_LIMIT)
+
+
+def retry_busy(task, busy, dispatched_at):
+    """
+    Enqueue `busy` items of `(canvas_id, pk, slot)` again after a delay.
+    """
+    batches = defaultdict(list)
+    for canvas_id, pk, slot in busy:
+        batches[get_queue(canvas_id)].append((pk, slot))
+
+    for queue, items in batches.items():
+        task.apply_async(
+            args=[items, dispatched_at],
+            queue=queue,
+            countdown=settings.CRON_BUSY_RETRY_DELAY,
+        )
 
-from dhanriti.models.tanks import Canvas, Flow, Funnel, FlowRateType, FlowType
-from utils.flow import trigger_canvas_inflow, trigger_funnel_flow
 
 @shared_task
-def cron_watch(request=None, cron_key=None):
-    if cron_key and cron_key != "3z1OxJQuzkvKKw9ZJDWnZE8R8SuysN7ghdFzwk870UzLXB84ww":
-        return HttpResponseForbidden("Incorrect password")
+def run_due_canvases(items, dispatched_at):
+    slots = start_chunk("canvas", items, dispatched_at)
+    busy = []
 
-    if cron_key is None:
-        pass
-    
-    # Fetch current time once
-    now = timezone.now()
+    with timed("cron.chunk_duration", kind="canvas", rows=len(items)):
+        # Preserved fields are read on init, so deferring one would refresh
+        # each row from the database, recursively
+        canvases = Canvas.objects.filter(pk__in=slots).only(
+            "id", "name", "last_auto_flow_at", *Canvas._preserved_fields
+        )
+        for canvas in canvases:
+            # A run that died before rescheduling has already fired this slot
+            slot = slots[canvas.pk]
+            if canvas.last_auto_flow_at and canvas.last_auto_flow_at >= slot:
+                continue
+
+            if has_missed_windows(canvas.inflow_rate, slot, timezone.now()):
+                logger.info(f"Catching up canvas {canvas.name}")
+                fire = partial(catch_up, canvas.pk)
+            else:
+                logger.info(f"Triggering canvas {canvas.name} inflow")
+                fire = partial(trigger_canvas_inflow, canvas)
+            fired = Canvas.objects.filter(pk=canvas.pk, last_auto_flow_at__gte=slot)
+            if not run_locked(canvas.pk, fired.exists, fire):
+                busy.append((canvas.pk, canvas.pk, slot.isoformat()))
+
+    retry_busy(run_due_canvases, busy, dispatched_at)
 
-    # Fetch all canvases with related flows and funnels to reduce queries in loops
-    all_canvases = Canvas.objects.prefetch_related('flows', 'funnels')
 
-    # Process each canvas
-    for canvas in all_canvases:
-        cron = canvas.inflow_rate
-        # Use the related_name of Flow to Canvas if defined, or use flow_set if not defined
-        last_flow : Flow = canvas.flows.filter(funnel=None, manual=False).order_by("-created_at").first()
-        last_flow_time = last_flow.created_at if last_flow else canvas.created_at
+@shared_task
+def run_due_funnels(items, dispatched_at):
+    slots = start_chunk("funnel", items, dispatched_at)
+    busy = []
+
+    with timed("cron.chunk_duration", kind="funnel", rows=len(items)):
+        funnels = Funnel.objects.filter(
+            pk__in=slots,
+            canvas__deleted=False,
+            flow_rate_type=FlowRateType.TIMELY,
+        ).only(
+            "id", "name", "canvas_id", "last_auto_flow_at", *Funnel._preserved_fields
+        )
+        for funnel in funnels:
+            slot = slots[funnel.pk]
+            if funnel.last_auto_flow_at and funnel.last_auto_flow_at >= slot:
+                continue
 
-        next_flow_time = croniter.croniter(cron, last_flow_time).get_next(timezone.now().__class__)
+            if has_missed_windows(funnel.flow_rate, slot, timezone.now()):
+                logger.info(f"Catching up funnel {funnel.name}")
+                fire = partial(catch_up, funnel.canvas_id)
+            else:
+                logger.info(f"Triggering funnel {funnel.name} flow")
+                fire = partial(
+                    trigger_funnel_flow,
+                    funnel,
+                    timely_trigger=True,
+                    bypass_last_flow=True,
+                )
+            fired = Funnel.objects.filter(pk=funnel.pk, last_auto_flow_at__gte=slot)
+            if not run_locked(funnel.canvas_id, fired.exists, fire):
+                busy.append((funnel.canvas_id, funnel.pk, slot.isoformat()))
 
-        if next_flow_time < now:
-            print(f"Triggering canvas {canvas.name} inflow")
-            trigger_canvas_inflow(canvas)
+    retry_busy(run_due_funnels, busy, dispatched_at)
 
-    # Fetch all funnels related to the canvases
-    all_funnels = Funnel.objects.filter(canvas__in=all_canvases, flow_rate_type=FlowRateType.TIMELY).select_related('canvas')
 
-    # Process each funnel
-    for funnel in all_funnels:
-        cron = funnel.flow_rate
-        last_flow = funnel.flows.filter(funnel__deleted=False, manual=False).order_by("-created_at").first()
-        last_flow_time = last_flow.created_at if last_flow else funnel.created_at
+@shared_task(bind=True)
+def cron_watch(self):
+    try:
+        return watch()
+    finally:
+        # Let the next HTTP trigger start a new run, unless this is a run
+        # that was not started over HTTP
+        if cache.get(CRON_JOB_CACHE_KEY) == self.request.id:
+            cache.delete(CRON_JOB_CACHE_KEY)
 
-        next_flow_time = croniter.croniter(cron, last_flow_time).get_next(timezone.now().__class__)
 
-        if next_flow_time < now:
-            print(f"Triggering funnel {funnel.name} flow")
+def watch():
+    # Fetch current time once
+    now = timezone.now()
+    chunk_size = settings.CRON_CHUNK_SIZE
 
-            trigger_funnel_flow(funnel, timely_trigger=True, bypass_last_flow=True)
+    # Only canvases whose precomputed next fire time has passed are due,
+    # which is a single range scan on the next_fire_at index. The dispatcher
+    # only reads ids; the flows run in run_due_canvases on the cron queues.
+    due_canvases = Canvas.objects.filter(next_fire_at__lte=now).values_list(
+        "id", "inflow_rate", "next_fire_at"
+    )
+    canvases = funnels = 0
+    for rows in chunked(due_canvases, chunk_size):
+        canvases += len(rows)
+        enqueued = set()
+        try:
+            dispatch(
+                run_due_canvases,
+                "canvas",
+                [(pk, pk, slot) for pk, _, slot in rows],
+                now,
+                enqueued,
+            )
+        finally:
+            # Rescheduled once enqueued, even if a later partition could not
+            # be, so the next tick does not dispatch them again; the chunk
+            # tasks skip slots that have already fired
+            reschedule(
+                Canvas, [(pk, expr) for pk, expr, _ in rows if pk in enqueued], now
+            )
 
-    if request:
-        return HttpResponse("Done")
-        
-        
+    due_funnels = Funnel.objects.filter(
+        canvas__deleted=False,
+        flow_rate_type=FlowRateType.TIMELY,
+        next_fire_at__lte=now,
+    ).values_list("id", "canvas_id", "flow_rate", "next_fire_at")
+    for rows in chunked(due_funnels, chunk_size):
+        funnels += len(rows)
+        enqueued = set()
+        try:
+            dispatch(
+                run_due_funnels,
+                "funnel",
+                [(canvas_id, pk, slot) for pk, canvas_id, _, slot in rows],
+                now,
+                enqueued,
+            )
+        finally:
+            reschedule(
+                Funnel, [(pk, expr) for pk, _, expr, _ in rows if pk in enqueued], now
+            )
 
+    return {"canvases": canvases, "funnels": funnels}
@@ -0,0 +1,27 @@
+from celery import shared_task
+
+from dhanriti.models.tanks import Canvas, Funnel
+from utils.flow import trigger_canvas_inflow, trigger_funnel_flow
+from utils.locks import CanvasBusy
+
+
+def run_manual_trigger(canvas_id, funnel_id=None):
+    """
+    Run a manual inflow into the canvas, or a manual flow through one of its
+    funnels, and return the external ids of the flows created.
+    """
+    if funnel_id:
+        funnel = Funnel.objects.get(pk=funnel_id, canvas_id=canvas_id)
+        flows = trigger_funnel_flow(funnel, bypass_last_flow=True, manual_trigger=True)
+    else:
+        canvas = Canvas.objects.get(pk=canvas_id)
+        flows = trigger_canvas_inflow(canvas, manual_trigger=True)
+    return [str(flow.external_id) for flow in flows]
+
+
+@shared_task(
+    bind=True, autoretry_for=(CanvasBusy,), retry_backoff=True, max_retries=5
+)
+def manual_trigger(self, canvas_id, funnel_id=None):
+    self.update_state(state="STARTED")
+    return {"flows": run_manual_trigger(canvas_id, funnel_id)}
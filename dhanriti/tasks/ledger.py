@@ -0,0 +1,8 @@
+from celery import shared_task
+
+from utils.ledger import take_snapshots
+
+
+@shared_task
+def snapshot_balances():
+    return take_snapshots()
@@ -0,0 +1,10 @@
+from celery import shared_task
+from django.conf import settings
+
+from utils.last_online import flush_last_online
+
+
+@shared_task
+def flush_last_online_task():
+    if settings.LAST_ONLINE_BUFFERED:
+        return flush_last_online()
@@ -1,4 +1,5 @@
-import requests
+from django.db import transaction
+from django.utils.decorators import method_decorator
 from drf_spectacular.utils import extend_schema
 from rest_framework import permissions, status
 from rest_framework.authtoken.models import Token
@@ -8,8 +9,8 @@ from rest_framework.mixins import RetrieveModelMixin
 from rest_framework.request import Request
 from rest_framework.response import Response
 
-from core.settings.base import VISHNU_API_KEY, VISHNU_HOST
 from utils.views.base import BaseModelViewSetPlain
+from utils.vishnu import VishnuUnavailable, get_vishnu_client
 from dhanriti.models import Login, User
 
 from ..serializers import (
@@ -19,6 +20,9 @@ from ..serializers import (
 )
 
 
+# Vishnu is called outside of a transaction so a slow response never holds
+# one open; the database work after it runs in its own atomic block
+@method_decorator(transaction.non_atomic_requests, name="dispatch")
 class APILoginView(CreateAPIView):
     serializer_class = VishnuLoginSerializer
     permission_classes = (permissions.AllowAny,)
@@ -32,13 +36,12 @@ class APILoginView(CreateAPIView):
         login_token = request.data.get("login_token")
         if login_token:
             try:
-                user_data_request = requests.get(
-                    VISHNU_HOST + "/users/token?token=" + login_token,
-                    headers={"X-API-KEY": VISHNU_API_KEY},
-                )
-                user_data = user_data_request.json()
-                print(user_data)
-                user_details = user_data.get("user")
+                user_data = get_vishnu_client().get_user_by_token(login_token)
+            except VishnuUnavailable:
+                raise ParseError("Could not connect to Vishnu")
+
+            user_details = user_data.get("user")
+            with transaction.atomic():
                 login = Login.objects.get(
                     service_token=user_data.get("service_token"), successful=False
                 )
@@ -56,40 +59,30 @@ class APILoginView(CreateAPIView):
                 login.user = user
                 login.successful = True
                 login.save()
-                return Response(
-                    {"token": login.token.key, "user": UserSerializer(user).data}
-                )
-            except requests.exceptions.ConnectionError:
-                raise ParseError("Could not connect to Vishnu")
+            return Response(
+                {"token": login.token.key, "user": UserSerializer(user).data}
+            )
         else:
             client_url = request.data.get("client_url")
             redirect_url = request.data.get("redirect")
             try:
-                service_token_request = requests.post(
-                    VISHNU_HOST + "/servicetoken",
-                    {
-                        "success_url": (
-                            client_url
-                            + "/vishnu-login?success=true&token=[token]"
-                            + (("&redirect=" + redirect_url) if redirect_url else "")
-                        ),
-                        "failure_url": client_url + "/vishnu-login?success=false",
-                    },
-                    headers={"X-API-KEY": VISHNU_API_KEY},
+                json_data = get_vishnu_client().create_service_token(
+                    success_url=(
+                        client_url
+                        + "/vishnu-login?success=true&token=[token]"
+                        + (("&redirect=" + redirect_url) if redirect_url else "")
+                    ),
+                    failure_url=client_url + "/vishnu-login?success=false",
                 )
-                # print raw 
-                print(service_token_request)
-                json_data = service_token_request.json()
-                print(json_data)
-                service_token = json_data["token"]
-                url = json_data["url"]
-                Login.objects.create(service_token=service_token)
-                return Response({"url": url, "token": service_token})
-            except requests.exceptions.ConnectionError:
+            except VishnuUnavailable:
                 return Response(
                     {"error": "Could not connect to Vishnu"},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 )
+            service_token = json_data["token"]
+            url = json_data["url"]
+            Login.objects.create(service_token=service_token)
+            return Response({"url": url, "token": service_token})
 
 
 class APILogoutView(DestroyAPIView):
@@ -0,0 +1,55 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponseForbidden, JsonResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+
+from dhanriti.tasks.cron import CRON_JOB_CACHE_KEY, cron_watch
+
+
+def check_cron_key(cron_key):
+    return bool(settings.CRON_KEY) and constant_time_compare(
+        cron_key, settings.CRON_KEY
+    )
+
+
+def get_job_response(job_id, status=200):
+    result = cron_watch.AsyncResult(job_id)
+    data = {"job_id": job_id, "status": result.status}
+    if result.successful():
+        data["result"] = result.result
+    return JsonResponse(data, status=status)
+
+
+@csrf_exempt
+@transaction.non_atomic_requests
+def cron_trigger(request, cron_key):
+    """
+    Enqueue a cron_watch run and return its job id at once. Hits while a
+    run is queued or in progress get that run's job id instead.
+    """
+    if not check_cron_key(cron_key):
+        return HttpResponseForbidden("Incorrect password")
+
+    job_id = str(uuid.uuid4())
+    if cache.add(CRON_JOB_CACHE_KEY, job_id, timeout=settings.CELERY_TASK_TIME_LIMIT):
+        try:
+            cron_watch.apply_async(task_id=job_id)
+        except Exception:
+            cache.delete(CRON_JOB_CACHE_KEY)
+            raise
+    else:
+        job_id = cache.get(CRON_JOB_CACHE_KEY, job_id)
+
+    return get_job_response(job_id, status=202)
+
+
+@transaction.non_atomic_requests
+def cron_job_status(request, cron_key, job_id):
+    if not check_cron_key(cron_key):
+        return HttpResponseForbidden("Incorrect password")
+
+    return get_job_response(job_id)
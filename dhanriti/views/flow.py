@@ -1,13 +1,20 @@
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404
-from dhanriti.models.tanks import Canvas, Flow, Funnel
+from dhanriti.models.tanks import Canvas, Flow, Funnel, Tank
 from dhanriti.serializers.tanks import (
     FlowDetailSerializer,
-    FlowSerializer,
+    FlowListSerializer,
+    FlowPreviewSerializer,
 )
-from utils.flow import trigger_canvas_inflow, trigger_funnel_flow
+from dhanriti.tasks.flows import manual_trigger, run_manual_trigger
+from utils.flow import preview_trigger
+from utils.pagination import CreatedAtCursorPagination
 from utils.views.base import BaseModelViewSetPlain
 from django_filters.rest_framework import (
+    DjangoFilterBackend,
     FilterSet,
+    UUIDFilter,
 )
 from rest_framework.mixins import (
     ListModelMixin,
@@ -15,21 +22,54 @@ from rest_framework.mixins import (
 )
 from rest_framework import permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 
+
+def get_job_cache_key(job_id):
+    return f"flows:job:{job_id}"
+
+
 class FlowFilter(FilterSet):
+    """
+    Tank and funnel external ids are resolved to primary keys up front, so
+    the flows are filtered on their own indexed columns instead of joining
+    through Funnel and Tank.
+    """
+
+    funnel__out_tank__external_id = UUIDFilter(method="filter_out_tank")
+    funnel__in_tank__external_id = UUIDFilter(method="filter_in_tank")
+    funnel__external_id = UUIDFilter(method="filter_funnel")
+
     class Meta:
         model = Flow
         fields = {
             "canvas__external_id": ["exact"],
-            "funnel__out_tank__external_id": ["exact"],
-            "funnel__in_tank__external_id": ["exact"],
-            "funnel__external_id": ["exact"],
             "flowed": ["exact", "lte", "gte"],
             "created_at": ["exact", "lte", "gte"],
             "modified_at": ["exact", "lte", "gte"],
         }
 
+    def filter_by_pk(self, queryset, field, model, external_id):
+        # Deleted tanks and funnels keep their flow history
+        pk = (
+            model._base_manager.filter(external_id=external_id)
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if pk is None:
+            return queryset.none()
+        return queryset.filter(**{field: pk})
+
+    def filter_out_tank(self, queryset, name, value):
+        return self.filter_by_pk(queryset, "out_tank_id", Tank, value)
+
+    def filter_in_tank(self, queryset, name, value):
+        return self.filter_by_pk(queryset, "in_tank_id", Tank, value)
+
+    def filter_funnel(self, queryset, name, value):
+        return self.filter_by_pk(queryset, "funnel_id", Funnel, value)
+
 
 class FlowViewSet(
     BaseModelViewSetPlain,
@@ -38,14 +78,39 @@ class FlowViewSet(
 ):
     queryset = Flow.objects.all()
     serializer_class = FlowDetailSerializer
+    serializer_action_classes = {
+        "list": FlowListSerializer,
+    }
     permission_classes = (permissions.IsAuthenticated,)
+    # No OrderingFilter: the keyset pagination always orders by
+    # (-created_at, -id), so an `ordering` parameter could not be honoured
+    filter_backends = (DjangoFilterBackend,)
     filterset_class = FlowFilter
+    pagination_class = CreatedAtCursorPagination
 
     lookup_field = "external_id"
 
     def get_queryset(self):
-        canvas_external_id = self.kwargs.get("canvas_external_id")
-        return super().get_queryset().filter(canvas__external_id=canvas_external_id)
+        if getattr(self, "swagger_fake_view", False):
+            # Schema generation, without a canvas or a user
+            return super().get_queryset().none()
+
+        # Resolved up front like FlowFilter's lookups, so the flows are read
+        # from the (canvas, -created_at, -id) index instead of a join
+        canvas_id = (
+            Canvas.objects.filter(
+                external_id=self.kwargs.get("canvas_external_id"),
+                user=self.request.user,
+            )
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if canvas_id is None:
+            raise NotFound()
+        queryset = super().get_queryset().filter(canvas_id=canvas_id)
+        if self.action == "list":
+            queryset = queryset.select_related("funnel", "in_tank", "out_tank")
+        return queryset
 
     def get_object(self):
         external_id = self.kwargs.get(self.lookup_field)
@@ -53,19 +118,91 @@ class FlowViewSet(
         obj = get_object_or_404(self.get_queryset(), external_id=external_id)
         return obj
     
-    @action(methods=["POST"], detail=False)
-    def trigger(self, *args, **kwargs):
+    def get_trigger_target(self):
+        """
+        The canvas to trigger, and the primary key of the funnel given by
+        `funnel_external_id` (None for an inflow).
+        """
         canvas_external_id = self.kwargs.get("canvas_external_id")
-        canvas = get_object_or_404(Canvas, external_id=canvas_external_id)
+        canvas = get_object_or_404(
+            Canvas, external_id=canvas_external_id, user=self.request.user
+        )
+        funnel_id = None
         funnel_external_id = self.request.query_params.get('funnel_external_id')
         if funnel_external_id:
-            funnel = get_object_or_404(Funnel, external_id=funnel_external_id)
-            print("triggering flow for funnel")
-            print(funnel)
-            trigger_funnel_flow(funnel, bypass_last_flow=True, manual_trigger=True)
-        else:
-            print("triggering flow for canvas")
-            print(canvas)
-            trigger_canvas_inflow(canvas, manual_trigger=True)
-        
-        return Response(status=status.HTTP_201_CREATED)
\ No newline at end of file
+            funnel = get_object_or_404(
+                Funnel, external_id=funnel_external_id, canvas=canvas
+            )
+            funnel_id = funnel.pk
+        return canvas, funnel_id
+
+    @action(methods=["POST"], detail=False)
+    def trigger(self, *args, **kwargs):
+        """
+        Enqueue a manual inflow, or a manual flow through the funnel given
+        by `funnel_external_id`, and return 202 with a job id. With `wait`
+        the cascade runs in the request and the flows are returned with 201.
+        """
+        canvas, funnel_id = self.get_trigger_target()
+
+        if self.request.query_params.get("wait", "").lower() in ("1", "true"):
+            flows = run_manual_trigger(canvas.pk, funnel_id)
+            return Response({"flows": flows}, status=status.HTTP_201_CREATED)
+
+        job = manual_trigger.delay(canvas.pk, funnel_id)
+        cache.set(
+            get_job_cache_key(job.id), canvas.pk, timeout=settings.FLOW_JOB_TTL
+        )
+        return Response(
+            {"job_id": job.id, "status": "PENDING"},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(methods=["GET"], detail=False)
+    def preview(self, *args, **kwargs):
+        """
+        The flows `trigger` would create, with the same parameters, and the
+        balance of the main tank and of every tank before and after them.
+        The cascade runs in memory on the canvas as loaded by the flow
+        engine, and nothing is written.
+        """
+        canvas, funnel_id = self.get_trigger_target()
+        engine = preview_trigger(canvas.pk, funnel_id)
+        tanks = [
+            {
+                "external_id": tank.external_id,
+                "name": tank.name,
+                "capacity": tank.capacity,
+                "before": tank.filled,
+                "after": engine.tank_filled[tank.pk],
+            }
+            for tank in engine.tanks.values()
+        ]
+        return Response(
+            {
+                "flows": FlowPreviewSerializer(engine.flows, many=True).data,
+                "main_tank": {
+                    "before": engine.canvas.filled,
+                    "after": engine.canvas_filled,
+                },
+                "tanks": tanks,
+            }
+        )
+
+    @action(methods=["GET"], detail=False, url_path=r"jobs/(?P<job_id>[^/.]+)")
+    def jobs(self, *args, job_id=None, **kwargs):
+        canvas = get_object_or_404(
+            Canvas,
+            external_id=self.kwargs.get("canvas_external_id"),
+            user=self.request.user,
+        )
+        if cache.get(get_job_cache_key(job_id)) != canvas.pk:
+            raise NotFound()
+
+        result = manual_trigger.AsyncResult(job_id)
+        data = {"job_id": job_id, "status": result.status, "flows": []}
+        if result.successful():
+            data["flows"] = result.result["flows"]
+        elif result.failed():
+            data["error"] = str(result.result)
+        return Response(data)
\ No newline at end of file
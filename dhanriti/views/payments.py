@@ -1,7 +1,10 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.shortcuts import get_object_or_404
 from dhanriti.models.payments import Payment
 from dhanriti.models.tanks import Tank
 from dhanriti.serializers.payments import PaymentsSerializer
+from utils.ledger import payment_entries, record_entries
+from utils.locks import canvas_lock
 from utils.views.base import BaseModelViewSet
 from rest_framework import permissions
 from rest_framework.serializers import ValidationError
@@ -29,10 +32,13 @@ class PaymentsViewSet(
         tank_external_id = self.kwargs.get("tank_external_id")
         tank = get_object_or_404(Tank, external_id=tank_external_id, canvas__user=self.request.user)
 
-        if tank.filled < serializer.validated_data["amount"]:
-            raise ValidationError("Payment amount is greater than tank filled amount")
+        with canvas_lock(tank.canvas_id):
+            try:
+                tank.debit(serializer.validated_data["amount"], guard=True)
+            except DjangoValidationError:
+                raise ValidationError(
+                    "Payment amount is greater than tank filled amount"
+                )
 
-        tank.filled -= serializer.validated_data["amount"]
-        tank.save()
-
-        serializer.save(tank=tank)
+            payment = serializer.save(tank=tank)
+            record_entries(payment_entries(payment, tank.canvas_id))
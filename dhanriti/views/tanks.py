@@ -1,11 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from dhanriti.models.enums import AccountType, RollupPeriod, RollupScope
+from dhanriti.models.rollups import FlowRollup
 from dhanriti.models.tanks import Canvas, Funnel, Tank
 from dhanriti.permissions import IsSelfOrReadOnly
 from dhanriti.serializers.tanks import (
+    BalanceAdjustmentSerializer,
     CanvasSerializer,
     FunnelSerializer,
     TankSerializer,
+    prefetch_canvas_graph,
+)
+from utils.forecast import forecast_canvas
+from utils.graph import get_funnel_graph
+from utils.ledger import (
+    adjustment_entries,
+    get_balance,
+    get_balance_range,
+    record_entries,
+    tank_deletion_entries,
 )
+from utils.locks import canvas_lock
 from utils.views.base import BaseModelViewSet, BaseModelViewSetPlain
 from rest_framework.mixins import (
     ListModelMixin,
@@ -15,6 +34,79 @@ from rest_framework.mixins import (
     UpdateModelMixin,
 )
 from rest_framework import permissions
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+
+def get_time_param(request, name, default=None):
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+    at = parse_datetime(value)
+    if at is None:
+        raise ValidationError({name: "Invalid date time"})
+    if timezone.is_naive(at):
+        at = timezone.make_aware(at)
+    return at
+
+
+def get_date_param(request, name, default=None):
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date is None:
+        raise ValidationError({name: "Invalid date"})
+    return date
+
+
+def get_balance_response(request, account_type, account_id):
+    """
+    The balance at `at` (default now), or with `start` the opening and
+    closing balance and the money moved in and out until `end`.
+    """
+    start = get_time_param(request, "start")
+    if start is None:
+        at = get_time_param(request, "at", timezone.now())
+        return Response(
+            {"at": at, "balance": get_balance(account_type, account_id, at)}
+        )
+
+    end = get_time_param(request, "end", timezone.now())
+    if end < start:
+        raise ValidationError({"end": "End must not be before start"})
+    data = get_balance_range(account_type, account_id, start, end)
+    return Response({"start": start, "end": end, **data})
+
+
+def adjust_balance_response(request, instance, account_type, canvas_id):
+    """
+    Set the balance of a canvas main tank or a tank to the posted `filled`.
+    The difference is applied as a delta under the canvas lock and
+    recorded in the ledger as an adjustment.
+    """
+    serializer = BalanceAdjustmentSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    with canvas_lock(canvas_id):
+        instance.filled = (
+            type(instance)
+            ._base_manager.filter(pk=instance.pk)
+            .values_list("filled", flat=True)
+            .get()
+        )
+        difference = serializer.validated_data["filled"] - instance.filled
+        if difference:
+            instance.credit(difference)
+            record_entries(
+                adjustment_entries(
+                    canvas_id, (account_type, instance.pk), difference, timezone.now()
+                )
+            )
+    return Response({"filled": instance.filled})
 
 
 class CanvasViewSet(
@@ -27,7 +119,10 @@ class CanvasViewSet(
     lookup_field = "external_id"
 
     def get_queryset(self):
-        return super().get_queryset().filter(user=self.request.user)
+        queryset = super().get_queryset().filter(user=self.request.user)
+        if self.action in ("list", "retrieve"):
+            queryset = prefetch_canvas_graph(queryset)
+        return queryset
 
     def get_object(self):
         external_id = self.kwargs.get(self.lookup_field)
@@ -35,6 +130,117 @@ class CanvasViewSet(
         obj = get_object_or_404(self.get_queryset(), external_id=external_id)
         return obj
 
+    @action(methods=["GET"], detail=True)
+    def balance(self, *args, **kwargs):
+        """
+        Balance of the main tank of the canvas, see get_balance_response.
+        """
+        canvas = get_object_or_404(
+            Canvas,
+            external_id=self.kwargs.get(self.lookup_field),
+            user=self.request.user,
+        )
+        return get_balance_response(self.request, AccountType.CANVAS, canvas.pk)
+
+    @action(methods=["POST"], detail=True)
+    def adjust(self, *args, **kwargs):
+        """
+        Set the balance of the main tank of the canvas, see
+        adjust_balance_response.
+        """
+        canvas = self.get_object()
+        return adjust_balance_response(
+            self.request, canvas, AccountType.CANVAS, canvas.pk
+        )
+
+    @action(methods=["GET"], detail=True)
+    def stats(self, *args, **kwargs):
+        """
+        Flow totals per day, or per month with `period=month`, for the canvas
+        inflows, each tank and each funnel, read from the flow rollups.
+        `start` and `end` are dates and default to the last 30 days or 12
+        months.
+        """
+        canvas = get_object_or_404(
+            Canvas,
+            external_id=self.kwargs.get(self.lookup_field),
+            user=self.request.user,
+        )
+        period = self.request.query_params.get("period", "day")
+        if period not in ("day", "month"):
+            raise ValidationError({"period": "Must be day or month"})
+
+        end = get_date_param(self.request, "end", timezone.localdate())
+        if period == "day":
+            start = get_date_param(self.request, "start", end - timedelta(days=29))
+        else:
+            start = get_date_param(
+                self.request, "start", end.replace(day=1) - timedelta(days=334)
+            ).replace(day=1)
+        if end < start:
+            raise ValidationError({"end": "End must not be before start"})
+
+        external_ids = {
+            RollupScope.CANVAS: {canvas.pk: canvas.external_id},
+            RollupScope.TANK: dict(
+                Tank._base_manager.filter(canvas=canvas).values_list(
+                    "pk", "external_id"
+                )
+            ),
+            RollupScope.FUNNEL: dict(
+                Funnel._base_manager.filter(canvas=canvas).values_list(
+                    "pk", "external_id"
+                )
+            ),
+        }
+        rollups = FlowRollup.objects.filter(
+            canvas=canvas,
+            period=RollupPeriod[period.upper()],
+            bucket__gte=start,
+            bucket__lte=end,
+        ).order_by("bucket", "scope", "scope_id")
+        results = [
+            {
+                "scope": RollupScope(rollup.scope).name.lower(),
+                "external_id": external_ids[rollup.scope].get(rollup.scope_id),
+                "bucket": rollup.bucket,
+                "flowed": rollup.flowed,
+                "count": rollup.count,
+                "manual_count": rollup.manual_count,
+                "reduced_count": rollup.reduced_count,
+            }
+            for rollup in rollups
+        ]
+        return Response(
+            {"period": period, "start": start, "end": end, "results": results}
+        )
+
+    @action(methods=["GET"], detail=True)
+    def forecast(self, *args, **kwargs):
+        """
+        Projected balances of the main tank and every tank at the start of
+        each month (or day with `period=day`, in UTC) over the next
+        `months` months, from the inflow and timely funnel schedules.
+        Nothing is written.
+        """
+        canvas = get_object_or_404(
+            Canvas,
+            external_id=self.kwargs.get(self.lookup_field),
+            user=self.request.user,
+        )
+        period = self.request.query_params.get("period", "month")
+        if period not in ("day", "month"):
+            raise ValidationError({"period": "Must be day or month"})
+        try:
+            months = int(self.request.query_params.get("months", 12))
+        except ValueError:
+            months = 0
+        if not 1 <= months <= settings.FORECAST_MAX_MONTHS:
+            raise ValidationError(
+                {"months": f"Must be between 1 and {settings.FORECAST_MAX_MONTHS}"}
+            )
+        return Response(forecast_canvas(canvas.pk, timezone.now(), months, period))
+
 
 class TankViewSet(BaseModelViewSet):
     queryset = Tank.objects.all()
@@ -67,14 +273,35 @@ class TankViewSet(BaseModelViewSet):
     def destroy(self, request, *args, **kwargs):
         strategy = request.data.get("strategy", "transfer")
         canvas_external_id = self.kwargs.get("canvas_external_id")
-        if strategy != "discard":
-            canvas = Canvas.objects.get(
-            external_id=canvas_external_id, user=self.request.user
-            )
-            canvas.filled += self.get_object().filled
-            canvas.save()
+        canvas = get_object_or_404(
+            Canvas, external_id=canvas_external_id, user=self.request.user
+        )
+        with canvas_lock(canvas.pk):
+            tank = self.get_object()
+            if strategy != "discard":
+                canvas.credit(tank.filled)
+            record_entries(tank_deletion_entries(tank, discard=strategy == "discard"))
+
+            return super().destroy(request, *args, **kwargs)
 
-        return super().destroy(request, *args, **kwargs)
+    @action(methods=["GET"], detail=True)
+    def balance(self, *args, **kwargs):
+        """
+        Balance of the tank, see get_balance_response.
+        """
+        return get_balance_response(
+            self.request, AccountType.TANK, self.get_object().pk
+        )
+
+    @action(methods=["POST"], detail=True)
+    def adjust(self, *args, **kwargs):
+        """
+        Set the balance of the tank, see adjust_balance_response.
+        """
+        tank = self.get_object()
+        return adjust_balance_response(
+            self.request, tank, AccountType.TANK, tank.canvas_id
+        )
 
 
 class FunnelViewSet(BaseModelViewSet):
@@ -115,6 +342,13 @@ class FunnelViewSet(BaseModelViewSet):
 
         out_tank = Tank.objects.get(external_id=out_tank_external_id, canvas__user=self.request.user)
 
-        print(in_tank, out_tank)
-
-        serializer.save(in_tank=in_tank, out_tank=out_tank, canvas=out_tank.canvas)
\ No newline at end of file
+        # Checked against the stored funnels under the canvas lock, so two
+        # funnels that only close a cycle together cannot both be created
+        canvas_id = out_tank.canvas_id
+        with canvas_lock(canvas_id):
+            graph = get_funnel_graph(canvas_id)
+            if graph.creates_cycle(in_tank and in_tank.pk, out_tank.pk):
+                raise ValidationError(
+                    {"out_tank_external_id": "This funnel would create a cycle"}
+                )
+            serializer.save(in_tank=in_tank, out_tank=out_tank, canvas=out_tank.canvas)
\ No newline at end of file
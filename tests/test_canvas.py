@@ -0,0 +1,78 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from dhanriti.models import User
+from dhanriti.models.enums import FlowRateType, FlowType
+from dhanriti.models.tanks import Canvas, Funnel, Tank
+from utils.flow import trigger_canvas_inflow
+
+
+class CanvasQueryCountTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="canvas@dhanriti.net", username="canvas", password="password"
+        )
+        self.client.force_authenticate(self.user)
+
+    def create_canvas(self, depth, width):
+        canvas = Canvas.objects.create(
+            name="Canvas", user=self.user, inflow=1000, inflow_rate="0 9 1 * *"
+        )
+        parents = [None]
+        for _ in range(depth):
+            level = []
+            for parent in parents:
+                for _ in range(width):
+                    tank = Tank.objects.create(name="Tank", canvas=canvas, capacity=10000)
+                    Funnel.objects.create(
+                        canvas=canvas,
+                        in_tank=parent,
+                        out_tank=tank,
+                        flow=10,
+                        flow_type=FlowType.PERCENTAGE,
+                        flow_rate_type=FlowRateType.CONSEQUENT,
+                    )
+                    level.append(tank)
+            parents = level
+
+        for _ in range(6):
+            trigger_canvas_inflow(canvas)
+        return canvas
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_list_query_count_does_not_grow_with_canvases(self):
+        self.create_canvas(depth=1, width=1)
+        small = self.count_queries("/v1/canvases")
+
+        for _ in range(3):
+            self.create_canvas(depth=3, width=2)
+        large = self.count_queries("/v1/canvases")
+
+        self.assertEqual(small, large)
+
+    def test_retrieve_query_count_does_not_grow_with_graph(self):
+        small_canvas = self.create_canvas(depth=1, width=1)
+        large_canvas = self.create_canvas(depth=4, width=2)
+
+        small = self.count_queries(f"/v1/canvases/{small_canvas.external_id}")
+        large = self.count_queries(f"/v1/canvases/{large_canvas.external_id}")
+
+        self.assertEqual(small, large)
+
+    def test_retrieve_renders_nested_funnels(self):
+        canvas = self.create_canvas(depth=2, width=2)
+
+        response = self.client.get(f"/v1/canvases/{canvas.external_id}")
+
+        self.assertEqual(len(response.data["funnels"]), 2)
+        child_funnels = response.data["funnels"][0]["out_tank"]["funnels"]
+        self.assertEqual(len(child_funnels), 2)
+        self.assertEqual(len(child_funnels[0]["last_flows"]), 5)
+        self.assertEqual(len(response.data["last_flows"]), 5)
+        self.assertAlmostEqual(response.data["total_money"], 6000)
@@ -0,0 +1,137 @@
+from threading import Barrier, Lock
+from unittest import mock
+
+import requests
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from rest_framework import serializers
+
+from utils.cdn import CDNClient, CDNError, LocalTTLCache
+from utils.verifyHTML import verify_html
+
+
+class FakeResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        if self.data is None:
+            raise ValueError("No JSON")
+        return self.data
+
+
+class FakeSession:
+    """
+    Answers /info lookups from `infos`, with a 404 for unknown files. With
+    `barrier`, every lookup waits for the others, so lookups that are not
+    made concurrently break it.
+    """
+
+    def __init__(self, infos, barrier=None, error=None):
+        self.infos = infos
+        self.barrier = barrier
+        self.error = error
+        self.names = []
+        self.lock = Lock()
+
+    def get(self, url, params, timeout):
+        with self.lock:
+            self.names.append(params["f"])
+        if self.error:
+            raise self.error
+        if self.barrier:
+            self.barrier.wait()
+        info = self.infos.get(params["f"])
+        return FakeResponse(200, info) if info else FakeResponse(404, None)
+
+
+class LocalTTLCacheTest(SimpleTestCase):
+    def test_entries_expire(self):
+        local = LocalTTLCache(maxsize=4, ttl=10)
+        with mock.patch("utils.cdn.time.monotonic", return_value=100):
+            local.set("a", 1)
+        with mock.patch("utils.cdn.time.monotonic", return_value=110):
+            self.assertEqual(local.get("a"), 1)
+        with mock.patch("utils.cdn.time.monotonic", return_value=111):
+            self.assertIsNone(local.get("a"))
+        self.assertNotIn("a", local.entries)
+
+    def test_least_recently_used_is_evicted(self):
+        local = LocalTTLCache(maxsize=2, ttl=10)
+        local.set("a", 1)
+        local.set("b", 2)
+        local.get("a")
+        local.set("c", 3)
+
+        self.assertEqual(local.get("a"), 1)
+        self.assertIsNone(local.get("b"))
+        self.assertEqual(local.get("c"), 3)
+
+
+@override_settings(CDN_LOOKUP_CONCURRENCY=8)
+class CDNClientTest(SimpleTestCase):
+    infos = {
+        name: {"meta": {"type": 2, "part": 7}} for name in ("abc", "def", "ghi")
+    }
+
+    def setUp(self):
+        cache.clear()
+
+    def get_client(self, session):
+        client = CDNClient()
+        client.session = session
+        return client
+
+    def test_misses_are_fetched_concurrently(self):
+        session = FakeSession(self.infos, barrier=Barrier(3, timeout=5))
+        client = self.get_client(session)
+
+        results = client.get_many(["abc", "def", "ghi", "abc"])
+
+        self.assertEqual(results, self.infos)
+        self.assertCountEqual(session.names, ["abc", "def", "ghi"])
+
+    def test_lookups_are_cached(self):
+        session = FakeSession(self.infos)
+        client = self.get_client(session)
+        client.get_many(["abc", "def"])
+
+        # Served from the process cache
+        self.assertEqual(client.get_info("abc"), self.infos["abc"])
+        self.assertEqual(len(session.names), 2)
+
+        # A new process reads them from the Django cache
+        other = self.get_client(FakeSession({}))
+        self.assertEqual(
+            other.get_many(["abc", "def"]),
+            {"abc": self.infos["abc"], "def": self.infos["def"]},
+        )
+        self.assertEqual(other.session.names, [])
+        self.assertEqual(other.local.get("def"), self.infos["def"])
+
+    def test_unknown_files_are_not_cached(self):
+        session = FakeSession(self.infos)
+        client = self.get_client(session)
+
+        self.assertIsNone(client.get_info("xyz"))
+        self.assertIsNone(client.get_info("xyz"))
+        self.assertEqual(session.names, ["xyz", "xyz"])
+
+    def test_request_errors(self):
+        error = requests.exceptions.ConnectionError("Connection refused")
+        client = self.get_client(FakeSession(self.infos, error=error))
+
+        with self.assertRaisesMessage(CDNError, "Connection refused"):
+            client.get_many(["abc", "def"])
+
+    def test_verify_html_reports_request_errors(self):
+        error = requests.exceptions.ConnectTimeout("Timed out")
+        client = self.get_client(FakeSession(self.infos, error=error))
+        value = '<div><img src="https://cdn.dhanriti.net/media/abc_1.png"></div>'
+
+        with mock.patch("utils.verifyHTML.get_cdn_client", return_value=client):
+            with self.assertRaisesMessage(
+                serializers.ValidationError, "Unable to verify image URL"
+            ):
+                verify_html(value, 2, 7)
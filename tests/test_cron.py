@@ -0,0 +1,452 @@
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from unittest import mock
+
+import croniter
+from celery import states
+from celery.result import EagerResult
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone as django_timezone
+
+from core.celery_app import app
+from dhanriti.models import User
+from dhanriti.models.enums import FlowRateType, FlowType
+from dhanriti.models.tanks import Canvas, Flow, Funnel, Tank
+from dhanriti.tasks.cron import (
+    CRON_JOB_CACHE_KEY,
+    cron_watch,
+    get_queue,
+    run_due_canvases,
+    watch,
+)
+from utils.cron import compile_cron, get_next_fire_times
+from utils.flow import get_missed_fire_times
+from utils.helpers import get_next_fire_time
+
+
+class CronExpressionTest(SimpleTestCase):
+    after = datetime(2024, 2, 28, 23, 59, 30, tzinfo=timezone.utc)
+
+    def test_next_after_matches_croniter(self):
+        expressions = [
+            "0 9 1 * *",
+            "*/15 * * * *",
+            "30 18 * * 1-5",
+            "0 0 1,15 * 7",
+            "5/20 */6 29 2 *",
+            "0 0 1-7 * 1",
+            "0 12 * 4-10/2 *",
+        ]
+        for expr in expressions:
+            with self.subTest(expr=expr):
+                expected = croniter.croniter(expr, self.after).get_next(datetime)
+                self.assertEqual(compile_cron(expr).next_after(self.after), expected)
+
+    def test_matches(self):
+        cron = compile_cron("0 9 1 * 1")
+
+        self.assertTrue(cron.matches(datetime(2024, 3, 1, 9, 0, 45)))
+        # Restricted day of month and day of week match either
+        self.assertTrue(cron.matches(datetime(2024, 3, 4, 9, 0)))
+        self.assertFalse(cron.matches(datetime(2024, 3, 5, 9, 0)))
+        self.assertFalse(cron.matches(datetime(2024, 3, 1, 9, 1)))
+
+    def test_never_fires(self):
+        self.assertIsNone(compile_cron("0 0 31 2 *").next_after(self.after))
+
+    def test_invalid_expressions(self):
+        for expr in [
+            "* * * *",
+            "60 * * * *",
+            "* * 0 * *",
+            "5-1 * * * *",
+            "*/0 * * * *",
+            None,
+            5,
+        ]:
+            with self.subTest(expr=expr):
+                with self.assertRaises(ValidationError):
+                    compile_cron(expr)
+
+    def test_missed_fire_times(self):
+        since = datetime(2024, 1, 1, 0, 30, tzinfo=timezone.utc)
+        until = datetime(2024, 1, 1, 5, 0, tzinfo=timezone.utc)
+        hours = [datetime(2024, 1, 1, hour, tzinfo=timezone.utc) for hour in range(7)]
+
+        self.assertEqual(
+            get_missed_fire_times("0 * * * *", since, until, 10), (hours[1:6], hours[6])
+        )
+        self.assertEqual(
+            get_missed_fire_times("0 * * * *", since, until, 2), (hours[1:3], hours[3])
+        )
+        self.assertEqual(
+            get_missed_fire_times("0 9 * * *", since, until, 10),
+            ([], datetime(2024, 1, 1, 9, tzinfo=timezone.utc)),
+        )
+
+    def test_next_fire_times_per_distinct_expression(self):
+        compile_cron.cache_clear()
+
+        result = get_next_fire_times(["0 9 1 * *"] * 50 + ["0 0 * * *"], self.after)
+
+        self.assertEqual(len(result), 2)
+        self.assertEqual(compile_cron.cache_info().misses, 2)
+
+
+class NextFireScheduleTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="schedule@dhanriti.net", username="schedule", password="password"
+        )
+        self.canvas = Canvas.objects.create(
+            name="Canvas", user=self.user, inflow=1000, inflow_rate="0 9 1 * *"
+        )
+        self.tank = Tank.objects.create(name="Savings", canvas=self.canvas)
+        self.funnel = Funnel.objects.create(
+            canvas=self.canvas,
+            out_tank=self.tank,
+            flow=10,
+            flow_type=FlowType.PERCENTAGE,
+            flow_rate="0 9 * * *",
+            flow_rate_type=FlowRateType.TIMELY,
+        )
+
+    def assertScheduledFromNow(self, instance, expression, save):
+        before = django_timezone.now()
+        save()
+        after = django_timezone.now()
+        instance.refresh_from_db()
+        self.assertGreaterEqual(
+            instance.next_fire_at, get_next_fire_time(expression, before)
+        )
+        self.assertLessEqual(
+            instance.next_fire_at, get_next_fire_time(expression, after)
+        )
+
+    def test_new_rows_are_scheduled(self):
+        self.assertEqual(
+            self.canvas.next_fire_at,
+            get_next_fire_time("0 9 1 * *", self.canvas.created_at),
+        )
+        self.assertEqual(
+            self.funnel.next_fire_at,
+            get_next_fire_time("0 9 * * *", self.funnel.created_at),
+        )
+
+    def test_canvas_rate_change_reschedules(self):
+        self.canvas.inflow_rate = "0 * * * *"
+        self.assertScheduledFromNow(self.canvas, "0 * * * *", self.canvas.save)
+
+        self.canvas.inflow_rate = "30 * * * *"
+        self.assertScheduledFromNow(
+            self.canvas,
+            "30 * * * *",
+            lambda: self.canvas.save(update_fields=["inflow_rate"]),
+        )
+
+    def test_funnel_rate_change_reschedules(self):
+        self.funnel.flow_rate = "0 * * * *"
+        self.assertScheduledFromNow(self.funnel, "0 * * * *", self.funnel.save)
+
+        self.funnel.flow_rate_type = FlowRateType.CONSEQUENT
+        self.funnel.save(update_fields=["flow_rate_type"])
+        self.funnel.refresh_from_db()
+        self.assertIsNone(self.funnel.next_fire_at)
+
+        self.funnel.flow_rate_type = FlowRateType.TIMELY
+        self.assertScheduledFromNow(self.funnel, "0 * * * *", self.funnel.save)
+
+    def test_timely_funnel_without_rate_is_not_scheduled(self):
+        funnel = Funnel.objects.create(
+            canvas=self.canvas,
+            out_tank=self.tank,
+            flow=10,
+            flow_type=FlowType.PERCENTAGE,
+            flow_rate_type=FlowRateType.TIMELY,
+        )
+        self.assertIsNone(funnel.next_fire_at)
+
+        self.funnel.flow_rate = None
+        self.funnel.save()
+        self.funnel.refresh_from_db()
+        self.assertIsNone(self.funnel.next_fire_at)
+
+    def test_other_changes_keep_the_schedule(self):
+        canvas_next, funnel_next = self.canvas.next_fire_at, self.funnel.next_fire_at
+
+        self.canvas.name = "Renamed"
+        self.canvas.inflow = 2000
+        self.canvas.last_auto_flow_at = django_timezone.now()
+        self.canvas.save()
+        self.funnel.flow = 20
+        self.funnel.save(update_fields=["flow"])
+
+        self.canvas.refresh_from_db()
+        self.funnel.refresh_from_db()
+        self.assertEqual(self.canvas.next_fire_at, canvas_next)
+        self.assertEqual(self.funnel.next_fire_at, funnel_next)
+
+
+class CronWatchTest(TestCase):
+    def setUp(self):
+        # Chunk tasks run in the dispatching process
+        for setting in ("task_always_eager", "task_eager_propagates"):
+            self.addCleanup(setattr, app.conf, setting, app.conf[setting])
+            app.conf[setting] = True
+
+        self.user = User.objects.create_user(
+            email="cron@dhanriti.net", username="cron", password="password"
+        )
+        self.now = django_timezone.now()
+
+    def create_canvas(self, **kwargs):
+        return Canvas.objects.create(
+            name="Canvas",
+            user=self.user,
+            inflow=1000,
+            inflow_rate="0 9 1 * *",
+            **kwargs,
+        )
+
+    def make_due(self, model, *instances):
+        model.objects.filter(pk__in=[instance.pk for instance in instances]).update(
+            next_fire_at=self.now - timedelta(minutes=1)
+        )
+
+    def get_next_fire_at(self, instance):
+        return (
+            type(instance)
+            .objects.values_list("next_fire_at", flat=True)
+            .get(pk=instance.pk)
+        )
+
+    @override_settings(CRON_PARTITIONS=2)
+    def test_enqueued_canvases_are_rescheduled_when_dispatch_fails(self):
+        canvases = [self.create_canvas() for _ in range(2)]
+        if get_queue(canvases[0].pk) == get_queue(canvases[1].pk):
+            canvases[1] = self.create_canvas()
+        self.make_due(Canvas, *canvases)
+
+        with mock.patch.object(
+            run_due_canvases, "apply_async", side_effect=[None, OSError]
+        ) as apply_async:
+            with self.assertRaises(OSError):
+                watch()
+
+        enqueued_queue = apply_async.call_args_list[0].kwargs["queue"]
+        for canvas in canvases:
+            # Only the partition that was enqueued has moved on
+            enqueued = get_queue(canvas.pk) == enqueued_queue
+            self.assertEqual(self.get_next_fire_at(canvas) > self.now, enqueued)
+
+    def test_chunks_do_not_fire_a_slot_twice(self):
+        canvas = self.create_canvas()
+        self.make_due(Canvas, canvas)
+        slot = self.get_next_fire_at(canvas)
+
+        self.assertEqual(watch()["canvases"], 1)
+        # A redelivered chunk finds the slot fired
+        run_due_canvases([(canvas.pk, slot.isoformat())], self.now.isoformat())
+
+        self.assertEqual(Flow.objects.filter(canvas=canvas).count(), 1)
+        self.assertGreater(self.get_next_fire_at(canvas), self.now)
+
+    def test_due_timely_funnel(self):
+        canvas = self.create_canvas(filled=1000)
+        funnel = Funnel.objects.create(
+            canvas=canvas,
+            out_tank=Tank.objects.create(name="Savings", canvas=canvas),
+            flow=10,
+            flow_type=FlowType.PERCENTAGE,
+            flow_rate_type=FlowRateType.TIMELY,
+            flow_rate="0 9 1 * *",
+        )
+        self.make_due(Funnel, funnel)
+
+        result = cron_watch.apply().get()
+
+        self.assertEqual(result, {"canvases": 0, "funnels": 1})
+        self.assertEqual(Flow.objects.get(funnel=funnel).flowed, 100)
+        self.assertGreater(self.get_next_fire_at(funnel), self.now)
+
+    def test_missed_windows_are_caught_up(self):
+        canvas = Canvas.objects.create(
+            name="Canvas", user=self.user, inflow=1000, inflow_rate="0 * * * *"
+        )
+        # The beat and the workers were down for five hours
+        last = self.now - timedelta(hours=5)
+        Canvas.objects.filter(pk=canvas.pk).update(
+            last_auto_flow_at=last, next_fire_at=get_next_fire_time("0 * * * *", last)
+        )
+
+        self.assertEqual(watch()["canvases"], 1)
+
+        inflows = Flow.objects.filter(canvas=canvas, funnel=None).order_by("created_at")
+        self.assertEqual(len(inflows), 5)
+        for inflow in inflows:
+            # Stamped with the time of its window
+            self.assertEqual(inflow.created_at.minute, 0)
+            self.assertEqual(inflow.created_at.second, 0)
+        self.assertGreater(self.get_next_fire_at(canvas), self.now)
+
+        # Nothing is due until the next window
+        self.assertEqual(watch(), {"canvases": 0, "funnels": 0})
+
+
+class CatchUpFlowsCommandTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(
+            email="catchup@dhanriti.net", username="catchup", password="password"
+        )
+        self.canvas = Canvas.objects.create(
+            name="Canvas", user=user, inflow=1000, inflow_rate="0 * * * *"
+        )
+        self.funnel = Funnel.objects.create(
+            canvas=self.canvas,
+            out_tank=Tank.objects.create(name="Savings", canvas=self.canvas),
+            flow=10,
+            flow_type=FlowType.PERCENTAGE,
+            flow_rate_type=FlowRateType.TIMELY,
+            flow_rate="0 * * * *",
+        )
+
+        # Created five hours ago and never fired since
+        self.now = django_timezone.now()
+        created_at = self.now - timedelta(hours=5)
+        for instance in (self.canvas, self.funnel):
+            type(instance).objects.filter(pk=instance.pk).update(
+                created_at=created_at,
+                next_fire_at=get_next_fire_time("0 * * * *", created_at),
+            )
+
+    def catch_up(self, *args):
+        out = StringIO()
+        call_command("catch_up_flows", *args, stdout=out)
+        return out.getvalue()
+
+    def get_flow_times(self, **filters):
+        return list(
+            Flow.objects.filter(canvas=self.canvas, **filters)
+            .order_by("created_at")
+            .values_list("created_at", flat=True)
+        )
+
+    def test_dry_run(self):
+        output = self.catch_up("--dry-run")
+
+        self.assertIn("Would fire 10 windows (10 flows) on 1 canvases", output)
+        self.assertFalse(Flow.objects.exists())
+        self.canvas.refresh_from_db()
+        self.assertLessEqual(self.canvas.next_fire_at, self.now)
+
+    def test_schedule_change_is_not_caught_up(self):
+        self.canvas.inflow_rate = "30 * * * *"
+        self.canvas.save()
+        self.funnel.flow_rate_type = FlowRateType.CONSEQUENT
+        self.funnel.save()
+        self.funnel.flow_rate_type = FlowRateType.TIMELY
+        self.funnel.save()
+
+        self.catch_up("--canvas", str(self.canvas.external_id))
+
+        # The new schedules start from the change
+        self.assertFalse(Flow.objects.exists())
+        for instance in (self.canvas, self.funnel):
+            instance.refresh_from_db()
+            self.assertGreater(instance.next_fire_at, self.now)
+
+    def test_limit(self):
+        output = self.catch_up("--limit", "3")
+
+        self.assertIn("more windows remain", output)
+        inflow_times = self.get_flow_times(funnel=None)
+        self.assertEqual(len(inflow_times), 3)
+        self.assertEqual(inflow_times, self.get_flow_times(funnel=self.funnel))
+        self.canvas.refresh_from_db()
+        # Rescheduled at the first window left
+        self.assertEqual(
+            self.canvas.next_fire_at, inflow_times[-1] + timedelta(hours=1)
+        )
+        self.assertEqual(self.canvas.last_auto_flow_at, inflow_times[-1])
+
+        # A second run continues where the first stopped
+        output = self.catch_up()
+
+        self.assertIn("Fired 4 windows (4 flows) on 1 canvases", output)
+        inflow_times = self.get_flow_times(funnel=None)
+        self.assertEqual(len(inflow_times), 5)
+        self.assertEqual(len(set(inflow_times)), 5)
+        self.assertEqual(len(self.get_flow_times(funnel=self.funnel)), 5)
+        self.canvas.refresh_from_db()
+        self.assertGreater(self.canvas.next_fire_at, self.now)
+
+
+@override_settings(CRON_KEY="secret")
+class CronEndpointTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(cron_watch, "apply_async")
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Job states, as the result backend would report them
+        self.results = {}
+        patcher = mock.patch.object(cron_watch, "AsyncResult", self.get_result)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_result(self, job_id):
+        return self.results.get(job_id, EagerResult(job_id, None, states.PENDING))
+
+    def test_key_is_required(self):
+        self.assertEqual(self.client.get("/v1/cron/wrong/").status_code, 403)
+        with override_settings(CRON_KEY=""):
+            self.assertEqual(self.client.get("/v1/cron/secret/").status_code, 403)
+        self.apply_async.assert_not_called()
+
+        response = self.client.get("/v1/cron/wrong/jobs/job/")
+        self.assertEqual(response.status_code, 403)
+
+    def test_hits_coalesce_into_the_run_in_flight(self):
+        first = self.client.get("/v1/cron/secret/")
+        second = self.client.get("/v1/cron/secret/")
+
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.status_code, 202)
+        job_id = first.json()["job_id"]
+        self.assertEqual(second.json()["job_id"], job_id)
+        self.apply_async.assert_called_once_with(task_id=job_id)
+
+        # The run lets go of the job once it is done
+        self.assertEqual(cache.get(CRON_JOB_CACHE_KEY), job_id)
+        cron_watch.apply(task_id=job_id)
+        self.assertIsNone(cache.get(CRON_JOB_CACHE_KEY))
+
+        third = self.client.get("/v1/cron/secret/")
+        self.assertNotEqual(third.json()["job_id"], job_id)
+        self.assertEqual(self.apply_async.call_count, 2)
+
+    def test_failed_enqueue_does_not_block_later_runs(self):
+        self.apply_async.side_effect = OSError
+        with self.assertRaises(OSError):
+            self.client.get("/v1/cron/secret/")
+        self.assertIsNone(cache.get(CRON_JOB_CACHE_KEY))
+
+    def test_job_status(self):
+        job_id = self.client.get("/v1/cron/secret/").json()["job_id"]
+        url = f"/v1/cron/secret/jobs/{job_id}/"
+
+        response = self.client.get(url)
+        self.assertEqual(response.json(), {"job_id": job_id, "status": "PENDING"})
+
+        result = {"canvases": 1, "funnels": 0}
+        self.results[job_id] = EagerResult(job_id, result, states.SUCCESS)
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(), {"job_id": job_id, "status": "SUCCESS", "result": result}
+        )
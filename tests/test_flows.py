@@ -0,0 +1,368 @@
+from datetime import timedelta
+from importlib import import_module
+from unittest import mock
+
+from celery import states
+from celery.result import EagerResult
+from django.apps import apps
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from dhanriti.models import User
+from dhanriti.models.enums import FlowRateType, FlowType
+from dhanriti.models.tanks import Canvas, Flow, Funnel, Tank
+from dhanriti.tasks.flows import manual_trigger, run_manual_trigger
+from utils.flow import trigger_canvas_inflow
+
+
+class FlowHistoryFilterTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="flows@dhanriti.net", username="flows", password="password"
+        )
+        self.client.force_authenticate(self.user)
+
+        self.canvas = Canvas.objects.create(
+            name="Canvas", user=self.user, inflow=1000, inflow_rate="0 9 1 * *"
+        )
+        self.savings = Tank.objects.create(
+            name="Savings", canvas=self.canvas, capacity=10000
+        )
+        self.travel = Tank.objects.create(
+            name="Travel", canvas=self.canvas, capacity=10000
+        )
+        for in_tank, out_tank in ((None, self.savings), (self.savings, self.travel)):
+            Funnel.objects.create(
+                canvas=self.canvas,
+                in_tank=in_tank,
+                out_tank=out_tank,
+                flow=10,
+                flow_type=FlowType.PERCENTAGE,
+                flow_rate_type=FlowRateType.CONSEQUENT,
+            )
+        trigger_canvas_inflow(self.canvas)
+
+    def get_flows(self, **params):
+        response = self.client.get(
+            f"/v1/canvases/{self.canvas.external_id}/flows", params
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data["results"]
+
+    def test_flows_carry_funnel_tanks(self):
+        flows = Flow.objects.filter(canvas=self.canvas, funnel__isnull=False)
+
+        self.assertEqual(len(flows), 2)
+        for flow in flows:
+            self.assertEqual(flow.in_tank_id, flow.funnel.in_tank_id)
+            self.assertEqual(flow.out_tank_id, flow.funnel.out_tank_id)
+
+    def test_filter_by_tank(self):
+        into_savings = self.get_flows(
+            funnel__out_tank__external_id=self.savings.external_id
+        )
+        out_of_savings = self.get_flows(
+            funnel__in_tank__external_id=self.savings.external_id
+        )
+
+        self.assertEqual(len(into_savings), 1)
+        self.assertEqual(into_savings[0]["out_tank"], str(self.savings.external_id))
+        self.assertEqual(len(out_of_savings), 1)
+        self.assertEqual(out_of_savings[0]["out_tank"], str(self.travel.external_id))
+
+    def test_filter_by_tank_of_other_user(self):
+        other = User.objects.create_user(
+            email="tanks@dhanriti.net", username="tanks", password="password"
+        )
+        self.client.force_authenticate(other)
+
+        for param in ("funnel__out_tank__external_id", "funnel__in_tank__external_id"):
+            with self.subTest(param=param):
+                response = self.client.get(
+                    f"/v1/canvases/{self.canvas.external_id}/flows",
+                    {param: self.savings.external_id},
+                )
+                self.assertEqual(response.status_code, 404)
+
+    def test_filter_by_unknown_tank(self):
+        flows = self.get_flows(
+            funnel__out_tank__external_id="00000000-0000-0000-0000-000000000000"
+        )
+
+        self.assertEqual(flows, [])
+
+    def test_flows_of_other_users_are_not_found(self):
+        other = User.objects.create_user(
+            email="other@dhanriti.net", username="other", password="password"
+        )
+        self.client.force_authenticate(other)
+        flow = Flow.objects.filter(canvas=self.canvas).first()
+        url = f"/v1/canvases/{self.canvas.external_id}/flows"
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(
+            self.client.get(f"{url}/{flow.external_id}").status_code, 404
+        )
+
+        # Nor are the flows of deleted canvases
+        self.client.force_authenticate(self.user)
+        Canvas.objects.filter(pk=self.canvas.pk).update(deleted=True)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_ordering_is_not_offered(self):
+        # Pages are always newest first, so `ordering` is not advertised
+        response = self.client.get("/v1/schema", {"format": "json"})
+        parameters = response.json()["paths"][
+            "/v1/canvases/{canvas_external_id}/flows"
+        ]["get"]["parameters"]
+        self.assertNotIn("ordering", {parameter["name"] for parameter in parameters})
+
+        flows = self.get_flows(ordering="created_at")
+        self.assertEqual(
+            [flow["external_id"] for flow in flows],
+            [
+                str(flow.external_id)
+                for flow in Flow.objects.filter(canvas=self.canvas).order_by(
+                    "-created_at", "-id"
+                )
+            ],
+        )
+
+
+class FlowPreviewTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="preview@dhanriti.net", username="preview", password="password"
+        )
+        self.client.force_authenticate(self.user)
+
+        self.canvas = Canvas.objects.create(
+            name="Canvas", user=self.user, inflow=1000, inflow_rate="0 9 1 * *"
+        )
+        self.savings = Tank.objects.create(
+            name="Savings", canvas=self.canvas, capacity=50
+        )
+        self.travel = Tank.objects.create(name="Travel", canvas=self.canvas)
+        self.add_funnel(None, self.savings)
+        self.funnel = self.add_funnel(self.savings, self.travel)
+        self.url = f"/v1/canvases/{self.canvas.external_id}/flows/preview"
+
+    def add_funnel(self, in_tank, out_tank):
+        return Funnel.objects.create(
+            canvas=self.canvas,
+            in_tank=in_tank,
+            out_tank=out_tank,
+            flow=10,
+            flow_type=FlowType.PERCENTAGE,
+            flow_rate_type=FlowRateType.CONSEQUENT,
+        )
+
+    def get_balances(self):
+        self.canvas.refresh_from_db()
+        return self.canvas.filled, {
+            str(tank.external_id): tank.filled
+            for tank in Tank.objects.filter(canvas=self.canvas)
+        }
+
+    def test_preview_matches_trigger(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        flows = response.data["flows"]
+        self.assertEqual([flow["flowed"] for flow in flows], [1000, 50, 1])
+        self.assertEqual(flows[1]["meta"]["reduced_reason"], "out_tank_space")
+        self.assertEqual(flows[2]["in_tank"], str(self.savings.external_id))
+        self.assertFalse(Flow.objects.exists())
+        self.assertEqual(
+            self.get_balances(),
+            (
+                0,
+                {
+                    str(self.savings.external_id): 0,
+                    str(self.travel.external_id): 0,
+                },
+            ),
+        )
+
+        response = self.client.post(
+            f"/v1/canvases/{self.canvas.external_id}/flows/trigger?wait=1"
+        )
+        self.assertEqual(len(response.data["flows"]), 3)
+        main_tank, tanks = self.get_balances()
+        self.assertEqual(main_tank, 950)
+        for tank in self.client.get(self.url).data["tanks"]:
+            self.assertEqual(tank["before"], tanks[str(tank["external_id"])])
+
+    def test_preview_funnel(self):
+        response = self.client.get(
+            self.url, {"funnel_external_id": self.funnel.external_id}
+        )
+        # A manual funnel flow reads the in tank balance, which is empty
+        self.assertEqual([flow["flowed"] for flow in response.data["flows"]], [0])
+
+    def test_preview_query_count(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.url)
+        for _ in range(5):
+            tank = Tank.objects.create(name="Tank", canvas=self.canvas)
+            self.add_funnel(self.travel, tank)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(self.url)
+
+        self.assertEqual(len(response.data["flows"]), 8)
+        self.assertEqual(len(large), len(small))
+
+
+class FlowTriggerJobTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email="jobs@dhanriti.net", username="jobs", password="password"
+        )
+        self.client.force_authenticate(self.user)
+        self.canvas = Canvas.objects.create(
+            name="Canvas", user=self.user, inflow=1000, inflow_rate="0 9 1 * *"
+        )
+        self.savings = Tank.objects.create(name="Savings", canvas=self.canvas)
+        Funnel.objects.create(
+            canvas=self.canvas,
+            out_tank=self.savings,
+            flow=10,
+            flow_type=FlowType.PERCENTAGE,
+            flow_rate_type=FlowRateType.CONSEQUENT,
+        )
+        self.url = f"/v1/canvases/{self.canvas.external_id}/flows"
+
+        # Jobs are queued instead of run, and their states are reported as
+        # the result backend would
+        self.queued = {}
+        self.results = {}
+        patcher = mock.patch.object(manual_trigger, "delay", self.delay)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(manual_trigger, "AsyncResult", self.get_result)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def delay(self, *args):
+        job = EagerResult(f"job-{len(self.queued)}", None, states.PENDING)
+        self.queued[job.id] = args
+        return job
+
+    def get_result(self, job_id):
+        return self.results.get(job_id, EagerResult(job_id, None, states.PENDING))
+
+    def run_job(self, job_id):
+        result = {"flows": run_manual_trigger(*self.queued[job_id])}
+        self.results[job_id] = EagerResult(job_id, result, states.SUCCESS)
+
+    def test_trigger_is_polled_to_its_flows(self):
+        response = self.client.post(f"{self.url}/trigger")
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data["job_id"]
+        self.assertEqual(response.data["status"], "PENDING")
+        self.assertEqual(self.queued[job_id], (self.canvas.pk, None))
+        self.assertFalse(Flow.objects.exists())
+
+        response = self.client.get(f"{self.url}/jobs/{job_id}")
+        self.assertEqual(
+            response.data, {"job_id": job_id, "status": "PENDING", "flows": []}
+        )
+
+        self.run_job(job_id)
+        response = self.client.get(f"{self.url}/jobs/{job_id}")
+
+        self.assertEqual(response.data["status"], "SUCCESS")
+        self.assertCountEqual(
+            response.data["flows"],
+            [str(flow.external_id) for flow in Flow.objects.all()],
+        )
+        self.assertEqual(len(response.data["flows"]), 2)
+
+    def test_failed_job(self):
+        job_id = self.client.post(f"{self.url}/trigger").data["job_id"]
+        self.results[job_id] = EagerResult(
+            job_id, ValueError("Canvas is busy"), states.FAILURE
+        )
+
+        response = self.client.get(f"{self.url}/jobs/{job_id}")
+
+        self.assertEqual(response.data["status"], "FAILURE")
+        self.assertEqual(response.data["error"], "Canvas is busy")
+
+    def test_jobs_of_other_canvases_are_not_found(self):
+        job_id = self.client.post(f"{self.url}/trigger").data["job_id"]
+        other = Canvas.objects.create(
+            name="Other", user=self.user, inflow=1000, inflow_rate="0 9 1 * *"
+        )
+
+        response = self.client.get(
+            f"/v1/canvases/{other.external_id}/flows/jobs/{job_id}"
+        )
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.get(f"{self.url}/jobs/unknown")
+        self.assertEqual(response.status_code, 404)
+
+
+class LastFlowPointerMigrationTest(TestCase):
+    def test_pointers_are_populated(self):
+        migration = import_module("dhanriti.migrations.0015_last_flow_pointers")
+        user = User.objects.create_user(
+            email="pointers@dhanriti.net", username="pointers", password="password"
+        )
+        canvas = Canvas.objects.create(
+            name="Canvas", user=user, inflow=1000, inflow_rate="0 9 1 * *"
+        )
+        funnel = Funnel.objects.create(
+            canvas=canvas,
+            out_tank=Tank.objects.create(name="Savings", canvas=canvas),
+            flow=10,
+            flow_type=FlowType.PERCENTAGE,
+            flow_rate_type=FlowRateType.CONSEQUENT,
+        )
+        idle = Canvas.objects.create(
+            name="Idle", user=user, inflow=1000, inflow_rate="0 9 1 * *"
+        )
+
+        # Flows written before the pointers existed. Bulk created so the
+        # engine does not run for them (and set the pointers itself), and
+        # inserted out of time order so the latest row is not the latest flow
+        manual_inflow = Flow(canvas=canvas, flowed=500, manual=True)
+        auto_inflow = Flow(canvas=canvas, flowed=1000)
+        funnel_flow = Flow(canvas=canvas, funnel=funnel, flowed=100)
+        Flow.objects.bulk_create([manual_inflow, auto_inflow, funnel_flow])
+
+        # created_at is auto_now_add, so flows are backdated with updates
+        now = timezone.now()
+        for flow, at in (
+            (auto_inflow, now - timedelta(days=2)),
+            (manual_inflow, now - timedelta(days=1)),
+            (funnel_flow, now),
+        ):
+            Flow.objects.filter(pk=flow.pk).update(created_at=at)
+            flow.created_at = at
+        null_pointers = {field: None for field in Canvas.LAST_FLOW_FIELDS}
+        Canvas.objects.update(**null_pointers)
+        Funnel.objects.update(**null_pointers)
+
+        migration.populate_last_flows(apps, None)
+
+        canvas.refresh_from_db()
+        self.assertEqual(canvas.last_flow, manual_inflow)
+        self.assertEqual(canvas.last_flow_at, manual_inflow.created_at)
+        self.assertEqual(canvas.last_flowed, 500)
+        self.assertEqual(canvas.last_auto_flow, auto_inflow)
+        self.assertEqual(canvas.last_auto_flow_at, auto_inflow.created_at)
+        self.assertEqual(canvas.last_auto_flowed, 1000)
+
+        funnel.refresh_from_db()
+        self.assertEqual(funnel.last_flow, funnel_flow)
+        self.assertEqual(funnel.last_auto_flow, funnel_flow)
+
+        idle.refresh_from_db()
+        self.assertIsNone(idle.last_flow)
+        self.assertIsNone(idle.last_auto_flow_at)
@@ -0,0 +1,144 @@
+from datetime import timedelta
+
+from rest_framework.test import APITestCase
+
+from dhanriti.models import User
+from dhanriti.models.enums import FlowRateType, FlowType
+from dhanriti.models.tanks import Canvas, Flow, Funnel, Tank
+from utils.cron import compile_cron
+from utils.flow import CanvasFlowEngine
+from utils.forecast import CanvasForecast, expand_fire_times, from_minutes, to_minutes
+
+
+class CanvasForecastTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="forecast@dhanriti.net", username="forecast", password="password"
+        )
+        self.client.force_authenticate(self.user)
+
+        self.canvas = Canvas.objects.create(
+            name="Canvas", user=self.user, inflow=1000, inflow_rate="0 * * * *"
+        )
+        self.savings = Tank.objects.create(
+            name="Savings", canvas=self.canvas, capacity=5000
+        )
+        self.travel = Tank.objects.create(name="Travel", canvas=self.canvas)
+        self.fuel = Tank.objects.create(name="Fuel", canvas=self.canvas, capacity=300)
+        for in_tank, out_tank, flow, flow_type, flow_rate in (
+            (None, self.savings, 20, FlowType.PERCENTAGE, None),
+            (self.savings, self.travel, 150, FlowType.ABSOLUTE, "30 */6 * * *"),
+            (self.travel, self.fuel, 50, FlowType.PERCENTAGE, None),
+            (self.fuel, self.savings, 40, FlowType.ABSOLUTE, None),
+        ):
+            Funnel.objects.create(
+                canvas=self.canvas,
+                in_tank=in_tank,
+                out_tank=out_tank,
+                flow=flow,
+                flow_type=flow_type,
+                flow_rate_type=(
+                    FlowRateType.TIMELY if flow_rate else FlowRateType.CONSEQUENT
+                ),
+                flow_rate=flow_rate,
+            )
+
+    def test_fire_times_match_cron(self):
+        start = to_minutes(self.canvas.created_at)
+        end = start + 40 * 24 * 60
+        for expr in ("*/20 * * * *", "30 9 * * 1-5", "0 0 1,15 * *", "0 12 13 * 5"):
+            cron = compile_cron(expr)
+            expected = []
+            at = cron.next_after(from_minutes(start))
+            while to_minutes(at) <= end:
+                expected.append(to_minutes(at))
+                at = cron.next_after(at)
+            self.assertEqual(expand_fire_times(expr, start, end).tolist(), expected)
+
+    def assertForecastMatchesEngine(self, canvas, days):
+        start = to_minutes(canvas.created_at)
+        end = start + days * 24 * 60
+        forecast = CanvasForecast(canvas.pk)
+        balances = forecast.run(start, end, [end])[0]
+
+        # Replay the same events the way the cron tasks run them
+        funnels = forecast.funnels
+        for at, code in zip(*forecast.get_events(start, end)):
+            engine = CanvasFlowEngine(canvas.pk)
+            if code == 0:
+                engine.inflow(at=from_minutes(at))
+            else:
+                engine.trigger(
+                    funnels[code - 1],
+                    timely_trigger=True,
+                    bypass_last_flow=True,
+                    at=from_minutes(at),
+                )
+            engine.commit()
+
+        canvas.refresh_from_db()
+        self.assertAlmostEqual(balances[0], canvas.filled)
+        for node, pk in enumerate(forecast.tank_ids, 1):
+            self.assertAlmostEqual(balances[node], Tank.objects.get(pk=pk).filled)
+
+    def test_forecast_matches_engine(self):
+        self.assertForecastMatchesEngine(self.canvas, 4)
+        # The savings tank filled up along the way
+        self.assertAlmostEqual(Tank.objects.get(pk=self.savings.pk).filled, 5000)
+
+    def test_forecast_matches_engine_on_diamond(self):
+        canvas = Canvas.objects.create(
+            name="Diamond", user=self.user, inflow=1000, inflow_rate="0 * * * *"
+        )
+        savings, travel, fuel, car = (
+            Tank.objects.create(name=name, canvas=canvas)
+            for name in ("Savings", "Travel", "Fuel", "Car")
+        )
+        for in_tank, out_tank in (
+            (None, savings),
+            (None, travel),
+            (savings, fuel),
+            (travel, fuel),
+            (fuel, car),
+        ):
+            Funnel.objects.create(
+                canvas=canvas,
+                in_tank=in_tank,
+                out_tank=out_tank,
+                flow=10,
+                flow_type=FlowType.PERCENTAGE,
+                flow_rate_type=FlowRateType.CONSEQUENT,
+            )
+
+        # The fuel to car funnel fires once per path into fuel
+        forecast = CanvasForecast(canvas.pk)
+        forecast.cascade(0)
+        car_node = forecast.tank_ids.index(car.pk) + 1
+        self.assertAlmostEqual(forecast.balances[car_node], 2)
+
+        self.assertForecastMatchesEngine(canvas, 1)
+
+    def test_forecast_endpoint(self):
+        url = f"/v1/canvases/{self.canvas.external_id}/forecast"
+
+        response = self.client.get(url, {"months": 2})
+        self.assertEqual(response.status_code, 200)
+        points = response.data["points"]
+        self.assertEqual(len(points), 2)
+        self.assertEqual(points[0]["at"].day, 1)
+        self.assertEqual(
+            set(points[0]["tanks"]),
+            {str(tank.external_id) for tank in (self.savings, self.travel, self.fuel)},
+        )
+        self.assertGreater(points[1]["main_tank"], points[0]["main_tank"])
+        self.assertFalse(Flow.objects.exists())
+
+        response = self.client.get(url, {"period": "day", "months": 1})
+        self.assertEqual(
+            response.data["points"][1]["at"] - response.data["points"][0]["at"],
+            timedelta(days=1),
+        )
+
+        for params in ({"months": 0}, {"months": 100}, {"period": "week"}):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 400)
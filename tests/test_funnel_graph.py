@@ -0,0 +1,124 @@
+from rest_framework.test import APITestCase
+
+from dhanriti.models import User
+from dhanriti.models.enums import FlowRateType, FlowType
+from dhanriti.models.tanks import Canvas, Flow, Funnel, Tank
+from utils.flow import CanvasFlowEngine, trigger_canvas_inflow
+from utils.graph import get_funnel_graph, get_topological_order
+
+
+class FunnelGraphTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="graph@dhanriti.net", username="graph", password="password"
+        )
+        self.client.force_authenticate(self.user)
+
+        self.canvas = Canvas.objects.create(
+            name="Canvas", user=self.user, inflow=1000, inflow_rate="0 9 1 * *"
+        )
+        self.tanks = [
+            Tank.objects.create(name=name, canvas=self.canvas)
+            for name in ("Savings", "Travel", "Fuel")
+        ]
+        self.url = f"/v1/canvases/{self.canvas.external_id}/funnels"
+
+    def create_funnel(self, in_tank, out_tank):
+        return self.client.post(
+            self.url,
+            {
+                "in_tank_external_id": in_tank and in_tank.external_id,
+                "out_tank_external_id": out_tank.external_id,
+                "flow": 10,
+                "flow_type": FlowType.PERCENTAGE,
+                "flow_rate_type": FlowRateType.CONSEQUENT,
+            },
+            format="json",
+        )
+
+    def test_topological_order(self):
+        self.assertEqual(
+            get_topological_order([(None, 3), (3, 1), (None, 2), (2, 1)]),
+            [None, 3, 2, 1],
+        )
+        self.assertIsNone(get_topological_order([(None, 1), (1, 2), (2, 1)]))
+
+    def test_cycles_are_rejected(self):
+        savings, travel, fuel = self.tanks
+        for in_tank, out_tank in ((None, savings), (savings, travel), (travel, fuel)):
+            self.assertEqual(self.create_funnel(in_tank, out_tank).status_code, 201)
+
+        for in_tank, out_tank in ((fuel, savings), (travel, travel)):
+            response = self.create_funnel(in_tank, out_tank)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("out_tank_external_id", response.data)
+        self.assertEqual(Funnel.objects.filter(canvas=self.canvas).count(), 3)
+
+        # Another path to the same tank is not a cycle
+        self.assertEqual(self.create_funnel(savings, fuel).status_code, 201)
+
+    def test_graph_of_stored_funnels(self):
+        savings, travel, _ = self.tanks
+        self.create_funnel(None, savings)
+        response = self.create_funnel(savings, travel)
+        funnel = Funnel.objects.get(external_id=response.data["external_id"])
+
+        graph = get_funnel_graph(self.canvas.pk)
+        self.assertEqual(graph.edges[funnel.pk], (savings.pk, travel.pk))
+        self.assertEqual(graph.order, [None, savings.pk, travel.pk])
+
+        self.client.delete(f"{self.url}/{funnel.external_id}")
+        self.assertNotIn(funnel.pk, get_funnel_graph(self.canvas.pk).edges)
+
+    def test_engine_takes_children_from_loaded_funnels(self):
+        savings, travel, _ = self.tanks
+        funnels = [
+            Funnel.objects.create(
+                canvas=self.canvas,
+                in_tank=in_tank,
+                out_tank=out_tank,
+                flow=10,
+                flow_type=FlowType.PERCENTAGE,
+                flow_rate_type=FlowRateType.CONSEQUENT,
+            )
+            for in_tank, out_tank in ((None, savings), (savings, travel))
+        ]
+
+        engine = CanvasFlowEngine(self.canvas.pk)
+        self.assertEqual(engine.root_funnels, [engine.funnels[funnels[0].pk]])
+        self.assertEqual(engine.children[savings.pk], [engine.funnels[funnels[1].pk]])
+
+        engine.inflow()
+        self.assertEqual(engine.flows[-1].funnel, funnels[1])
+
+    def test_diamond_cascades_once_per_path(self):
+        savings, travel, fuel = self.tanks
+        car = Tank.objects.create(name="Car", canvas=self.canvas)
+        for in_tank, out_tank in (
+            (None, savings),
+            (None, travel),
+            (savings, fuel),
+            (travel, fuel),
+            (fuel, car),
+        ):
+            Funnel.objects.create(
+                canvas=self.canvas,
+                in_tank=in_tank,
+                out_tank=out_tank,
+                flow=10,
+                flow_type=FlowType.PERCENTAGE,
+                flow_rate_type=FlowRateType.CONSEQUENT,
+            )
+
+        with self.assertLogs("utils.flow") as logs:
+            flows = trigger_canvas_inflow(self.canvas)
+        self.assertFalse([line for line in logs.output if "cycle" in line])
+
+        # The fuel to car funnel fires after each of the two flows into fuel
+        self.assertEqual(len(flows), 7)
+        self.assertEqual(Flow.objects.filter(funnel__out_tank=car).count(), 2)
+        self.canvas.refresh_from_db()
+        self.assertAlmostEqual(self.canvas.filled, 800)
+        for tank, filled in ((savings, 90), (travel, 90), (fuel, 18), (car, 2)):
+            tank.refresh_from_db()
+            self.assertAlmostEqual(tank.filled, filled)
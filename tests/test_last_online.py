@@ -0,0 +1,86 @@
+import time
+from datetime import timedelta
+from threading import Thread
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from dhanriti.models import User
+from dhanriti.tasks.users import flush_last_online_task
+from utils.last_online import add_pending, pop_pending, record_last_online
+
+
+class SlowCache:
+    """
+    The default cache, with a pause after each read so that concurrent
+    read-modify-writes interleave.
+    """
+
+    def get(self, *args, **kwargs):
+        value = cache.get(*args, **kwargs)
+        time.sleep(0.001)
+        return value
+
+    def __getattr__(self, name):
+        return getattr(cache, name)
+
+
+@override_settings(LAST_ONLINE_UPDATE_INTERVAL=300)
+class LastOnlineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            User.objects.create_user(
+                email=f"online{i}@dhanriti.net",
+                username=f"online{i}",
+                password="password",
+            )
+            for i in range(3)
+        ]
+
+    def get_last_online(self, user):
+        return User.objects.values_list("last_online", flat=True).get(pk=user.pk)
+
+    def test_pending_set(self):
+        threads = [
+            Thread(target=add_pending, args=(user_id,)) for user_id in range(50)
+        ]
+        with mock.patch("utils.last_online.cache", SlowCache()):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        # No id is lost to a concurrent read-modify-write
+        self.assertEqual(pop_pending(), set(range(50)))
+        self.assertEqual(pop_pending(), set())
+
+    @override_settings(LAST_ONLINE_BUFFERED=False)
+    def test_writes_are_throttled(self):
+        user = self.users[0]
+        now = user.last_online + timedelta(seconds=60)
+        with self.assertNumQueries(0):
+            record_last_online(user, now)
+
+        now += timedelta(seconds=300)
+        with self.assertNumQueries(1):
+            record_last_online(user, now)
+        self.assertEqual(self.get_last_online(user), now)
+
+    @override_settings(LAST_ONLINE_BUFFERED=True)
+    def test_buffered_writes_are_flushed(self):
+        now = timezone.now() + timedelta(hours=1)
+        with self.assertNumQueries(0):
+            for user in self.users[:2]:
+                record_last_online(user, now)
+                record_last_online(user, now + timedelta(seconds=1))
+
+        self.assertEqual(flush_last_online_task(), 2)
+        for user in self.users[:2]:
+            self.assertEqual(self.get_last_online(user), now)
+        self.assertLess(self.get_last_online(self.users[2]), now)
+
+        # Nothing is left pending
+        self.assertEqual(flush_last_online_task(), 0)
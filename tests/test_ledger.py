@@ -0,0 +1,211 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db.models import Sum
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from dhanriti.models import User
+from dhanriti.models.enums import AccountType, EntryType, FlowRateType, FlowType
+from dhanriti.models.ledger import BalanceSnapshot, LedgerEntry
+from dhanriti.models.tanks import Canvas, Flow, Funnel, Tank
+from utils.flow import CanvasFlowEngine, trigger_canvas_inflow
+from utils.ledger import get_balance, get_balance_range, take_snapshots
+
+
+class LedgerTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="ledger@dhanriti.net", username="ledger", password="password"
+        )
+        self.client.force_authenticate(self.user)
+
+        self.canvas = Canvas.objects.create(
+            name="Canvas", user=self.user, inflow=1000, inflow_rate="0 9 1 * *"
+        )
+        self.savings = Tank.objects.create(
+            name="Savings", canvas=self.canvas, capacity=100000
+        )
+        self.travel = Tank.objects.create(
+            name="Travel", canvas=self.canvas, capacity=100000
+        )
+        for in_tank, out_tank in ((None, self.savings), (self.savings, self.travel)):
+            Funnel.objects.create(
+                canvas=self.canvas,
+                in_tank=in_tank,
+                out_tank=out_tank,
+                flow=10,
+                flow_type=FlowType.PERCENTAGE,
+                flow_rate_type=FlowRateType.CONSEQUENT,
+            )
+
+    def inflow(self, at=None):
+        engine = CanvasFlowEngine(self.canvas.pk)
+        engine.inflow(at=at)
+        engine.commit()
+
+    def assertReconciled(self):
+        for journal in LedgerEntry.objects.values("journal").annotate(
+            total=Sum("amount")
+        ):
+            self.assertAlmostEqual(journal["total"], 0)
+
+        self.canvas.refresh_from_db()
+        self.assertAlmostEqual(
+            get_balance(AccountType.CANVAS, self.canvas.pk), self.canvas.filled
+        )
+        for tank in Tank.objects.filter(canvas=self.canvas):
+            self.assertAlmostEqual(get_balance(AccountType.TANK, tank.pk), tank.filled)
+
+    def test_movements_balance(self):
+        trigger_canvas_inflow(self.canvas)
+        trigger_canvas_inflow(self.canvas)
+        response = self.client.post(
+            f"/v1/canvases/{self.canvas.external_id}/tanks/{self.travel.external_id}/payments",
+            {"amount": 1},
+        )
+        self.assertEqual(response.status_code, 201)
+
+        self.assertReconciled()
+
+        response = self.client.delete(
+            f"/v1/canvases/{self.canvas.external_id}/tanks/{self.travel.external_id}"
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertAlmostEqual(get_balance(AccountType.TANK, self.travel.pk), 0)
+        self.assertReconciled()
+
+    def test_point_in_time_balance(self):
+        now = timezone.now()
+        balances = []
+        for days in (3, 2, 1):
+            self.inflow(at=now - timedelta(days=days))
+            self.savings.refresh_from_db()
+            balances.append(self.savings.filled)
+
+        self.assertAlmostEqual(
+            get_balance(AccountType.TANK, self.savings.pk, now - timedelta(days=4)), 0
+        )
+        self.assertAlmostEqual(
+            get_balance(AccountType.TANK, self.savings.pk, now - timedelta(days=2)),
+            balances[1],
+        )
+        self.assertEqual(
+            get_balance_range(
+                AccountType.CANVAS,
+                self.canvas.pk,
+                now - timedelta(days=2, hours=12),
+                now,
+            ),
+            {"opening": 900, "credits": 2000, "debits": 200, "closing": 2700},
+        )
+
+    def test_snapshots_bound_reads(self):
+        for _ in range(3):
+            trigger_canvas_inflow(self.canvas)
+        self.assertEqual(take_snapshots(), 4)
+        self.assertEqual(take_snapshots(), 0)
+        trigger_canvas_inflow(self.canvas)
+
+        with self.assertNumQueries(2):
+            balance = get_balance(AccountType.CANVAS, self.canvas.pk)
+        self.assertAlmostEqual(balance, 3600)
+        self.assertReconciled()
+
+    def test_backdated_entries_invalidate_snapshots(self):
+        trigger_canvas_inflow(self.canvas)
+        take_snapshots()
+
+        self.inflow(at=timezone.now() - timedelta(days=1))
+
+        self.assertFalse(BalanceSnapshot.objects.exists())
+        self.assertReconciled()
+
+    def test_balance_endpoint(self):
+        trigger_canvas_inflow(self.canvas)
+        self.savings.refresh_from_db()
+        url = f"/v1/canvases/{self.canvas.external_id}/tanks/{self.savings.external_id}/balance"
+
+        response = self.client.get(url)
+        self.assertAlmostEqual(response.data["balance"], self.savings.filled)
+
+        response = self.client.get(url, {"start": "2000-01-01T00:00:00Z"})
+        self.assertAlmostEqual(response.data["opening"], 0)
+        self.assertAlmostEqual(response.data["credits"], 100)
+        self.assertAlmostEqual(response.data["closing"], self.savings.filled)
+
+        response = self.client.get(url, {"at": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_backfill_reconciles_stored_balances(self):
+        trigger_canvas_inflow(self.canvas)
+        LedgerEntry.objects.all().delete()
+        Tank.objects.filter(pk=self.travel.pk).update(filled=50)
+
+        call_command("backfill_ledger", stdout=StringIO())
+
+        self.assertReconciled()
+
+    def test_backfill_after_live_entries(self):
+        # History from before the ledger, then a live inflow once deployed
+        trigger_canvas_inflow(self.canvas)
+        LedgerEntry.objects.all().delete()
+        trigger_canvas_inflow(self.canvas)
+
+        call_command("backfill_ledger", stdout=StringIO())
+
+        self.assertReconciled()
+        self.assertFalse(
+            Flow.objects.filter(canvas=self.canvas, ledger_entries=None).exists()
+        )
+        self.assertFalse(
+            LedgerEntry.objects.filter(entry_type=EntryType.ADJUSTMENT).exists()
+        )
+
+        # Everything has entries now, so a rerun writes nothing
+        count = LedgerEntry.objects.count()
+        call_command("backfill_ledger", stdout=StringIO())
+        self.assertEqual(LedgerEntry.objects.count(), count)
+
+    def test_patch_does_not_write_balances(self):
+        trigger_canvas_inflow(self.canvas)
+        canvas_url = f"/v1/canvases/{self.canvas.external_id}"
+
+        response = self.client.patch(
+            canvas_url, {"name": "Renamed", "filled": 5}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch(
+            f"{canvas_url}/tanks/{self.savings.external_id}",
+            {"name": "Renamed", "filled": 5},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.canvas.refresh_from_db()
+        self.savings.refresh_from_db()
+        self.assertEqual(self.canvas.name, "Renamed")
+        self.assertAlmostEqual(self.canvas.filled, 900)
+        self.assertEqual(self.savings.name, "Renamed")
+        self.assertAlmostEqual(self.savings.filled, 90)
+        self.assertReconciled()
+
+    def test_adjustments_are_ledgered(self):
+        trigger_canvas_inflow(self.canvas)
+        canvas_url = f"/v1/canvases/{self.canvas.external_id}"
+
+        response = self.client.post(f"{canvas_url}/adjust", {"filled": 1000})
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(response.data["filled"], 1000)
+        response = self.client.post(
+            f"{canvas_url}/tanks/{self.savings.external_id}/adjust", {"filled": 40}
+        )
+        self.assertAlmostEqual(response.data["filled"], 40)
+        response = self.client.post(f"{canvas_url}/adjust", {"filled": -1})
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(
+            LedgerEntry.objects.filter(entry_type=EntryType.ADJUSTMENT).count(), 4
+        )
+        self.assertReconciled()
@@ -0,0 +1,84 @@
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import override_settings
+from rest_framework.test import APITestCase
+
+from dhanriti.models import User
+from dhanriti.models.tanks import Canvas, Tank
+from utils.locks import CANVAS_LOCK_CLASS, CanvasBusy, canvas_lock, get_lock_key
+
+
+@skipUnless(connection.vendor == "postgresql", "Advisory locks need Postgres")
+@override_settings(CANVAS_LOCK_TIMEOUT=100)
+class CanvasLockTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="locks@dhanriti.net", username="locks", password="password"
+        )
+        self.client.force_authenticate(self.user)
+        self.canvas = Canvas.objects.create(
+            name="Canvas", user=self.user, inflow=1000, inflow_rate="0 9 1 * *"
+        )
+        self.tank = Tank.objects.create(name="Savings", canvas=self.canvas, filled=100)
+
+        # Another session, as another worker or request would be
+        self.other = connection.copy()
+        self.addCleanup(self.other.close)
+
+    def hold_lock(self):
+        with self.other.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_lock(%s, %s)",
+                [CANVAS_LOCK_CLASS, get_lock_key(self.canvas.pk)],
+            )
+
+    def get_lock_timeout(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW lock_timeout")
+            return cursor.fetchone()[0]
+
+    def test_lock_is_reentrant(self):
+        with canvas_lock(self.canvas.pk):
+            with canvas_lock(self.canvas.pk, blocking=False):
+                pass
+
+    def test_non_blocking_lock_is_not_waited_for(self):
+        self.hold_lock()
+
+        with self.assertRaises(CanvasBusy):
+            with canvas_lock(self.canvas.pk, blocking=False):
+                self.fail("Locked a canvas held by another session")
+
+        # Other canvases are not affected
+        other_canvas = Canvas.objects.create(
+            name="Other", user=self.user, inflow=1000, inflow_rate="0 9 1 * *"
+        )
+        with canvas_lock(other_canvas.pk, blocking=False):
+            pass
+
+    def test_blocking_lock_times_out(self):
+        lock_timeout = self.get_lock_timeout()
+        self.hold_lock()
+
+        with self.assertRaises(CanvasBusy):
+            with canvas_lock(self.canvas.pk):
+                self.fail("Locked a canvas held by another session")
+
+        # The timeout only applied to taking the lock, and the transaction
+        # is still usable
+        self.assertEqual(self.get_lock_timeout(), lock_timeout)
+        self.assertTrue(Canvas.objects.filter(pk=self.canvas.pk).exists())
+
+    def test_busy_canvas_is_a_conflict(self):
+        self.hold_lock()
+
+        response = self.client.post(
+            f"/v1/canvases/{self.canvas.external_id}/tanks/"
+            f"{self.tank.external_id}/payments",
+            {"amount": 10},
+        )
+
+        self.assertEqual(response.status_code, 409)
+        self.tank.refresh_from_db()
+        self.assertEqual(self.tank.filled, 100)
@@ -0,0 +1,157 @@
+import json
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from dhanriti.models import User
+from dhanriti.models.enums import FlowRateType, FlowType
+from dhanriti.models.tanks import Canvas, Flow, Funnel, Tank
+
+
+class FlowQueryPlanTest(APITestCase):
+    """
+    EXPLAIN the Flow queries the views actually run, as captured from real
+    requests, and check each reads flows through the index designed for
+    it. Sequential scans are priced out because the seeded tables are far
+    smaller than production ones, so a Seq Scan or an index scan that only
+    filters (no Index Cond) also fails.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email="plans@dhanriti.net", username="plans", password="password"
+        )
+        cls.canvases = []
+        flows = []
+        for i in range(20):
+            canvas = Canvas.objects.create(
+                name="Canvas", user=cls.user, inflow=1000, inflow_rate="0 9 1 * *"
+            )
+            tanks = [
+                Tank.objects.create(name=name, canvas=canvas)
+                for name in ("Savings", "Travel", "Fuel")
+            ]
+            funnels = [
+                Funnel.objects.create(
+                    canvas=canvas,
+                    in_tank=in_tank,
+                    out_tank=out_tank,
+                    flow=10,
+                    flow_type=FlowType.PERCENTAGE,
+                    flow_rate_type=FlowRateType.CONSEQUENT,
+                )
+                for in_tank, out_tank in zip([None] + tanks[:-1], tanks)
+            ]
+            cls.canvases.append((canvas, tanks, funnels))
+            for j in range(50):
+                flows.append(Flow(canvas=canvas, flowed=1000, manual=j % 5 == 0))
+                for funnel in funnels:
+                    flows.append(
+                        Flow(
+                            canvas=canvas,
+                            funnel=funnel,
+                            in_tank=funnel.in_tank,
+                            out_tank=funnel.out_tank,
+                            flowed=100,
+                            manual=j % 5 == 0,
+                        )
+                    )
+        Flow.objects.bulk_create(flows)
+
+        # Every joined table is analyzed, so the plans never depend on
+        # statistics autovacuum happened to leave behind
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "ANALYZE dhanriti_flow, dhanriti_canvas, dhanriti_funnel, dhanriti_tank"
+            )
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def get_flow_scans(self, node):
+        """
+        Yield `(node type, index name, index cond)` for every node of the
+        plan reading the flow table or one of its indexes.
+        """
+        index_name = node.get("Index Name", "")
+        if node.get("Relation Name") == "dhanriti_flow" or index_name.startswith(
+            "flow_"
+        ):
+            yield node["Node Type"], index_name, node.get("Index Cond")
+        for child in node.get("Plans", []):
+            yield from self.get_flow_scans(child)
+
+    def get_flow_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [
+            query["sql"]
+            for query in context.captured_queries
+            if 'FROM "dhanriti_flow"' in query["sql"]
+        ]
+
+    def assertUsesIndexes(self, url, expected):
+        """
+        The request runs one flow query per name in `expected`, in order,
+        each reading the flows only through that index.
+        """
+        queries = self.get_flow_queries(url)
+        self.assertEqual(len(queries), len(expected), queries)
+        for sql, index_name in zip(queries, expected):
+            # Read through BaseManager
+            self.assertIn('"dhanriti_flow"."deleted"', sql)
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            plan = plan[0]["Plan"]
+
+            scans = list(self.get_flow_scans(plan))
+            self.assertTrue(scans, json.dumps(plan, indent=2))
+            for node_type, name, index_cond in scans:
+                if node_type == "Bitmap Heap Scan":
+                    continue
+                self.assertEqual(name, index_name, json.dumps(plan, indent=2))
+                self.assertIsNotNone(index_cond, json.dumps(plan, indent=2))
+
+    def test_canvas_flow_history(self):
+        canvas, _, _ = self.canvases[0]
+        url = f"/v1/canvases/{canvas.external_id}/flows"
+        self.assertUsesIndexes(url, ["flow_canvas_created_idx"])
+
+        response = self.client.get(url)
+        self.assertUsesIndexes(response.data["next"], ["flow_canvas_created_idx"])
+
+    def test_flow_filter_lookups(self):
+        canvas, tanks, funnels = self.canvases[0]
+        url = f"/v1/canvases/{canvas.external_id}/flows"
+        for param, external_id, index_name in (
+            ("funnel__external_id", funnels[1].external_id, "flow_funnel_created_idx"),
+            (
+                "funnel__in_tank__external_id",
+                tanks[0].external_id,
+                "flow_in_tank_created_idx",
+            ),
+            (
+                "funnel__out_tank__external_id",
+                tanks[1].external_id,
+                "flow_out_tank_created_idx",
+            ),
+        ):
+            with self.subTest(param=param):
+                self.assertUsesIndexes(f"{url}?{param}={external_id}", [index_name])
+
+    def test_canvas_latest_flows(self):
+        canvas, _, _ = self.canvases[0]
+
+        # The last inflows of the canvas and the last flows of its funnels
+        self.assertUsesIndexes(
+            f"/v1/canvases/{canvas.external_id}",
+            ["flow_canvas_inflow_idx", "flow_funnel_created_idx"],
+        )
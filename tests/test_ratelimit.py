@@ -0,0 +1,150 @@
+from unittest import mock
+
+from django.core.cache import cache, caches
+from django.test import RequestFactory, TestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from dhanriti.models import User
+from utils.ratelimit import RateLimiter
+
+RULES = [
+    {"name": "auth", "path": "/v1/auth/", "limit": 2, "window": 60, "key": "ip"},
+    {"name": "api", "path": "/v1/", "limit": 2, "window": 60, "key": "user"},
+]
+
+# Halfway through a window, so hits never straddle two of them
+NOW = 1_700_000_010.0
+
+
+def freeze_time(test):
+    patcher = mock.patch("utils.ratelimit.time")
+    patcher.start().time.return_value = NOW
+    test.addCleanup(patcher.stop)
+
+
+class FakeRedisClient:
+    """
+    Runs INCR_SCRIPT the way Redis would, and records each call.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.expiries = {}
+        self.calls = []
+
+    def get_client(self, key, write=False):
+        return self
+
+    def register_script(self, script):
+        def run(keys, args, client):
+            self.calls.append((keys, args))
+            count = self.counters.get(keys[0], 0) + 1
+            self.counters[keys[0]] = count
+            if count == 1:
+                self.expiries[keys[0]] = args[0]
+            return count
+
+        return run
+
+
+@override_settings(RATE_LIMITS=RULES, RATE_LIMIT_TRUSTED_PROXIES=0)
+class RateLimiterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        freeze_time(self)
+        self.factory = RequestFactory()
+        self.limiter = RateLimiter()
+
+    def hit(self, path="/v1/auth/login", **headers):
+        return self.limiter.hit(self.factory.get(path, **headers))
+
+    def test_ip_ignores_client_forwarded_for(self):
+        for forwarded_for in ("10.0.0.1", "10.0.0.2"):
+            self.assertIsNone(self.hit(HTTP_X_FORWARDED_FOR=forwarded_for))
+        # A fresh X-Forwarded-For does not give a fresh bucket
+        self.assertIsNotNone(self.hit(HTTP_X_FORWARDED_FOR="10.0.0.3"))
+
+    @override_settings(RATE_LIMIT_TRUSTED_PROXIES=1)
+    def test_ip_behind_trusted_proxy(self):
+        request = self.factory.get(
+            "/v1/auth/login", HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2"
+        )
+        self.assertEqual(self.limiter.get_ip(request), "2.2.2.2")
+
+        for spoofed in ("1.1.1.1", "3.3.3.3"):
+            self.assertIsNone(self.hit(HTTP_X_FORWARDED_FOR=f"{spoofed}, 4.4.4.4"))
+        self.assertIsNotNone(self.hit(HTTP_X_FORWARDED_FOR="5.5.5.5, 4.4.4.4"))
+        self.assertIsNone(self.hit(HTTP_X_FORWARDED_FOR="4.4.4.4, 6.6.6.6"))
+
+    def test_unknown_tokens_count_against_ip(self):
+        for token in ("a", "b"):
+            self.assertIsNone(
+                self.hit("/v1/canvases", HTTP_AUTHORIZATION=f"Token {token}")
+            )
+        self.assertIsNotNone(self.hit("/v1/canvases", HTTP_AUTHORIZATION="Token c"))
+
+    def test_unknown_tokens_are_cached(self):
+        request = self.factory.get("/v1/canvases", HTTP_AUTHORIZATION="Token made-up")
+        self.assertEqual(self.limiter.get_identity(request, RULES[1]), "ip:127.0.0.1")
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.limiter.get_identity(request, RULES[1]), "ip:127.0.0.1"
+            )
+
+    def test_tokens_count_against_their_user(self):
+        user = User.objects.create_user(
+            email="limits@dhanriti.net", username="limits", password="password"
+        )
+        token = Token.objects.create(user=user)
+        request = self.factory.get(
+            "/v1/canvases", HTTP_AUTHORIZATION=f"Token {token.key}"
+        )
+
+        self.assertEqual(
+            self.limiter.get_identity(request, RULES[1]), f"user:{user.pk}"
+        )
+        # The owner is cached, so later requests do not query
+        with self.assertNumQueries(0):
+            self.limiter.get_identity(request, RULES[1])
+
+    def test_redis_script(self):
+        with override_settings(
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.redis.RedisCache",
+                    "LOCATION": "redis://localhost:6379/",
+                }
+            }
+        ):
+            client = FakeRedisClient()
+            caches["default"].__dict__["_cache"] = client
+
+            self.assertIsNone(self.hit())
+            self.assertIsNone(self.hit())
+            self.assertIsNotNone(self.hit())
+
+        # One script call per request, with the window as the expiry
+        self.assertEqual(len(client.calls), 3)
+        [(key, count)] = client.counters.items()
+        self.assertTrue(key.startswith(":1:ratelimit:auth:ip:127.0.0.1:"))
+        self.assertEqual(count, 3)
+        self.assertEqual(client.expiries[key], 60)
+
+
+@override_settings(RATE_LIMITS=RULES, RATE_LIMIT_ENABLED=True)
+class RateLimitMiddlewareTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        freeze_time(self)
+
+    def test_retry_after(self):
+        for _ in range(2):
+            self.assertNotEqual(self.client.get("/v1/auth/missing").status_code, 429)
+
+        response = self.client.get("/v1/auth/missing")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "30")
+
+        # Buckets are per rule, not per URL
+        self.assertEqual(self.client.get("/v1/auth/other").status_code, 429)
+        self.assertNotEqual(self.client.get("/v1/missing").status_code, 429)
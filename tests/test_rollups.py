@@ -0,0 +1,119 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from dhanriti.models import User
+from dhanriti.models.enums import FlowRateType, FlowType, RollupPeriod, RollupScope
+from dhanriti.models.rollups import FlowRollup
+from dhanriti.models.tanks import Canvas, Flow, Funnel, Tank
+from utils.flow import CanvasFlowEngine, trigger_canvas_inflow
+
+
+class FlowRollupTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="rollups@dhanriti.net", username="rollups", password="password"
+        )
+        self.client.force_authenticate(self.user)
+
+        self.canvas = Canvas.objects.create(
+            name="Canvas", user=self.user, inflow=1000, inflow_rate="0 9 1 * *"
+        )
+        self.tank = Tank.objects.create(
+            name="Savings", canvas=self.canvas, capacity=250
+        )
+        self.funnel = Funnel.objects.create(
+            canvas=self.canvas,
+            out_tank=self.tank,
+            flow=10,
+            flow_type=FlowType.PERCENTAGE,
+            flow_rate_type=FlowRateType.CONSEQUENT,
+        )
+
+    def get_rollups(self):
+        return set(
+            FlowRollup.objects.values_list(
+                "scope",
+                "scope_id",
+                "period",
+                "bucket",
+                "flowed",
+                "count",
+                "manual_count",
+                "reduced_count",
+            )
+        )
+
+    def test_rollups_are_incremented(self):
+        for _ in range(3):
+            trigger_canvas_inflow(self.canvas)
+        trigger_canvas_inflow(self.canvas, manual_trigger=True)
+
+        today = timezone.localdate()
+        tank = FlowRollup.objects.get(
+            scope=RollupScope.TANK, scope_id=self.tank.pk, period=RollupPeriod.DAY
+        )
+        self.assertEqual(tank.bucket, today)
+        self.assertAlmostEqual(tank.flowed, 250)
+        self.assertEqual(tank.count, 4)
+        self.assertEqual(tank.manual_count, 1)
+        # The third flow fills the tank and the fourth finds it full
+        self.assertEqual(tank.reduced_count, 2)
+
+        month = FlowRollup.objects.get(
+            scope=RollupScope.CANVAS,
+            scope_id=self.canvas.pk,
+            period=RollupPeriod.MONTH,
+        )
+        self.assertEqual(month.bucket, today.replace(day=1))
+        self.assertAlmostEqual(month.flowed, 4000)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        now = timezone.now()
+        for days in (40, 3, 3, 0):
+            engine = CanvasFlowEngine(self.canvas.pk)
+            engine.inflow(at=now - timedelta(days=days))
+            engine.commit()
+        # Flows saved outside the engine are rolled up too
+        Flow.objects.create(canvas=self.canvas, flowed=5, manual=True)
+        incremental = self.get_rollups()
+
+        FlowRollup.objects.all().delete()
+        call_command("rebuild_flow_rollups", stdout=StringIO())
+
+        self.assertEqual(self.get_rollups(), incremental)
+        self.assertEqual(
+            FlowRollup.objects.filter(
+                scope=RollupScope.FUNNEL, period=RollupPeriod.DAY
+            ).count(),
+            3,
+        )
+
+    def test_stats_endpoint(self):
+        trigger_canvas_inflow(self.canvas)
+        url = f"/v1/canvases/{self.canvas.external_id}/stats"
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["period"], "day")
+        self.assertEqual(
+            {(row["scope"], row["external_id"]) for row in response.data["results"]},
+            {
+                ("canvas", self.canvas.external_id),
+                ("tank", self.tank.external_id),
+                ("funnel", self.funnel.external_id),
+            },
+        )
+
+        response = self.client.get(url, {"period": "month"})
+        self.assertEqual(len(response.data["results"]), 3)
+
+        start = timezone.localdate() + timedelta(days=1)
+        response = self.client.get(url, {"start": start.isoformat()})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(url, {"period": "week"})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,71 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+from rest_framework import serializers
+
+from utils.verifyHTML import validate_html, verify_html
+
+
+class ValidateHTMLTest(SimpleTestCase):
+    def test_collects_image_file_names(self):
+        value = (
+            '<div style="text-align: center;"><b>Title</b><br>'
+            '<img src="https://cdn.dhanriti.net/media/abc_1.png"><br/>'
+            '<i>text</i><img src="https://cdn.dhanriti.net/media/def.jpg" /></div>'
+        )
+
+        self.assertEqual(validate_html(value), ["abc", "def"])
+
+    def test_rejects_invalid_documents(self):
+        cases = {
+            "<div><b>text</div></b>": "not closed",
+            "<div><b>text</b>": "not closed",
+            "text</div>": "not closed",
+            "<p>text</p>": "Invalid HTML tag",
+            '<div class="x">text</div>': "Invalid HTML attribute",
+            '<div style="color: red">text</div>': "invalid property",
+            "<img>": "Invalid image URL",
+        }
+        for value, message in cases.items():
+            with self.subTest(value=value):
+                with self.assertRaisesMessage(serializers.ValidationError, message):
+                    validate_html(value)
+
+    def test_document_larger_than_a_chunk(self):
+        value = "<div><b>text</b><br></div>" * 10000
+
+        self.assertEqual(validate_html(value), [])
+
+
+class VerifyHTMLTest(SimpleTestCase):
+    value = (
+        '<div><img src="https://cdn.dhanriti.net/media/abc_1.png">'
+        '<img src="https://cdn.dhanriti.net/media/def.jpg"></div>'
+    )
+
+    def verify(self, infos, part_id=7):
+        client = mock.Mock()
+        client.get_many.return_value = infos
+        with mock.patch("utils.verifyHTML.get_cdn_client", return_value=client):
+            verify_html(self.value, 2, part_id)
+        return client
+
+    def test_images_of_the_part(self):
+        meta = {"meta": {"type": 2, "part": 7}}
+        client = self.verify({"abc": meta, "def": meta})
+
+        client.get_many.assert_called_once_with(["abc", "def"])
+
+    def test_rejects_other_images(self):
+        meta = {"meta": {"type": 2, "part": 7}}
+        cases = [
+            {"abc": meta, "def": None},
+            {"abc": meta, "def": {"meta": {"type": 1, "part": 7}}},
+            {"abc": meta, "def": {"meta": {"type": 2, "part": 8}}},
+        ]
+        for infos in cases:
+            with self.subTest(infos=infos):
+                with self.assertRaisesMessage(
+                    serializers.ValidationError, "Invalid image URL"
+                ):
+                    self.verify(infos)
@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.test import SimpleTestCase
+
+from utils.vishnu import VishnuClient, VishnuUnavailable
+
+
+class StubVishnuHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def respond(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get("X-API-KEY")))
+        if server.failures:
+            server.failures -= 1
+            return self.respond({}, status=503)
+        if server.delay:
+            time.sleep(server.delay)
+        self.respond({"service_token": "service", "user": {"email": "a@b.c"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.server.requests.append((self.path, self.rfile.read(length).decode()))
+        self.respond({"token": "service", "url": "https://vishnu/login"})
+
+
+class VishnuClientTest(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubVishnuHandler)
+        self.server.requests = []
+        self.server.failures = 0
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def get_client(self, **kwargs):
+        options = {
+            "host": f"http://127.0.0.1:{self.server.server_port}",
+            "api_key": "key",
+            "connect_timeout": 1,
+            "read_timeout": 0.5,
+            "retries": 2,
+            "backoff_factor": 0,
+            "failure_threshold": 2,
+            "reset_timeout": 60,
+        }
+        options.update(kwargs)
+        return VishnuClient(**options)
+
+    def test_get_user_by_token(self):
+        data = self.get_client().get_user_by_token("abc")
+
+        self.assertEqual(data["service_token"], "service")
+        self.assertEqual(self.server.requests, [("/users/token?token=abc", "key")])
+
+    def test_create_service_token(self):
+        data = self.get_client().create_service_token("https://ok", "https://fail")
+
+        self.assertEqual(data["url"], "https://vishnu/login")
+        path, body = self.server.requests[0]
+        self.assertEqual(path, "/servicetoken")
+        self.assertIn("success_url=https%3A%2F%2Fok", body)
+
+    def test_retries_unavailable_responses(self):
+        self.server.failures = 2
+
+        data = self.get_client().get_user_by_token("abc")
+
+        self.assertEqual(data["service_token"], "service")
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_read_timeout(self):
+        self.server.delay = 2
+
+        with self.assertRaises(VishnuUnavailable):
+            self.get_client(retries=0).get_user_by_token("abc")
+
+    def test_circuit_opens_after_failures(self):
+        self.server.failures = 100
+        client = self.get_client(retries=0)
+
+        for _ in range(2):
+            with self.assertRaises(VishnuUnavailable):
+                client.get_user_by_token("abc")
+        with self.assertRaises(VishnuUnavailable):
+            client.get_user_by_token("abc")
+
+        self.assertEqual(len(self.server.requests), 2)
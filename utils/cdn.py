@@ -0,0 +1,147 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+
+class CDNError(Exception):
+    pass
+
+
+def get_file_name(url):
+    return str(url.split("media/")[-1].split(".")[0].split("_")[0])
+
+
+class LocalTTLCache:
+    """
+    Small per-process LRU cache whose entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+class CDNClient:
+    """
+    Looks up file metadata from the CDN `/info` endpoint.
+
+    Successful lookups are cached by file name for CDN_INFO_TTL seconds,
+    first in a per-process LRU and then in the Django cache, and misses
+    for a whole document are fetched concurrently over a pooled session.
+    """
+
+    def __init__(self):
+        self.host = settings.CDN_HOST
+        self.ttl = settings.CDN_INFO_TTL
+        self.local = LocalTTLCache(settings.CDN_LOCAL_CACHE_SIZE, self.ttl)
+
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=settings.CDN_LOOKUP_CONCURRENCY
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Authorization"] = f"Bearer {settings.CDN_KEY}"
+
+    def get_cache_key(self, name):
+        return f"cdn:info:{name}"
+
+    def fetch(self, name):
+        try:
+            response = self.session.get(
+                f"{self.host}/info",
+                params={"f": name},
+                timeout=settings.CDN_TIMEOUT,
+            )
+        except requests.exceptions.RequestException as e:
+            raise CDNError(str(e)) from e
+
+        if response.status_code != 200:
+            return None
+        try:
+            return response.json()
+        except ValueError as e:
+            raise CDNError(str(e)) from e
+
+    def get_info(self, name):
+        return self.get_many([name])[name]
+
+    def get_many(self, names):
+        """
+        Return `{name: info}` for every file name, with None for files the
+        CDN does not know. Only successful lookups are cached.
+        """
+        names = list(dict.fromkeys(names))
+        results = {}
+
+        for name in names:
+            info = self.local.get(name)
+            if info is not None:
+                results[name] = info
+
+        missing = [name for name in names if name not in results]
+        if missing:
+            cached = cache.get_many([self.get_cache_key(name) for name in missing])
+            for name in missing:
+                info = cached.get(self.get_cache_key(name))
+                if info is not None:
+                    results[name] = info
+                    self.local.set(name, info)
+
+        missing = [name for name in names if name not in results]
+        if len(missing) == 1:
+            fetched = [self.fetch(missing[0])]
+        elif missing:
+            workers = min(len(missing), settings.CDN_LOOKUP_CONCURRENCY)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                fetched = list(executor.map(self.fetch, missing))
+        else:
+            fetched = []
+
+        to_cache = {}
+        for name, info in zip(missing, fetched):
+            results[name] = info
+            if info is not None:
+                self.local.set(name, info)
+                to_cache[self.get_cache_key(name)] = info
+        if to_cache:
+            cache.set_many(to_cache, timeout=self.ttl)
+
+        return results
+
+
+_client = None
+
+
+def get_cdn_client():
+    global _client
+    if _client is None:
+        _client = CDNClient()
+    return _client
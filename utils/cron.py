@@ -0,0 +1,173 @@
+import re
+from datetime import timedelta
+from functools import lru_cache
+
+from django.core.exceptions import ValidationError
+
+# *, numbers, ranges and lists, with an optional step
+FIELD_RE = re.compile(r"^(\*|(\d+(-\d+)?)(,\d+(-\d+)?)*)(/\d+)?$")
+
+# (min, max) for minute, hour, day of month, month and day of week
+# (0 and 7 are both Sunday)
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+# An expression that matches nothing (e.g. "0 0 31 2 *") is given up on
+# after this many years without a fire time
+MAX_SEARCH_YEARS = 8
+
+
+def full_mask(low, high):
+    return ((1 << (high + 1)) - 1) & ~((1 << low) - 1)
+
+
+def next_bit(mask, n):
+    """
+    Return the lowest set bit of `mask` at position `n` or above, or None.
+    """
+    rest = mask >> n
+    if not rest:
+        return None
+    return n + (rest & -rest).bit_length() - 1
+
+
+def parse_field(field, low, high):
+    if not FIELD_RE.match(field):
+        raise ValidationError("Invalid crontab expression")
+
+    mask = 0
+    for part in field.split(","):
+        step = None
+        if "/" in part:
+            part, step = part.split("/")
+            step = int(step)
+            if step <= 0:
+                raise ValidationError("Invalid crontab expression")
+
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = map(int, part.split("-"))
+            if start > end or start < low or end > high:
+                raise ValidationError("Invalid crontab expression")
+        else:
+            start = int(part)
+            if start < low or start > high:
+                raise ValidationError("Invalid crontab expression")
+            # A single value with a step runs to the end of the range
+            end = start if step is None else high
+
+        for value in range(start, end + 1, step or 1):
+            mask |= 1 << value
+    return mask
+
+
+class CronExpression:
+    """
+    A crontab expression compiled to one bitmask per field.
+
+    Bit `n` of a mask is set when the field matches value `n`. Days of the
+    week are numbered from Sunday = 0. As in cron, when both the day of
+    month and the day of week are restricted a day matches if either does.
+    """
+
+    __slots__ = ("minutes", "hours", "days", "months", "weekdays", "day_or")
+
+    def __init__(self, minutes, hours, days, months, weekdays):
+        self.minutes = minutes
+        self.hours = hours
+        self.days = days
+        self.months = months
+        self.weekdays = weekdays
+        self.day_or = days != full_mask(1, 31) and weekdays != full_mask(0, 6)
+
+    @classmethod
+    def parse(cls, expr):
+        # Nullable schedule fields hand over None
+        if not isinstance(expr, str):
+            raise ValidationError("Invalid crontab expression")
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValidationError("Invalid crontab expression")
+
+        masks = [
+            parse_field(field, low, high)
+            for field, (low, high) in zip(fields, FIELD_RANGES)
+        ]
+        # Fold Sunday = 7 onto Sunday = 0
+        if masks[4] & (1 << 7):
+            masks[4] = (masks[4] | 1) & ~(1 << 7)
+        return cls(*masks)
+
+    def matches_day(self, dt):
+        day = self.days >> dt.day & 1
+        weekday = self.weekdays >> (dt.weekday() + 1) % 7 & 1
+        if self.day_or:
+            return bool(day or weekday)
+        return bool(day and weekday)
+
+    def matches(self, dt):
+        """
+        Return whether the expression fires at the minute containing `dt`.
+        """
+        return bool(
+            self.minutes >> dt.minute & 1
+            and self.hours >> dt.hour & 1
+            and self.months >> dt.month & 1
+            and self.matches_day(dt)
+        )
+
+    def next_after(self, after):
+        """
+        Return the first minute strictly after `after` at which the
+        expression fires, or None if it never does. Aware datetimes are
+        stepped in their own wall-clock time.
+        """
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt.year + MAX_SEARCH_YEARS
+
+        while dt.year <= limit:
+            month = next_bit(self.months, dt.month)
+            if month is None:
+                dt = dt.replace(year=dt.year + 1, month=1, day=1, hour=0, minute=0)
+                continue
+            if month != dt.month:
+                dt = dt.replace(month=month, day=1, hour=0, minute=0)
+
+            if not self.matches_day(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+
+            hour = next_bit(self.hours, dt.hour)
+            if hour is None:
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if hour != dt.hour:
+                dt = dt.replace(hour=hour, minute=0)
+
+            minute = next_bit(self.minutes, dt.minute)
+            if minute is None:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+                continue
+            return dt.replace(minute=minute)
+
+        return None
+
+
+@lru_cache(maxsize=1024)
+def compile_cron(expr):
+    """
+    Parse and cache `expr`. Raises ValidationError if it is not a valid
+    five-field crontab expression, or not a string at all.
+    """
+    return CronExpression.parse(expr)
+
+
+def get_next_fire_times(exprs, after):
+    """
+    Return `{expr: next fire time}` computing each distinct expression once.
+    """
+    return {expr: compile_cron(expr).next_after(after) for expr in set(exprs)}
+
+
+def is_due(expr, at):
+    return compile_cron(expr).matches(at)
@@ -1,12 +1,20 @@
 from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import status
+from rest_framework.exceptions import APIException
 from rest_framework.exceptions import ValidationError as DRFValidationError
 from rest_framework.fields import get_error_detail
 from rest_framework.views import exception_handler as drf_exception_handler
 
+from utils.locks import CanvasBusy
+
 
 def exception_handler(exc, context):
 
     if isinstance(exc, DjangoValidationError):
         exc = DRFValidationError(detail={"detail": get_error_detail(exc)[0]})
 
+    if isinstance(exc, CanvasBusy):
+        exc = APIException(detail="Canvas is busy, please try again")
+        exc.status_code = status.HTTP_409_CONFLICT
+
     return drf_exception_handler(exc, context)
@@ -1,22 +1,37 @@
-from dhanriti.models.enums import FlowRateType, FlowType
-from dhanriti.models.tanks import Canvas, Flow, Funnel
+import logging
+from collections import defaultdict
 
+from django.db import transaction
 
-def trigger_canvas_inflow(canvas : Canvas, manual_trigger=False):
-    Flow.objects.create(canvas=canvas, flowed=canvas.inflow, manual=manual_trigger)
+from dhanriti.models.enums import FlowRateType, FlowType
+from dhanriti.models.tanks import Canvas, Flow, Funnel, Tank
+from utils.cron import compile_cron
+from utils.graph import FunnelGraph
+from utils.ledger import flow_entries, record_entries
+from utils.locks import canvas_lock
+from utils.rollups import update_rollups
+
+logger = logging.getLogger(__name__)
 
-def trigger_funnel_flow(funnel: Funnel, timely_trigger=False, bypass_last_flow=False, manual_trigger=False):
-    last_flow = None
-    flow = 0
-    if not funnel.in_tank:
-        in_tank_filled = funnel.canvas.filled
-        last_flow = Flow.objects.filter(canvas=funnel.canvas, funnel=None)
-    else:
-        last_flow = Flow.objects.filter(funnel=Funnel.objects.get(out_tank=funnel.in_tank))
-        in_tank_filled = funnel.in_tank.filled
 
-    last_flow = last_flow.order_by("-created_at").first()
+def compute_funnel_flow(
+    funnel: Funnel,
+    in_tank_filled,
+    out_tank_filled,
+    out_tank_capacity,
+    last_flow=None,
+    timely_trigger=False,
+    bypass_last_flow=False,
+):
+    """
+    Apply the flow rules of `funnel` to the given balances. This has no
+    side effects, so forecasts can run it as often as they need.
 
+    `last_flow` is the most recent flow into the funnel's in tank (or the
+    latest canvas inflow for funnels draining the main tank). Returns a
+    `(flow, reduce_reason)` tuple, or None if the funnel does not flow for
+    this kind of trigger.
+    """
     if funnel.flow_rate_type == FlowRateType.CONSEQUENT:
         if last_flow and not bypass_last_flow:
             deductable = last_flow.flowed if not (last_flow.meta and last_flow.meta.get("reduced", False)) else last_flow.meta.get("original_flow", 0)
@@ -36,23 +51,405 @@ def trigger_funnel_flow(funnel: Funnel, timely_trigger=False, bypass_last_flow=F
         else:
             flow = funnel.flow if funnel.flow < in_tank_filled else in_tank_filled
     else:
-        return
+        return None
 
     reduce_reason = None
-    tank_space = funnel.out_tank.capacity - funnel.out_tank.filled
+    tank_space = (
+        out_tank_capacity - out_tank_filled
+        if out_tank_capacity is not None
+        else float("inf")
+    )
     if flow > tank_space:
-        print(f"Flow reduced to {tank_space} from {flow} because out tank does not have space")
         flow = tank_space
         reduce_reason = "out_tank_space"
-    elif funnel.in_tank and flow > funnel.in_tank.filled:
-        print(f"Flow reduced to {funnel.in_tank.filled} from {flow} because in tank does not have enough money")
+    elif funnel.in_tank_id and flow > in_tank_filled:
         reduce_reason = "in_tank_space"
-        flow = funnel.in_tank.filled
+        flow = in_tank_filled
+
+    return flow, reduce_reason
+
+
+class CanvasFlowEngine:
+    """
+    Runs flow cascades for a single canvas in memory.
+
+    The canvas, its funnels and tanks, and the latest flows feeding every
+    tank are loaded once. Each trigger walks the funnel graph iteratively
+    in the same depth-first order the post_save cascade used to follow,
+    and `commit` writes every resulting Flow row and balance in bulk
+    inside one transaction.
+    """
+
+    def __init__(self, canvas_id):
+        self.canvas = Canvas.objects.select_related("last_flow").get(pk=canvas_id)
+        self.canvas_filled = self.canvas.filled
+
+        self.funnels = {}
+        self.tanks = {}
+        self.tank_filled = {}
+        for funnel in (
+            Funnel.objects.filter(canvas_id=canvas_id)
+            .select_related("in_tank", "out_tank", "last_flow")
+            .order_by("pk")
+        ):
+            self._register(funnel)
+
+        # Downstream funnels come from the graph of the funnels just loaded
+        graph = FunnelGraph.from_funnels(self.funnels.values())
+        self.cyclic = graph.order is None
+        self.root_funnels = [self.funnels[pk] for pk in graph.children.get(None, [])]
+        self.children = defaultdict(list)
+        for tank_id, pks in graph.children.items():
+            if tank_id is not None:
+                self.children[tank_id] = [self.funnels[pk] for pk in pks]
+
+        # The latest flows come from the denormalized pointers
+        self.last_inflow = self.canvas.last_flow
+        self.last_into_tank = {}
+        for funnel in sorted(
+            (funnel for funnel in self.funnels.values() if funnel.last_flow_id),
+            key=lambda funnel: funnel.last_flow_at,
+        ):
+            self.last_into_tank[funnel.out_tank_id] = funnel.last_flow
+
+        self.flows = []
+        self.applied = []
+
+    @classmethod
+    def for_flow(cls, flow: Flow):
+        return cls(flow.canvas_id if flow.canvas_id else flow.funnel.canvas_id)
+
+    def _register(self, funnel: Funnel):
+        for field in ("in_tank", "out_tank"):
+            tank = getattr(funnel, field)
+            if tank is None:
+                continue
+            if tank.pk not in self.tanks:
+                self.tanks[tank.pk] = tank
+                self.tank_filled[tank.pk] = tank.filled
+            setattr(funnel, field, self.tanks[tank.pk])
+
+        self.funnels[funnel.pk] = funnel
+
+    def inflow(self, manual=False, at=None):
+        """
+        `at` backdates the created flows, e.g. when catching up on missed
+        schedule windows.
+        """
+        flow = Flow(
+            canvas=self.canvas, flowed=self.canvas.inflow, manual=manual, created_at=at
+        )
+        self.flows.append(flow)
+        self._apply(flow)
+        self._cascade(self.root_funnels, manual, at=at)
+
+    def trigger(
+        self,
+        funnel: Funnel,
+        timely_trigger=False,
+        bypass_last_flow=False,
+        manual=False,
+        at=None,
+    ):
+        self._cascade(
+            [self.funnels[funnel.pk]],
+            manual,
+            timely_trigger=timely_trigger,
+            bypass_last_flow=bypass_last_flow,
+            at=at,
+        )
+
+    def apply(self, flow: Flow):
+        """
+        Account for a flow that was saved outside the engine and cascade it.
+        """
+        self.applied.append(flow)
+        if flow.funnel_id is None:
+            self._apply(flow)
+            self._cascade(self.root_funnels, flow.manual)
+            return
+
+        if flow.funnel_id not in self.funnels:
+            # A deleted funnel; it joins the cascades of this engine only
+            self._register(flow.funnel)
+            if flow.funnel.in_tank_id is None:
+                self.root_funnels.append(flow.funnel)
+            else:
+                self.children[flow.funnel.in_tank_id].append(flow.funnel)
+        self._apply(flow)
+        self._cascade(
+            self.children[self.funnels[flow.funnel_id].out_tank_id], flow.manual
+        )
+
+    def _apply(self, flow: Flow):
+        if flow.funnel_id is None:
+            self.canvas_filled += flow.flowed
+            self.last_inflow = flow
+            return
+
+        funnel = self.funnels[flow.funnel_id]
+        if funnel.in_tank_id:
+            self.tank_filled[funnel.in_tank_id] -= flow.flowed
+        else:
+            self.canvas_filled -= flow.flowed
+        self.tank_filled[funnel.out_tank_id] += flow.flowed
+        self.last_into_tank[funnel.out_tank_id] = flow
+
+    def _cascade(
+        self, funnels, manual, timely_trigger=False, bypass_last_flow=False, at=None
+    ):
+        # Explicit stack instead of recursion: a funnel's whole subtree is
+        # settled before its next sibling computes its flow
+        stack = [(funnel, timely_trigger, bypass_last_flow) for funnel in reversed(funnels)]
+        # A funnel fires once per flow into its in tank, so in a diamond it
+        # fires once per path. Cycles are rejected when funnels are written;
+        # on canvases from before that every funnel fires at most once.
+        fired = set() if self.cyclic else None
+        while stack:
+            funnel, timely, bypass = stack.pop()
+            if fired is not None and funnel.pk in fired:
+                logger.warning(f"Funnel {funnel.pk} is part of a cycle, not flowing again")
+                continue
+
+            if funnel.in_tank_id is None:
+                in_tank_filled = self.canvas_filled
+                last_flow = self.last_inflow
+            else:
+                in_tank_filled = self.tank_filled[funnel.in_tank_id]
+                last_flow = self.last_into_tank.get(funnel.in_tank_id)
+
+            result = compute_funnel_flow(
+                funnel,
+                in_tank_filled,
+                self.tank_filled[funnel.out_tank_id],
+                funnel.out_tank.capacity,
+                last_flow,
+                timely_trigger=timely,
+                bypass_last_flow=bypass,
+            )
+            if result is None:
+                continue
+            if fired is not None:
+                fired.add(funnel.pk)
+
+            amount, reduce_reason = result
+            if reduce_reason == "out_tank_space":
+                logger.info(f"Flow reduced to {amount} because out tank does not have space")
+            elif reduce_reason == "in_tank_space":
+                logger.info(f"Flow reduced to {amount} because in tank does not have enough money")
+            logger.info(f"flowing {amount} from {funnel.in_tank.name if funnel.in_tank else 'Main Tank'} to {funnel.out_tank.name}")
+            flow = Flow(
+                funnel=funnel,
+                in_tank=funnel.in_tank,
+                out_tank=funnel.out_tank,
+                flowed=amount,
+                canvas=self.canvas,
+                manual=manual,
+                created_at=at,
+                meta={
+                    "reduced": amount != funnel.flow,
+                    "reduced_reason": reduce_reason,
+                    "original_flow": funnel.flow,
+                },
+            )
+            self.flows.append(flow)
+            self._apply(flow)
+
+            stack.extend(
+                (child, False, False)
+                for child in reversed(self.children[funnel.out_tank_id])
+            )
+
+    def commit(self):
+        """
+        Write pending flows and the resulting balances in one transaction.
+        """
+        flows, self.flows = self.flows, []
+        backdated = [(flow, flow.created_at) for flow in flows if flow.created_at]
+        with transaction.atomic():
+            # Bulk created flows reach post_save receivers with raw=True
+            Flow.objects.bulk_create(flows)
+
+            # created_at is auto_now_add, so backdated flows are restamped
+            if backdated:
+                for flow, at in backdated:
+                    flow.created_at = at
+                Flow.objects.bulk_update([flow for flow, _ in backdated], ["created_at"])
+
+            # Balances are written as deltas so concurrent payments and
+            # flows on the same rows are never overwritten
+            if self.canvas_filled != self.canvas.filled:
+                self.canvas.credit(self.canvas_filled - self.canvas.filled)
+
+            deltas = {}
+            for pk, filled in self.tank_filled.items():
+                deltas[pk] = filled - self.tanks[pk].filled
+                self.tanks[pk].filled = filled
+            Tank.apply_deltas(deltas)
+
+            applied, self.applied = self.applied, []
+            self._record_last_flows(applied + flows)
+            record_entries(
+                [
+                    entry
+                    for flow in applied + flows
+                    for entry in flow_entries(flow, self.canvas.pk)
+                ]
+            )
+            update_rollups(applied + flows, self.canvas.pk)
+
+        return flows
+
+    def _record_last_flows(self, flows):
+        """
+        Move the last flow pointers of the canvas and funnels to `flows`.
+        """
+        canvas_changed = False
+        funnels = {}
+        for flow in flows:
+            if flow.funnel_id is None:
+                canvas_changed |= self.canvas.record_flow(flow)
+                continue
+            funnel = self.funnels.get(flow.funnel_id)
+            if funnel is not None and funnel.record_flow(flow):
+                funnels[funnel.pk] = funnel
+
+        if canvas_changed:
+            Canvas.objects.filter(pk=self.canvas.pk).update(
+                **{
+                    field: getattr(self.canvas, field)
+                    for field in Canvas.LAST_FLOW_FIELDS
+                }
+            )
+        if funnels:
+            Funnel.objects.bulk_update(funnels.values(), Funnel.LAST_FLOW_FIELDS)
+
+
+def trigger_canvas_inflow(canvas : Canvas, manual_trigger=False):
+    with canvas_lock(canvas.pk):
+        engine = CanvasFlowEngine(canvas.pk)
+        engine.inflow(manual=manual_trigger)
+        return engine.commit()
+
+def trigger_funnel_flow(funnel: Funnel, timely_trigger=False, bypass_last_flow=False, manual_trigger=False):
+    with canvas_lock(funnel.canvas_id):
+        engine = CanvasFlowEngine(funnel.canvas_id)
+        engine.trigger(
+            funnel,
+            timely_trigger=timely_trigger,
+            bypass_last_flow=bypass_last_flow,
+            manual=manual_trigger,
+        )
+        return engine.commit()
+
+
+def preview_trigger(canvas_id, funnel_id=None):
+    """
+    Run a manual inflow into the canvas, or a manual flow through one of its
+    funnels, in memory only. Returns the engine with the flows left pending
+    and the balances they would leave; nothing is locked or written.
+    """
+    engine = CanvasFlowEngine(canvas_id)
+    if funnel_id:
+        engine.trigger(engine.funnels[funnel_id], bypass_last_flow=True, manual=True)
+    else:
+        engine.inflow(manual=True)
+    return engine
+
+
+def get_missed_fire_times(expr, since, until, limit):
+    """
+    Return up to `limit` fire times of `expr` after `since` and no later
+    than `until`, and the fire time that follows them.
+    """
+    cron = compile_cron(expr)
+    times = []
+    at = cron.next_after(since)
+    while at is not None and at <= until and len(times) < limit:
+        times.append(at)
+        at = cron.next_after(at)
+    return times, at
+
+
+def get_due_fire_times(expr, first, until, limit):
+    """
+    Like get_missed_fire_times, from the fire time `first` included.
+    """
+    if first > until or limit < 1:
+        return [], first
+    times, at = get_missed_fire_times(expr, first, until, limit - 1)
+    return [first, *times], at
+
+
+def catch_up_canvas(canvas_id, now, limit, dry_run=False):
+    """
+    Fire every schedule window of a canvas inflow and its timely funnels
+    missed from their next fire time on, at most `limit` windows each.
+    Saving a new schedule moves the next fire time past the change, so the
+    windows a new schedule would have had before it are never fired.
+
+    The windows are replayed in time order in one engine, the flows are
+    stamped with their window's time and everything is written in one
+    commit. Entities with windows left over are rescheduled at the first of
+    them, so running this again continues where it stopped. Returns a
+    report; with `dry_run` nothing is written.
+    """
+    with canvas_lock(canvas_id):
+        engine = CanvasFlowEngine(canvas_id)
+        canvas = engine.canvas
+
+        events = []
+        next_fire_at = {}
+        remaining = False
+
+        if canvas.inflow_rate and canvas.next_fire_at:
+            times, next_fire_at[canvas] = get_due_fire_times(
+                canvas.inflow_rate, canvas.next_fire_at, now, limit
+            )
+            events += [(at, 0, None) for at in times]
+            remaining |= bool(next_fire_at[canvas] and next_fire_at[canvas] <= now)
+
+        timely_funnels = [
+            funnel
+            for funnel in engine.funnels.values()
+            if funnel.flow_rate_type == FlowRateType.TIMELY
+            and funnel.flow_rate
+            and funnel.next_fire_at
+        ]
+        for funnel in timely_funnels:
+            times, next_fire_at[funnel] = get_due_fire_times(
+                funnel.flow_rate, funnel.next_fire_at, now, limit
+            )
+            events += [(at, 1, funnel.pk) for at in times]
+            remaining |= bool(next_fire_at[funnel] and next_fire_at[funnel] <= now)
+
+        # Inflows before funnels at the same instant, as cron_watch does
+        for at, _, funnel_id in sorted(events, key=lambda event: event[:2]):
+            if funnel_id is None:
+                engine.inflow(at=at)
+            else:
+                engine.trigger(
+                    engine.funnels[funnel_id],
+                    timely_trigger=True,
+                    bypass_last_flow=True,
+                    at=at,
+                )
+
+        report = {
+            "canvas": str(canvas.external_id),
+            "name": canvas.name,
+            "windows": len(events),
+            "flows": len(engine.flows),
+            "inflowed": sum(
+                flow.flowed for flow in engine.flows if flow.funnel_id is None
+            ),
+            "remaining": remaining,
+        }
+        if dry_run or not events:
+            return report
 
-    print(f"flowing {flow} from {funnel.in_tank.name if funnel.in_tank else 'Main Tank'} to {funnel.out_tank.name}")
+        engine.commit()
+        for instance, at in next_fire_at.items():
+            type(instance).objects.filter(pk=instance.pk).update(next_fire_at=at)
+    return report
 
-    Flow.objects.create(funnel=funnel, flowed=flow, canvas=funnel.canvas, manual=manual_trigger, meta={
-        "reduced": flow != funnel.flow,
-        "reduced_reason": reduce_reason,
-        "original_flow": funnel.flow
-    })
\ No newline at end of file
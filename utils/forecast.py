@@ -0,0 +1,433 @@
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from datetime import timezone as dt_timezone
+from functools import reduce
+
+import numpy as np
+
+from dhanriti.models.enums import FlowRateType, FlowType
+from dhanriti.models.tanks import Tank
+from utils.cron import compile_cron
+from utils.flow import CanvasFlowEngine, compute_funnel_flow
+
+MINUTES_PER_DAY = 24 * 60
+
+# Effects remembered per event, for events that alternate between regimes
+# (say an inflow right after a timely funnel fills a tank it empties)
+MAX_EFFECTS = 8
+
+# The bits of a flow the flow rules read when it is the latest flow into a
+# tank; forecast flows are never saved
+LastFlow = namedtuple("LastFlow", ("flowed", "meta"))
+
+
+def get_bits(mask, low, high):
+    return [n for n in range(low, high + 1) if mask >> n & 1]
+
+
+def expand_fire_times(expr, start, end):
+    """
+    Return every minute in (start, end] at which `expr` fires, as a sorted
+    array of minutes since the epoch (UTC).
+
+    The day fields are matched for all days of the range at once, and each
+    matching day is crossed with the minutes of the day the hour and minute
+    fields allow, so nothing is evaluated per minute.
+    """
+    cron = compile_cron(expr)
+    days = np.arange(start // MINUTES_PER_DAY, end // MINUTES_PER_DAY + 1)
+    dates = days.astype("datetime64[D]")
+    month_starts = dates.astype("datetime64[M]")
+    months = month_starts.astype(np.int64) % 12 + 1
+    days_of_month = (dates - month_starts.astype("datetime64[D]")).astype(np.int64) + 1
+    # 1970-01-01 was a Thursday, and Sunday is 0
+    weekdays = (days + 4) % 7
+
+    day_match = np.right_shift(cron.days, days_of_month) & 1
+    weekday_match = np.right_shift(cron.weekdays, weekdays) & 1
+    if cron.day_or:
+        day_match = day_match | weekday_match
+    else:
+        day_match = day_match & weekday_match
+    matched = day_match & np.right_shift(cron.months, months) & 1
+
+    offsets = np.add.outer(
+        np.array(get_bits(cron.hours, 0, 23), dtype=np.int64) * 60,
+        np.array(get_bits(cron.minutes, 0, 59), dtype=np.int64),
+    ).ravel()
+    times = np.add.outer(days[matched == 1] * MINUTES_PER_DAY, offsets).ravel()
+    return times[(times > start) & (times <= end)]
+
+
+class Effect:
+    """
+    What an event (or a minute of events) did: `delta` is the change of
+    every balance. It does exactly the same again whenever the balances it
+    starts from lie within `low` and `high`, element-wise.
+    """
+
+    __slots__ = ("delta", "low", "high", "moving", "rate", "bound")
+
+    def __init__(self, delta, low, high):
+        self.delta = delta
+        self.low = low
+        self.high = high
+        # The balances that move, and the bound each moves towards
+        self.moving = np.flatnonzero(delta)
+        self.rate = delta[self.moving]
+        self.bound = np.where(self.rate > 0, high[self.moving], low[self.moving])
+
+    def fits(self, balances):
+        return bool(((balances >= self.low) & (balances <= self.high)).all())
+
+    def then(self, other):
+        """
+        Return the effect of this event followed by `other`.
+        """
+        return Effect(
+            self.delta + other.delta,
+            np.maximum(self.low, other.low - self.delta),
+            np.minimum(self.high, other.high - self.delta),
+        )
+
+    def get_repeats(self, balances):
+        """
+        How many times in a row this effect can run from `balances` before
+        one of them leaves its bounds, or None if there is no limit.
+        """
+        limit = ((self.bound - balances[self.moving]) / self.rate).min(initial=np.inf)
+        if limit == np.inf:
+            return None
+        return int(limit) + 1
+
+
+class CanvasForecast:
+    """
+    Simulates the schedules of a canvas without writing anything.
+
+    Node 0 is the main tank and nodes 1..n the tanks, with balances held in
+    a NumPy array. Every event (an inflow, or a timely funnel firing) runs
+    the same cascade and the same rules (compute_funnel_flow) as
+    CanvasFlowEngine, and events due in the same minute run inflow first,
+    then funnels by id, as the cron tasks do.
+
+    Flows only depend on the balances when a flow is reduced, when a
+    percentage or a minimum is taken of a balance, or when a flow would be
+    reduced if the balances moved far enough. So each event is cascaded
+    once and remembered as an Effect with the bounds within which it
+    repeats exactly, and later fire times within those bounds are a single
+    array addition. Minutes that repeat unchanged (say an inflow every
+    minute) are combined into one Effect, and the number of repeats that
+    stay within its bounds is computed for all tanks at once, so a run of
+    them is skipped in one step. A forecast then costs a cascade per change
+    of regime (a tank filling up or running dry) rather than per fire time.
+    """
+
+    def __init__(self, canvas_id):
+        engine = CanvasFlowEngine(canvas_id)
+        self.canvas = engine.canvas
+
+        self.tank_ids = list(engine.tanks)
+        index = {pk: i + 1 for i, pk in enumerate(self.tank_ids)}
+        self.balances = np.array(
+            [engine.canvas_filled] + [engine.tank_filled[pk] for pk in self.tank_ids],
+            dtype=np.float64,
+        )
+        self.capacities = [None] + [engine.tanks[pk].capacity for pk in self.tank_ids]
+        self.last = [engine.last_inflow] + [
+            engine.last_into_tank.get(pk) for pk in self.tank_ids
+        ]
+
+        self.funnels = list(engine.funnels.values())
+        self.sources = [index.get(funnel.in_tank_id, 0) for funnel in self.funnels]
+        self.targets = [index[funnel.out_tank_id] for funnel in self.funnels]
+        self.cyclic = engine.cyclic
+        self.children = [[] for _ in self.balances]
+        for f, funnel in enumerate(self.funnels):
+            self.children[self.sources[f]].append(f)
+
+        self.inflow = LastFlow(self.canvas.inflow, None)
+        self.effects = defaultdict(list)
+
+    def get_events(self, start, end):
+        """
+        Return `(times, codes)` of every event in (start, end] in the order
+        they run. Code 0 is an inflow and code f + 1 funnel f firing.
+        """
+        times = [np.array([], dtype=np.int64)]
+        if self.canvas.inflow:
+            times[0] = expand_fire_times(self.canvas.inflow_rate, start, end)
+        codes = [np.zeros(len(times[0]), dtype=np.int64)]
+        for f, funnel in enumerate(self.funnels):
+            if funnel.flow_rate_type != FlowRateType.TIMELY or not funnel.flow_rate:
+                continue
+            times.append(expand_fire_times(funnel.flow_rate, start, end))
+            codes.append(np.full(len(times[-1]), f + 1, dtype=np.int64))
+        times = np.concatenate(times)
+        codes = np.concatenate(codes)
+        order = np.lexsort((codes, times))
+        return times[order], codes[order]
+
+    def cascade(self, code):
+        """
+        Run event `code` and return its Effect.
+
+        Consequent funnels only read the latest flow into their in tank
+        right after this same event made it, and timely funnels do not read
+        it at all, so an event never depends on the flows of earlier ones.
+        """
+        balances = self.balances
+        start = balances.copy()
+        low = np.full(len(balances), -np.inf)
+        high = np.full(len(balances), np.inf)
+
+        # Bounds on the balance of a node just before a flow, moved back to
+        # the start of the event
+        def pin(node):
+            low[node] = max(low[node], start[node])
+            high[node] = min(high[node], start[node])
+
+        def cover(node, filled, amount):
+            low[node] = max(low[node], start[node] + amount - filled)
+
+        def fit(node, filled, amount):
+            room = self.capacities[node] - amount - filled
+            high[node] = min(high[node], start[node] + room)
+
+        if code == 0:
+            balances[0] += self.canvas.inflow
+            self.last[0] = self.inflow
+            stack = [(f, False) for f in reversed(self.children[0])]
+        else:
+            stack = [(code - 1, True)]
+
+        # The same walk as CanvasFlowEngine._cascade, which only stops a
+        # funnel from firing twice on canvases with a cycle
+        fired = set() if self.cyclic else None
+        while stack:
+            f, timely = stack.pop()
+            if fired is not None and f in fired:
+                continue
+            funnel = self.funnels[f]
+            source, target = self.sources[f], self.targets[f]
+            in_filled, out_filled = balances[source], balances[target]
+            last = self.last[source]
+            result = compute_funnel_flow(
+                funnel,
+                in_filled,
+                out_filled,
+                self.capacities[target],
+                last,
+                timely_trigger=timely,
+                bypass_last_flow=timely,
+            )
+            if result is None:
+                continue
+            if fired is not None:
+                fired.add(f)
+
+            amount, reduce_reason = result
+            balances[source] -= amount
+            balances[target] += amount
+            self.last[target] = LastFlow(
+                amount,
+                {
+                    "reduced": amount != funnel.flow,
+                    "reduced_reason": reduce_reason,
+                    "original_flow": funnel.flow,
+                },
+            )
+
+            from_last = (
+                funnel.flow_rate_type == FlowRateType.CONSEQUENT
+                and last is not None
+                and not timely
+            )
+            if not from_last:
+                if funnel.flow_type == FlowType.PERCENTAGE or funnel.flow >= in_filled:
+                    # A share of the balance, or all of it
+                    pin(source)
+                else:
+                    cover(source, in_filled, funnel.flow)
+
+            capped = self.capacities[target] is not None
+            if reduce_reason == "out_tank_space":
+                pin(target)
+            elif reduce_reason == "in_tank_space":
+                pin(source)
+                if capped and from_last:
+                    # The out tank must still have room for the whole flow
+                    wanted = compute_funnel_flow(funnel, np.inf, 0, None, last)[0]
+                    fit(target, out_filled, wanted)
+                elif capped:
+                    pin(target)
+            else:
+                if capped:
+                    fit(target, out_filled, amount)
+                if funnel.in_tank_id is not None:
+                    cover(source, in_filled, amount)
+
+            stack.extend((child, False) for child in reversed(self.children[target]))
+
+        return Effect(balances - start, low, high)
+
+    def apply(self, effect, count=1):
+        self.balances += count * effect.delta
+
+    def find(self, effects):
+        for effect in effects:
+            if effect.fits(self.balances):
+                return effect
+        return None
+
+    def remember(self, effects, effect):
+        effects.insert(0, effect)
+        del effects[MAX_EFFECTS:]
+        return effect
+
+    def step(self, codes):
+        """
+        Run the events of one minute and return their combined Effect.
+        """
+        effects = []
+        for code in codes:
+            effect = self.find(self.effects[code])
+            if effect is None:
+                effect = self.remember(self.effects[code], self.cascade(code))
+            else:
+                self.apply(effect)
+            effects.append(effect)
+        return reduce(Effect.then, effects)
+
+    def run(self, start, end, samples):
+        """
+        Simulate (start, end], given in minutes since the epoch, and return
+        the balances of every node after the events at or before each of the
+        sorted `samples` (also minutes since the epoch) as a
+        `(len(samples), nodes)` array.
+        """
+        result = np.empty((len(samples), len(self.balances)))
+        times, codes = self.get_events(start, end)
+        if not len(times):
+            result[:] = self.balances
+            return result
+
+        # One group per minute with events
+        starts = np.flatnonzero(np.r_[True, times[1:] != times[:-1]])
+        sizes = np.diff(np.r_[starts, len(times)])
+        group_times = times[starts]
+
+        # A group repeats the one before it if it runs the same events
+        previous = np.arange(len(codes)) - np.repeat(sizes, sizes)
+        differs = codes != codes[np.maximum(previous, 0)]
+        changed = np.add.reduceat(differs, starts) > 0
+        repeats = np.r_[False, (sizes[1:] == sizes[:-1]) & ~changed[1:]]
+        run_starts = np.flatnonzero(~repeats)
+        run_ends = np.r_[run_starts[1:], len(starts)]
+
+        # Groups that have run when each sample is taken
+        sample_groups = np.r_[
+            np.searchsorted(group_times, samples, side="right"), len(starts) + 1
+        ]
+        next_sample = 0
+
+        def take_samples(done, origin=None, delta=None):
+            nonlocal next_sample
+            if done < sample_groups[next_sample]:
+                return
+            stop = np.searchsorted(sample_groups, done, side="right")
+            if delta is None:
+                result[next_sample:stop] = self.balances
+            else:
+                counts = sample_groups[next_sample:stop] - origin[0]
+                result[next_sample:stop] = origin[1] + np.outer(counts, delta)
+            next_sample = stop
+
+        take_samples(0)
+        minutes = defaultdict(list)
+        for group, run_end in zip(run_starts.tolist(), run_ends.tolist()):
+            first = starts[group]
+            events = tuple(codes[first : first + sizes[group]].tolist())
+            known = minutes[events]
+            while group < run_end:
+                effect = self.find(known)
+                if effect is None:
+                    self.remember(known, self.step(events))
+                    group += 1
+                    take_samples(group)
+                    continue
+
+                count = run_end - group
+                if count > 1:
+                    repeats = effect.get_repeats(self.balances)
+                    if repeats is not None and repeats < count:
+                        count = repeats
+                origin = (group, self.balances.copy())
+                self.apply(effect, count)
+                group += count
+                take_samples(group, origin, effect.delta)
+
+        take_samples(len(starts))
+        result[next_sample:] = self.balances
+        return result
+
+
+def to_minutes(dt):
+    return int(dt.timestamp()) // 60
+
+
+def from_minutes(minutes):
+    return datetime.fromtimestamp(int(minutes) * 60, tz=dt_timezone.utc)
+
+
+def get_sample_times(start, months, period):
+    """
+    The start of every day or month (UTC) after `start` until the start of
+    the month `months` months ahead, as minutes since the epoch.
+    """
+    now = np.datetime64(from_minutes(start).replace(tzinfo=None), "m")
+    month = now.astype("datetime64[M]")
+    if period == "month":
+        samples = np.arange(month + 1, month + months + 1).astype("datetime64[D]")
+    else:
+        samples = np.arange(
+            now.astype("datetime64[D]") + 1,
+            (month + months).astype("datetime64[D]") + 1,
+        )
+    return samples.astype("datetime64[m]").astype(np.int64)
+
+
+def forecast_canvas(canvas_id, now, months=12, period="month"):
+    """
+    Forecast the balance of the main tank and of every tank of the canvas
+    at the start of each day or month until `months` months from now.
+    """
+    start = to_minutes(now)
+    samples = get_sample_times(start, months, period)
+    forecast = CanvasForecast(canvas_id)
+    balances = forecast.run(start, int(samples[-1]), samples)
+
+    nodes = {pk: i + 1 for i, pk in enumerate(forecast.tank_ids)}
+    tanks = list(
+        Tank.objects.filter(canvas_id=canvas_id).values_list(
+            "pk", "external_id", "filled"
+        )
+    )
+    points = []
+    for at, row in zip(samples, balances.tolist()):
+        points.append(
+            {
+                "at": from_minutes(at),
+                "main_tank": row[0],
+                "tanks": {
+                    str(external_id): row[nodes[pk]] if pk in nodes else filled
+                    for pk, external_id, filled in tanks
+                },
+            }
+        )
+    return {
+        "start": now,
+        "end": from_minutes(samples[-1]),
+        "period": period,
+        "points": points,
+    }
@@ -0,0 +1,96 @@
+from collections import defaultdict
+
+from dhanriti.models.tanks import Funnel
+
+
+def get_topological_order(edges):
+    """
+    Order the tanks joined by `edges`, `(in_tank_id, out_tank_id)` pairs,
+    so that every edge runs from an earlier tank to a later one, starting
+    from None (the main tank). Returns None if the edges form a cycle.
+    """
+    outgoing = defaultdict(list)
+    incoming = defaultdict(int)
+    for in_tank_id, out_tank_id in edges:
+        outgoing[in_tank_id].append(out_tank_id)
+        incoming[out_tank_id] += 1
+    tanks = {None, *outgoing, *incoming}
+
+    order = [None] + sorted(
+        tank for tank in tanks if tank is not None and not incoming[tank]
+    )
+    for tank in order:
+        for out_tank_id in outgoing[tank]:
+            incoming[out_tank_id] -= 1
+            if not incoming[out_tank_id]:
+                order.append(out_tank_id)
+    if len(order) < len(tanks):
+        return None
+    return order
+
+
+class FunnelGraph:
+    """
+    The funnels of a canvas as edges between its tanks.
+
+    `edges` maps every funnel to its `(in_tank_id, out_tank_id)`, where an
+    in tank of None is the main tank. `children` maps each tank to the
+    funnels draining it in primary key order, the order cascades run them
+    in, and `order` lists the tanks upstream first (None if the funnels
+    form a cycle, which only canvases from before cycles were rejected
+    can have).
+    """
+
+    __slots__ = ("edges", "children", "order")
+
+    def __init__(self, edges):
+        self.edges = dict(sorted(edges.items()))
+        self.children = {}
+        for pk, (in_tank_id, _) in self.edges.items():
+            self.children.setdefault(in_tank_id, []).append(pk)
+        self.order = get_topological_order(self.edges.values())
+
+    @classmethod
+    def from_funnels(cls, funnels):
+        return cls(
+            {funnel.pk: (funnel.in_tank_id, funnel.out_tank_id) for funnel in funnels}
+        )
+
+    def reaches(self, tank_id, target_id):
+        """
+        Return whether money flowing into `tank_id` can reach `target_id`.
+        """
+        seen = {tank_id}
+        stack = [tank_id]
+        while stack:
+            tank = stack.pop()
+            if tank == target_id:
+                return True
+            for pk in self.children.get(tank, ()):
+                out_tank_id = self.edges[pk][1]
+                if out_tank_id not in seen:
+                    seen.add(out_tank_id)
+                    stack.append(out_tank_id)
+        return False
+
+    def creates_cycle(self, in_tank_id, out_tank_id):
+        """
+        Return whether a new funnel from `in_tank_id` to `out_tank_id` would
+        close a cycle. Nothing flows into the main tank, so funnels out of
+        it never do.
+        """
+        return in_tank_id is not None and self.reaches(out_tank_id, in_tank_id)
+
+
+def get_funnel_graph(canvas_id):
+    """
+    Build the funnel graph of the canvas from its stored funnels, reading
+    only their tank ids.
+    """
+    edges = {
+        pk: (in_tank_id, out_tank_id)
+        for pk, in_tank_id, out_tank_id in Funnel.objects.filter(
+            canvas_id=canvas_id
+        ).values_list("pk", "in_tank_id", "out_tank_id")
+    }
+    return FunnelGraph(edges)
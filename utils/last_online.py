@@ -0,0 +1,114 @@
+import threading
+from datetime import datetime
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.utils import timezone
+
+from dhanriti.models import User
+
+PENDING_KEY = "last_online:pending"
+
+# Guards the read-modify-write of the pending set outside Redis
+pending_lock = threading.Lock()
+
+
+def get_user_key(user_id):
+    return f"last_online:user:{user_id}"
+
+
+def get_redis_client():
+    """
+    Return the Redis client and the pending set key, or None when the
+    default cache is not Redis.
+
+    Without Redis the pending set is read and written whole under
+    `pending_lock`, which is only atomic within one process. That suits
+    the per-process locmem cache, where the flush must also run in the
+    process that buffered the timestamps; buffering across processes
+    needs the Redis cache.
+    """
+    # `cache` is a proxy, so the backend is checked on the handler
+    backend = caches["default"]
+    if not isinstance(backend, RedisCache):
+        return None
+    key = backend.make_key(PENDING_KEY)
+    return backend._cache.get_client(key, write=True), key
+
+
+def add_pending(user_id):
+    if redis := get_redis_client():
+        client, key = redis
+        client.sadd(key, user_id)
+        return
+
+    with pending_lock:
+        pending = cache.get(PENDING_KEY, set())
+        pending.add(user_id)
+        cache.set(PENDING_KEY, pending, timeout=None)
+
+
+def pop_pending():
+    if redis := get_redis_client():
+        client, key = redis
+        pipeline = client.pipeline()
+        pipeline.smembers(key)
+        pipeline.delete(key)
+        members, _ = pipeline.execute()
+        return {int(member) for member in members}
+
+    with pending_lock:
+        pending = cache.get(PENDING_KEY, set())
+        cache.delete(PENDING_KEY)
+    return pending
+
+
+def record_last_online(user, now=None):
+    """
+    Note that `user` was seen at `now`.
+
+    Nothing is written while the stored value is younger than
+    LAST_ONLINE_UPDATE_INTERVAL. Otherwise only the last_online column is
+    updated, or, with LAST_ONLINE_BUFFERED, the timestamp is parked in the
+    cache for flush_last_online to write in bulk.
+    """
+    now = now or timezone.now()
+    interval = settings.LAST_ONLINE_UPDATE_INTERVAL
+    if user.last_online and (now - user.last_online).total_seconds() < interval:
+        return
+
+    if settings.LAST_ONLINE_BUFFERED:
+        # Only the first request of each interval reaches the pending set
+        if cache.add(get_user_key(user.pk), now.timestamp(), timeout=interval):
+            add_pending(user.pk)
+        return
+
+    User.objects.filter(pk=user.pk).update(last_online=now)
+    user.last_online = now
+
+
+def flush_last_online():
+    """
+    Write buffered last_online timestamps with one bulk UPDATE.
+    """
+    user_ids = pop_pending()
+    if not user_ids:
+        return 0
+
+    timestamps = cache.get_many([get_user_key(user_id) for user_id in user_ids])
+    users = []
+    for user_id in user_ids:
+        timestamp = timestamps.get(get_user_key(user_id))
+        if timestamp is None:
+            continue
+        users.append(
+            User(
+                pk=user_id,
+                last_online=datetime.fromtimestamp(timestamp, tz=dt_timezone.utc),
+            )
+        )
+
+    User.objects.bulk_update(users, ["last_online"], batch_size=500)
+    return len(users)
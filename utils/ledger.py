@@ -0,0 +1,244 @@
+import logging
+from uuid import uuid4
+
+from django.db.models import Max, Q, Sum
+from django.utils import timezone
+
+from dhanriti.models.enums import AccountType, EntryType
+from dhanriti.models.ledger import BalanceSnapshot, LedgerEntry
+from utils.locks import CanvasBusy, canvas_lock
+
+logger = logging.getLogger(__name__)
+
+
+def movement(canvas_id, source, destination, amount, entry_type, at, **links):
+    """
+    Return the two entries moving `amount` from the `source` account to the
+    `destination` account, each given as `(account_type, account_id)`.
+    """
+    journal = uuid4()
+    return [
+        LedgerEntry(
+            canvas_id=canvas_id,
+            journal=journal,
+            account_type=account_type,
+            account_id=account_id,
+            entry_type=entry_type,
+            amount=sign * amount,
+            created_at=at,
+            **links,
+        )
+        for (account_type, account_id), sign in ((source, -1), (destination, 1))
+    ]
+
+
+def flow_entries(flow, canvas_id):
+    if not flow.flowed:
+        return []
+    if flow.funnel_id is None:
+        return movement(
+            canvas_id,
+            (AccountType.EXTERNAL, canvas_id),
+            (AccountType.CANVAS, canvas_id),
+            flow.flowed,
+            EntryType.INFLOW,
+            flow.created_at,
+            flow=flow,
+        )
+
+    if flow.in_tank_id:
+        source = (AccountType.TANK, flow.in_tank_id)
+    else:
+        source = (AccountType.CANVAS, canvas_id)
+    return movement(
+        canvas_id,
+        source,
+        (AccountType.TANK, flow.out_tank_id),
+        flow.flowed,
+        EntryType.FLOW,
+        flow.created_at,
+        flow=flow,
+    )
+
+
+def payment_entries(payment, canvas_id):
+    return movement(
+        canvas_id,
+        (AccountType.TANK, payment.tank_id),
+        (AccountType.EXTERNAL, canvas_id),
+        payment.amount,
+        EntryType.PAYMENT,
+        payment.created_at,
+        payment=payment,
+    )
+
+
+def adjustment_entries(canvas_id, account, amount, at):
+    """
+    Money added to (or with a negative `amount` taken from) `account` from
+    outside the canvas, for balances that are set by hand or reconciled.
+    """
+    if not amount:
+        return []
+    return movement(
+        canvas_id,
+        (AccountType.EXTERNAL, canvas_id),
+        account,
+        amount,
+        EntryType.ADJUSTMENT,
+        at,
+    )
+
+
+def tank_deletion_entries(tank, discard=False):
+    """
+    The balance of a deleted tank goes back to the main tank, or out of the
+    canvas when it is discarded.
+    """
+    if not tank.filled:
+        return []
+    destination = AccountType.EXTERNAL if discard else AccountType.CANVAS
+    return movement(
+        tank.canvas_id,
+        (AccountType.TANK, tank.pk),
+        (destination, tank.canvas_id),
+        tank.filled,
+        EntryType.TANK_DELETION,
+        timezone.now(),
+    )
+
+
+def record_entries(entries):
+    """
+    Insert `entries`. Snapshots of their canvases taken at or after the
+    earliest entry no longer include everything before them and are
+    deleted, which only happens for backdated entries.
+
+    Must be called under the canvas lock of the entries' canvas so that
+    snapshots never miss an entry that is being written.
+    """
+    if not entries:
+        return []
+    LedgerEntry.objects.bulk_create(entries)
+    BalanceSnapshot.objects.filter(
+        canvas_id__in={entry.canvas_id for entry in entries},
+        at__gte=min(entry.created_at for entry in entries),
+    ).delete()
+    return entries
+
+
+def get_snapshot(account_type, account_id, at):
+    return (
+        BalanceSnapshot.objects.filter(
+            account_type=account_type, account_id=account_id, at__lte=at
+        )
+        .order_by("-at")
+        .first()
+    )
+
+
+def get_entries(account_type, account_id, snapshot, until):
+    """
+    Entries of the account after `snapshot` (or all of them when it is
+    None) up to and including `until`.
+    """
+    entries = LedgerEntry.objects.filter(
+        account_type=account_type, account_id=account_id, created_at__lte=until
+    )
+    if snapshot is not None:
+        entries = entries.filter(created_at__gt=snapshot.at)
+    return entries
+
+
+def get_balance(account_type, account_id, at=None):
+    """
+    Balance of the account at `at` (default now): the latest snapshot at or
+    before `at` plus the entries since.
+    """
+    at = at or timezone.now()
+    snapshot = get_snapshot(account_type, account_id, at)
+    total = get_entries(account_type, account_id, snapshot, at).aggregate(
+        total=Sum("amount")
+    )["total"]
+    return (snapshot.balance if snapshot else 0) + (total or 0)
+
+
+def get_balance_range(account_type, account_id, start, end):
+    """
+    Opening and closing balance of the account over (start, end] with the
+    money credited to and debited from it in between, from one snapshot
+    read and one scan of the entries after that snapshot.
+    """
+    snapshot = get_snapshot(account_type, account_id, start)
+    in_range = Q(created_at__gt=start)
+    totals = get_entries(account_type, account_id, snapshot, end).aggregate(
+        before=Sum("amount", filter=~in_range),
+        credits=Sum("amount", filter=in_range & Q(amount__gt=0)),
+        debits=Sum("amount", filter=in_range & Q(amount__lt=0)),
+    )
+    opening = (snapshot.balance if snapshot else 0) + (totals["before"] or 0)
+    credits = totals["credits"] or 0
+    debits = -(totals["debits"] or 0)
+    return {
+        "opening": opening,
+        "credits": credits,
+        "debits": debits,
+        "closing": opening + credits - debits,
+    }
+
+
+def snapshot_canvas(canvas_id, since_entry_id, last_entry_id):
+    """
+    Snapshot every account of the canvas with entries after
+    `since_entry_id`. Returns the number of snapshots written.
+    """
+    with canvas_lock(canvas_id, blocking=False):
+        at = timezone.now()
+        accounts = (
+            LedgerEntry.objects.filter(canvas_id=canvas_id, id__gt=since_entry_id)
+            .values_list("account_type", "account_id")
+            .distinct()
+        )
+        snapshots = [
+            BalanceSnapshot(
+                canvas_id=canvas_id,
+                account_type=account_type,
+                account_id=account_id,
+                at=at,
+                balance=get_balance(account_type, account_id, at),
+                last_entry_id=last_entry_id,
+            )
+            for account_type, account_id in accounts
+        ]
+        BalanceSnapshot.objects.bulk_create(snapshots)
+    return len(snapshots)
+
+
+def take_snapshots():
+    """
+    Snapshot the accounts with entries written since the previous run.
+
+    Canvases that are busy are skipped. Their entries are then read from
+    an older snapshot until the account is written to again, which is
+    slower but still exact.
+    """
+    last_entry_id = LedgerEntry.objects.aggregate(Max("id"))["id__max"]
+    if last_entry_id is None:
+        return 0
+    since_entry_id = (
+        BalanceSnapshot.objects.aggregate(Max("last_entry_id"))["last_entry_id__max"]
+        or 0
+    )
+    canvas_ids = list(
+        LedgerEntry.objects.filter(id__gt=since_entry_id, id__lte=last_entry_id)
+        .values_list("canvas_id", flat=True)
+        .distinct()
+    )
+
+    count = 0
+    for canvas_id in canvas_ids:
+        try:
+            count += snapshot_canvas(canvas_id, since_entry_id, last_entry_id)
+        except CanvasBusy:
+            logger.info(f"Canvas {canvas_id} is busy, not taking balance snapshots")
+    return count
@@ -0,0 +1,68 @@
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+# First key of the two-key advisory locks taken on canvases
+CANVAS_LOCK_CLASS = 0x44484E52
+
+# SQLSTATE lock_not_available, raised when lock_timeout expires
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+class CanvasBusy(Exception):
+    pass
+
+
+def get_lock_key(canvas_id):
+    # pg_advisory_xact_lock(int, int) takes signed 32-bit keys
+    return (canvas_id + 2**31) % 2**32 - 2**31
+
+
+@contextmanager
+def canvas_lock(canvas_id, blocking=True):
+    """
+    Serialize everything that moves money within one canvas.
+
+    Takes a transaction-scoped Postgres advisory lock keyed on the canvas,
+    so the lock is released when the surrounding transaction ends (at the
+    end of the request under ATOMIC_REQUESTS). Locks are reentrant within a
+    connection. A blocking lock waits up to CANVAS_LOCK_TIMEOUT
+    milliseconds; with `blocking=False` it is not waited for at all. Both
+    raise CanvasBusy if the lock is not acquired. Other databases have no
+    advisory locks and are not locked.
+    """
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            acquire(get_lock_key(canvas_id), blocking)
+        yield
+
+
+def acquire(key, blocking):
+    with connection.cursor() as cursor:
+        if not blocking:
+            cursor.execute(
+                "SELECT pg_try_advisory_xact_lock(%s, %s)", [CANVAS_LOCK_CLASS, key]
+            )
+            if not cursor.fetchone()[0]:
+                raise CanvasBusy()
+            return
+
+        # lock_timeout is only lowered for this statement, inside a
+        # savepoint so a timeout does not abort the outer transaction
+        try:
+            with transaction.atomic():
+                cursor.execute(
+                    "SELECT current_setting('lock_timeout'),"
+                    " set_config('lock_timeout', %s, true)",
+                    [f"{settings.CANVAS_LOCK_TIMEOUT}ms"],
+                )
+                previous = cursor.fetchone()[0]
+                cursor.execute(
+                    "SELECT pg_advisory_xact_lock(%s, %s)", [CANVAS_LOCK_CLASS, key]
+                )
+                cursor.execute("SELECT set_config('lock_timeout', %s, true)", [previous])
+        except OperationalError as e:
+            if getattr(e.__cause__, "pgcode", None) == LOCK_NOT_AVAILABLE:
+                raise CanvasBusy() from e
+            raise
@@ -0,0 +1,45 @@
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+_lock = Lock()
+_stats = defaultdict(lambda: {"count": 0, "total": 0.0, "max": 0.0})
+
+
+def record(name, value, **tags):
+    """
+    Record one observation of the metric `name` (milliseconds for timings).
+
+    Observations are logged with their tags and aggregated per process so
+    they can be inspected with get_stats.
+    """
+    with _lock:
+        stats = _stats[name]
+        stats["count"] += 1
+        stats["total"] += value
+        stats["max"] = max(stats["max"], value)
+
+    logger.info(
+        "%s=%.2f %s",
+        name,
+        value,
+        " ".join(f"{key}={tag}" for key, tag in tags.items()),
+    )
+
+
+@contextmanager
+def timed(name, **tags):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - start) * 1000, **tags)
+
+
+def get_stats():
+    with _lock:
+        return {name: dict(stats) for name, stats in _stats.items()}
@@ -1,10 +1,11 @@
 import contextlib
 
-from django.core.cache import cache
-from django.http import HttpResponseForbidden
+from django.conf import settings
+from django.http import HttpResponse
 from django.utils import timezone
 
-from core.settings.base import RATE_LIMIT_ENABLED
+from utils.last_online import record_last_online
+from utils.ratelimit import RateLimiter
 
 
 class TimezoneMiddleware:
@@ -27,8 +28,7 @@ class LastOnlineMiddleware:
         user = request.user
 
         if user.is_authenticated:
-            user.last_online = timezone.now()
-            user.save()
+            record_last_online(user)
 
         return self.get_response(request)
 
@@ -36,19 +36,16 @@ class LastOnlineMiddleware:
 class RateLimitMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
-        self.limit = 50
-        self.window = 3600
+        self.limiter = RateLimiter()
 
     def __call__(self, request):
-        if RATE_LIMIT_ENABLED:
-            cache_key = f'ratelimit:{request.META["REMOTE_ADDR"]}:{request.path}'
+        if settings.RATE_LIMIT_ENABLED:
+            retry_after = self.limiter.hit(request)
 
-            request_count = cache.get(cache_key, 0)
-
-            if request_count >= self.limit:
-                return HttpResponseForbidden("Rate limit exceeded")
-
-            cache.set(cache_key, request_count + 1, self.window)
+            if retry_after is not None:
+                response = HttpResponse("Rate limit exceeded", status=429)
+                response["Retry-After"] = str(retry_after)
+                return response
 
         response = self.get_response(request)
         return response
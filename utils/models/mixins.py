@@ -1,3 +1,8 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+
+
 class ObjectOwnerMixin:
     """
     Restrict access to the endpoint to the owner of the object.
@@ -33,3 +38,54 @@ class PreserveInitialFieldValueMixin:
 
     def get_preserved_fields(self):
         return self._preserved_fields
+
+
+class FilledBalanceMixin:
+    """
+    Mixin for models with a `filled` balance.
+
+    Balances are changed with single `UPDATE ... SET filled = filled + %s`
+    statements so concurrent writers never overwrite each other's deltas.
+    The in-memory `filled` is adjusted by the same amount; use
+    refresh_from_db if the authoritative value is needed.
+    """
+
+    def credit(self, amount):
+        type(self)._base_manager.filter(pk=self.pk).update(
+            filled=F("filled") + amount
+        )
+        self.filled += amount
+
+    def debit(self, amount, guard=False):
+        """
+        With `guard`, the row is locked with SELECT ... FOR UPDATE and a
+        ValidationError is raised instead of overdrawing it.
+        """
+        queryset = type(self)._base_manager.filter(pk=self.pk)
+        with transaction.atomic():
+            if guard:
+                filled = (
+                    queryset.select_for_update().values_list("filled", flat=True).get()
+                )
+                if filled < amount:
+                    raise ValidationError("Insufficient balance")
+                self.filled = filled
+            queryset.update(filled=F("filled") - amount)
+        self.filled -= amount
+
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """
+        Add each amount in `deltas` ({pk: amount}) to the matching row's
+        balance with one UPDATE statement.
+        """
+        deltas = {pk: amount for pk, amount in deltas.items() if amount}
+        if not deltas:
+            return 0
+        return cls._base_manager.filter(pk__in=deltas).update(
+            filled=F("filled")
+            + Case(
+                *[When(pk=pk, then=Value(amount)) for pk, amount in deltas.items()],
+                output_field=FloatField(),
+            )
+        )
@@ -1,5 +1,11 @@
-from rest_framework.pagination import LimitOffsetPagination
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomLimitOffsetPagination(LimitOffsetPagination):
@@ -16,3 +22,114 @@ class CustomLimitOffsetPagination(LimitOffsetPagination):
                 "results": data,
             }
         )
+
+
+class CreatedAtCursorPagination(BasePagination):
+    """
+    Keyset pagination over `(created_at, id)`, newest first.
+
+    Pages are fetched with a `(created_at, id) < cursor` range condition
+    instead of OFFSET, and no COUNT(*) is issued, so deep pages cost the
+    same as the first one.
+    """
+
+    page_size = 10
+    max_page_size = 30
+    page_size_query_param = "limit"
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        if cursor is None:
+            reverse = False
+        else:
+            reverse, created_at, pk = cursor
+            if reverse:
+                queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+                )
+
+        ordering = ("created_at", "id") if reverse else ("-created_at", "-id")
+        results = list(queryset.order_by(*ordering)[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_previous = has_more
+            self.has_next = True
+        else:
+            self.has_previous = cursor is not None
+            self.has_next = has_more
+
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            reverse, created_at, pk = (
+                urlsafe_b64decode(encoded.encode("ascii")).decode("ascii").split("|")
+            )
+            created_at = datetime.fromisoformat(created_at)
+            return bool(int(reverse)), created_at, int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj, reverse):
+        cursor = f"{int(reverse)}|{obj.created_at.isoformat()}|{obj.pk}"
+        encoded = urlsafe_b64encode(cursor.encode("ascii")).decode("ascii")
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, encoded
+        )
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "has_previous": self.has_previous,
+                "has_next": self.has_next,
+                "previous": self.get_previous_link(),
+                "next": self.get_next_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "has_previous": {"type": "boolean"},
+                "has_next": {"type": "boolean"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
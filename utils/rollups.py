@@ -0,0 +1,70 @@
+from collections import defaultdict
+
+from django.db import connection
+from django.utils import timezone
+
+from dhanriti.models.enums import RollupPeriod, RollupScope
+from dhanriti.models.rollups import FlowRollup
+
+# Columns summed into a rollup, in the order of the totals below
+TOTAL_FIELDS = ("flowed", "count", "manual_count", "reduced_count")
+
+
+def get_buckets(at):
+    day = timezone.localtime(at).date()
+    return ((RollupPeriod.DAY, day), (RollupPeriod.MONTH, day.replace(day=1)))
+
+
+def get_scopes(flow, canvas_id):
+    if flow.funnel_id is None:
+        return ((RollupScope.CANVAS, canvas_id),)
+    return ((RollupScope.TANK, flow.out_tank_id), (RollupScope.FUNNEL, flow.funnel_id))
+
+
+def rollup_flows(flows, canvas_id):
+    """
+    Return `{(scope, scope_id, period, bucket): totals}` for `flows`, with
+    totals listed as in TOTAL_FIELDS. A flow counts as reduced when the
+    engine cut it short (it has a reduce reason).
+    """
+    totals = defaultdict(lambda: [0.0, 0, 0, 0])
+    for flow in flows:
+        reduced = bool(flow.meta and flow.meta.get("reduced_reason"))
+        for scope, scope_id in get_scopes(flow, canvas_id):
+            for period, bucket in get_buckets(flow.created_at):
+                row = totals[(scope, scope_id, period, bucket)]
+                row[0] += flow.flowed or 0
+                row[1] += 1
+                row[2] += flow.manual
+                row[3] += reduced
+    return totals
+
+
+def add_to_rollups(canvas_id, totals):
+    """
+    Add `totals` (as returned by rollup_flows) to the rollup rows with one
+    INSERT ... ON CONFLICT DO UPDATE, creating the rows that are missing.
+    """
+    if not totals:
+        return
+    table = connection.ops.quote_name(FlowRollup._meta.db_table)
+    columns = ("canvas_id", "scope", "scope_id", "period", "bucket") + TOTAL_FIELDS
+    row = f"({', '.join(['%s'] * len(columns))})"
+    params = []
+    for key, values in totals.items():
+        params += [canvas_id, *key, *values]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} AS rollup ({', '.join(columns)})"
+            f" VALUES {', '.join([row] * len(totals))}"
+            " ON CONFLICT (scope, scope_id, period, bucket) DO UPDATE SET "
+            + ", ".join(
+                f"{field} = rollup.{field} + EXCLUDED.{field}" for field in TOTAL_FIELDS
+            ),
+            params,
+        )
+
+
+def update_rollups(flows, canvas_id):
+    add_to_rollups(canvas_id, rollup_flows(flows, canvas_id))
@@ -1,63 +1,109 @@
-import requests
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+
 from rest_framework import serializers
 
-from core.settings.base import CDN_KEY
-from dhanriti.models.enums import UploadType
+from .cdn import CDNError, get_cdn_client, get_file_name
+
+# Parsed text is handed to the validator in chunks of this many characters
+FEED_CHUNK_SIZE = 64 * 1024
 
-from .helpers import check_unclosed_tags
 
+class HTMLValidator(HTMLParser):
+    """
+    Validates rich-text HTML in a single streaming pass.
 
-def verify_html(self, value, part_id):
-    allowed_tags = ["div", "br", "i", "b", "strike", "u", "img"]
-    allowed_attributes = {
-        "*": ["style"],
-        "img": ["src"],
-    }
+    Checks the tag and attribute whitelists, the style properties and that
+    every tag is closed in order, and collects the file names of all images.
+    Only the stack of open tags and the image names are kept in memory.
+    """
 
-    verified_content = check_unclosed_tags(value)
-    if not verified_content:
-        raise serializers.ValidationError("Invalid HTML: Some tags are not closed")
+    allowed_tags = {"div", "br", "i", "b", "strike", "u", "img"}
+    void_tags = {"br", "img"}
+    allowed_attributes = {"style"}
+    allowed_style_properties = ("text-align",)
 
-    soup = BeautifulSoup(value, "html.parser")
-    for tag in soup.find_all(True):
-        if tag.name not in allowed_tags:
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.open_tags = []
+        self.file_names = []
+
+    def check_tag(self, tag, attrs):
+        if tag not in self.allowed_tags:
             raise serializers.ValidationError("Invalid HTML tag")
 
-        # check for attributes
-        for attr in tag.attrs:
+        src = None
+        for attr, value in attrs:
             if attr == "src":
+                src = value
                 continue
-            if attr not in allowed_attributes.get("*", []):
+            if attr not in self.allowed_attributes:
                 raise serializers.ValidationError("Invalid HTML attribute for tag")
+            if attr == "style":
+                self.check_style(value or "")
 
-        if tag.name == "img":
-            src = tag.get("src")
-            file_name = str(src.split("media/")[-1].split(".")[0].split("_")[0])
-            req_headers = {
-                "Authorization": f"Bearer {CDN_KEY}",
-            }
-            response = requests.get(
-                f"https://cdn.dhanriti.net/info?f={file_name}",
-                timeout=5,
-                headers=req_headers,
-            )
-            if response.status_code != 200:
+        if tag == "img":
+            if not src:
                 raise serializers.ValidationError("Invalid image URL")
-            else:
-                response_json = response.json()
-                meta = response_json.get("meta")
-
-                if meta.get("type") != UploadType.STORY_CONTENT or str(
-                    meta.get("part")
-                ) != str(part_id):
-                    raise serializers.ValidationError("Invalid image URL")
-
-    for tag in soup.find_all(attrs={"style": True}):
-        style = tag["style"]
-        properties = style.split(";")
-        for prop in properties:
-            if prop.strip() and not prop.strip().startswith("text-align"):
+            self.file_names.append(get_file_name(src))
+
+    def check_style(self, style):
+        for prop in style.split(";"):
+            prop = prop.strip()
+            if prop and not prop.startswith(self.allowed_style_properties):
                 raise serializers.ValidationError(
                     "Style attribute contains an invalid property"
                 )
+
+    def handle_starttag(self, tag, attrs):
+        self.check_tag(tag, attrs)
+        if tag not in self.void_tags:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.check_tag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in self.void_tags:
+            return
+        if not self.open_tags or self.open_tags[-1] != tag:
+            raise serializers.ValidationError("Invalid HTML: Some tags are not closed")
+        self.open_tags.pop()
+
+    def close(self):
+        super().close()
+        if self.open_tags:
+            raise serializers.ValidationError("Invalid HTML: Some tags are not closed")
+
+
+def validate_html(value):
+    """
+    Run `value` through the streaming validator and return the file names
+    of the images it references.
+    """
+    validator = HTMLValidator()
+    for start in range(0, len(value), FEED_CHUNK_SIZE):
+        validator.feed(value[start : start + FEED_CHUNK_SIZE])
+    validator.close()
+    return validator.file_names
+
+
+def verify_html(value, type, part_id):
+    """
+    Validate rich-text HTML whose images must be CDN uploads of `type`
+    belonging to `part_id`.
+    """
+    file_names = validate_html(value)
+
+    # Network lookups last, and as one concurrent round for every image
+    try:
+        infos = get_cdn_client().get_many(file_names)
+    except CDNError as e:
+        raise serializers.ValidationError("Unable to verify image URL : " + str(e))
+
+    for response_json in infos.values():
+        if response_json is None:
+            raise serializers.ValidationError("Invalid image URL")
+        meta = response_json.get("meta")
+
+        if meta.get("type") != type or str(meta.get("part")) != str(part_id):
+            raise serializers.ValidationError("Invalid image URL")
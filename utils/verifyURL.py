@@ -1,32 +1,22 @@
-import requests
 from rest_framework import serializers
 
-from core.settings.base import CDN_KEY
+from utils.cdn import CDNError, get_cdn_client, get_file_name
 
 
 def validate_image(url, type, validations):
-    req_headers = {
-        "Authorization": f"Bearer {CDN_KEY}",
-    }
-
     if url and not url.startswith("https://cdn.dhanriti.net/media/"):
         raise serializers.ValidationError({"cover": "Invalid cover url"})
 
-    img_name = str(url.split("media/")[-1].split(".")[0].split("_")[0])
+    img_name = get_file_name(url)
 
     try:
-        img_url_response = requests.get(
-            f"https://cdn.dhanriti.net/info?f={img_name}",
-            timeout=5,
-            headers=req_headers,
-        )
-        img_url_json = img_url_response.json()
-    except Exception as e:
+        img_url_json = get_cdn_client().get_info(img_name)
+    except CDNError as e:
         raise serializers.ValidationError({"cover": "Unable to verify URL : " + str(e)})
 
     validation_keys = validations.keys()
 
-    if img_url_response.status_code != 200:
+    if img_url_json is None:
         raise serializers.ValidationError({"cover": "Invalid url"})
 
     meta = img_url_json.get("meta")
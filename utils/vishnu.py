@@ -0,0 +1,138 @@
+import time
+from threading import Lock
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.metrics import timed
+
+
+class VishnuUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for `reset_timeout` seconds after
+    `failure_threshold` consecutive failures, then lets a trial call
+    through.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half open: the next result decides whether to close
+                self.opened_at = None
+                self.failures = self.failure_threshold - 1
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class VishnuClient:
+    """
+    Client for the Vishnu identity provider.
+
+    Keeps a pooled keep-alive session, bounds every call with connect and
+    read timeouts, retries connection failures and idempotent requests
+    with backoff, and short-circuits while Vishnu keeps failing.
+    """
+
+    def __init__(
+        self,
+        host=None,
+        api_key=None,
+        connect_timeout=None,
+        read_timeout=None,
+        retries=None,
+        backoff_factor=None,
+        failure_threshold=None,
+        reset_timeout=None,
+    ):
+        self.host = host or settings.VISHNU_HOST
+        self.timeout = (
+            connect_timeout or settings.VISHNU_CONNECT_TIMEOUT,
+            read_timeout or settings.VISHNU_READ_TIMEOUT,
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold or settings.VISHNU_CIRCUIT_FAILURES,
+            reset_timeout or settings.VISHNU_CIRCUIT_RESET,
+        )
+
+        # Connection errors are retried for every method since the request
+        # never reached Vishnu; read errors and 5xx only for GET
+        retry = Retry(
+            total=settings.VISHNU_RETRIES if retries is None else retries,
+            backoff_factor=(
+                settings.VISHNU_BACKOFF if backoff_factor is None else backoff_factor
+            ),
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["X-API-KEY"] = api_key or settings.VISHNU_API_KEY or ""
+
+    def request(self, method, path, **kwargs):
+        if not self.breaker.allow():
+            raise VishnuUnavailable("Vishnu is unavailable")
+
+        try:
+            with timed("vishnu.latency", method=method, path=path):
+                response = self.session.request(
+                    method, self.host + path, timeout=self.timeout, **kwargs
+                )
+        except requests.exceptions.RequestException as e:
+            self.breaker.record_failure()
+            raise VishnuUnavailable("Could not connect to Vishnu") from e
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            raise VishnuUnavailable(f"Vishnu responded with {response.status_code}")
+
+        self.breaker.record_success()
+        return response
+
+    def get_user_by_token(self, token):
+        return self.request("GET", "/users/token", params={"token": token}).json()
+
+    def create_service_token(self, success_url, failure_url):
+        return self.request(
+            "POST",
+            "/servicetoken",
+            data={"success_url": success_url, "failure_url": failure_url},
+        ).json()
+
+
+_client = None
+
+
+def get_vishnu_client():
+    global _client
+    if _client is None:
+        _client = VishnuClient()
+    return _client